@@ -0,0 +1,554 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from instrumentation import RunRecorder, peak_rss_mb
+
+SAMPLE_GRIB2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'usa_data.grib2')
+
+DEFAULT_CONFIG = {
+    'radar_files': 2,
+    'sweeps': 3,
+    'rays': 360,
+    'gates': 960,
+    'grib2_files': 2,
+    'grib2_shape': (700, 350),  # (nx, ny), the full MRMS CONUS grid is (7000, 3500)
+    'compare_pairs': 4,
+    'compare_size': (512, 512),
+    'reorganize_frames': 58,
+    'seed': 0,
+    # Converter options of the radar_to_cartesian and grib2_to_png benchmarks
+    'engine': 'agg',
+    'precision': 'float32',
+    'dpi': 300,
+    'size': None,
+}
+
+def _storm_field(shape, rng, n_cells=6):
+    """
+    Smooth reflectivity-like field (dBZ) made of gaussian storm cells
+    """
+    ny, nx = shape
+    yy, xx = np.mgrid[0:ny, 0:nx]
+    field = np.full(shape, -10.0)
+    for _ in range(n_cells):
+        cy, cx = rng.uniform(0, ny), rng.uniform(0, nx)
+        sy, sx = rng.uniform(0.02, 0.1) * ny, rng.uniform(0.02, 0.1) * nx
+        peak = rng.uniform(30, 65)
+        field = np.maximum(field, peak * np.exp(-((yy - cy) ** 2 / (2 * sy ** 2) + (xx - cx) ** 2 / (2 * sx ** 2))) - 10)
+    return field + rng.normal(0, 1.5, shape)
+
+def make_synthetic_radar(file_path, sweeps=9, rays=360, gates=960, variables=('DBZH',), seed=0,
+                         start_time=datetime(2024, 12, 22, 15, 0, 0)):
+    """
+    Write a CfRadial-style NetCDF volume laid out like the KMA RDR_SSP files
+
+    Every variable is stored as int16 with scale_factor 0.01 on the flat
+    n_points dimension (ray-major), about 10% of the gates are missing.
+
+    Parameters:
+    file_path (str): Path of the NetCDF file to create
+    sweeps (int): Number of sweeps
+    rays (int): Number of rays per sweep
+    gates (int): Number of range gates per ray
+    variables (tuple): Names of the moment variables to write
+    seed (int): Random seed
+    start_time (datetime): Volume start time
+
+    Returns:
+    str: Path to the generated file
+    """
+    import netCDF4 as nc
+
+    rng = np.random.default_rng(seed)
+    n_rays = sweeps * rays
+
+    with nc.Dataset(file_path, 'w') as ds:
+        ds.Conventions = 'Cf/Radial'
+        ds.title = 'synthetic volume'
+        ds.time_coverage_start = start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+        ds.time_coverage_end = (start_time + timedelta(seconds=n_rays // 10)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        ds.createDimension('time', n_rays)
+        ds.createDimension('range', gates)
+        ds.createDimension('sweep', sweeps)
+        ds.createDimension('n_points', n_rays * gates)
+
+        time_var = ds.createVariable('time', 'f8', ('time',))
+        time_var.units = f"seconds since {start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+        time_var[:] = np.arange(n_rays) / 10.0
+
+        range_var = ds.createVariable('range', 'f4', ('range',))
+        range_var.units = 'meters'
+        range_var[:] = 125.0 + 250.0 * np.arange(gates)
+
+        azimuth = ds.createVariable('azimuth', 'f4', ('time',))
+        azimuth.units = 'degrees'
+        azimuth[:] = np.tile((np.arange(rays) + 0.5) * 360.0 / rays, sweeps)
+
+        fixed_angles = np.round(np.linspace(0.5, 0.5 + 1.5 * (sweeps - 1), sweeps), 2)
+        elevation = ds.createVariable('elevation', 'f4', ('time',))
+        elevation.units = 'degrees'
+        elevation[:] = np.repeat(fixed_angles, rays)
+
+        fixed_angle = ds.createVariable('fixed_angle', 'f4', ('sweep',))
+        fixed_angle[:] = fixed_angles
+
+        start_index = ds.createVariable('sweep_start_ray_index', 'i4', ('sweep',))
+        start_index[:] = np.arange(sweeps) * rays
+        end_index = ds.createVariable('sweep_end_ray_index', 'i4', ('sweep',))
+        end_index[:] = np.arange(sweeps) * rays + rays - 1
+
+        for name in variables:
+            var = ds.createVariable(name, 'i2', ('n_points',), fill_value=-32768, zlib=True)
+            var.scale_factor = 0.01
+            var.add_offset = 0.0
+            var.coordinates = 'elevation azimuth range'
+            var.units = 'dBZ'
+            values = np.concatenate([_storm_field((rays, gates), rng).ravel() for _ in range(sweeps)])
+            missing = rng.random(values.size) < 0.1
+            var[:] = np.ma.masked_array(np.clip(values, -30, 90), mask=missing)
+
+    return file_path
+
+def make_synthetic_grib2(file_path, nx=700, ny=350, messages=1, seed=0, template=SAMPLE_GRIB2):
+    """
+    Write a GRIB2 file with synthetic fields on a regular lat/lon grid
+
+    The bundled MRMS sample is used as a message template; only the grid
+    size and the values are replaced (0.01 degree spacing is kept).
+
+    Parameters:
+    file_path (str): Path of the GRIB2 file to create
+    nx (int): Number of grid points along a parallel
+    ny (int): Number of grid points along a meridian
+    messages (int): Number of messages in the file
+    seed (int): Random seed
+    template (str): GRIB2 file whose first message is used as template
+
+    Returns:
+    str: Path to the generated file
+    """
+    import pygrib
+
+    rng = np.random.default_rng(seed)
+    grbs = pygrib.open(template)
+    try:
+        grb = grbs[1]
+        lat_first = grb['latitudeOfFirstGridPointInDegrees']
+        lon_first = grb['longitudeOfFirstGridPointInDegrees']
+        d_lat = grb['jDirectionIncrementInDegrees']
+        d_lon = grb['iDirectionIncrementInDegrees']
+
+        grb['Ni'] = nx
+        grb['Nj'] = ny
+        grb['latitudeOfLastGridPointInDegrees'] = lat_first - (ny - 1) * d_lat
+        grb['longitudeOfLastGridPointInDegrees'] = lon_first + (nx - 1) * d_lon
+
+        with open(file_path, 'wb') as f:
+            for _ in range(messages):
+                # Precipitation-rate-like field: mostly zero with a few rain cells
+                field = np.clip(_storm_field((ny, nx), rng) / 10.0, 0, None)
+                grb.values = np.round(field, 1)
+                f.write(grb.tostring())
+    finally:
+        grbs.close()
+    return file_path
+
+def make_synthetic_png(file_path, size=(512, 512), seed=0):
+    """
+    Write a grayscale PNG looking like a rendered reflectivity frame
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    field = _storm_field((size[1], size[0]), rng)
+    pixels = np.clip((field + 20) * 255 / 100, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(file_path)
+    return file_path
+
+def _result(recorder, files, input_bytes, seconds):
+    return {
+        'files': files,
+        'input_mb': input_bytes / (1024 * 1024),
+        'seconds': seconds,
+        'files_per_s': files / seconds if seconds > 0 else None,
+        'mb_per_s': input_bytes / (1024 * 1024) / seconds if seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': recorder.summary()['stages'],
+    }
+
+def _render_options(config):
+    """
+    Converter options of the engine/precision under test (size: converter default if None)
+    """
+    options = {'engine': config['engine'], 'precision': config['precision'], 'dpi': config['dpi']}
+    if config['size'] is not None:
+        options['size'] = config['size']
+    return options
+
+def bench_radar_to_cartesian(work_dir, config):
+    """
+    Time radar_to_cartesian on synthetic volumes, with the stages it records
+    """
+    from nc_to_png_all import radar_to_cartesian
+
+    input_dir = os.path.join(work_dir, 'radar_nc')
+    output_dir = os.path.join(work_dir, 'radar_png')
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = []
+    for i in range(config['radar_files']):
+        time_point = datetime(2024, 12, 22, 15, 0) + timedelta(minutes=5 * i)
+        path = os.path.join(input_dir, f"RDR_SSP_FQC_{time_point.strftime('%Y%m%d%H%M')}.nc")
+        files.append(make_synthetic_radar(path, config['sweeps'], config['rays'], config['gates'],
+                                          seed=config['seed'] + i, start_time=time_point))
+
+    recorder = RunRecorder(verbosity='quiet')
+    start = time.perf_counter()
+    for path in files:
+        radar_to_cartesian(path, output_dir, recorder=recorder, **_render_options(config))
+    seconds = time.perf_counter() - start
+
+    return _result(recorder, len(files), sum(os.path.getsize(p) for p in files), seconds)
+
+def bench_grib2_to_png(work_dir, config):
+    """
+    Time grib2_to_png on synthetic grids, with the stages it records
+    """
+    from grib2_to_png import grib2_to_png
+
+    input_dir = os.path.join(work_dir, 'grib2')
+    output_dir = os.path.join(work_dir, 'grib2_png')
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    nx, ny = config['grib2_shape']
+    files = [make_synthetic_grib2(os.path.join(input_dir, f'synthetic_{i:03d}.grib2'), nx, ny,
+                                  seed=config['seed'] + i)
+             for i in range(config['grib2_files'])]
+
+    recorder = RunRecorder(verbosity='quiet')
+    start = time.perf_counter()
+    for path in files:
+        grib2_to_png(path, os.path.join(output_dir, os.path.basename(path) + '.png'), recorder=recorder,
+                     **_render_options(config))
+    seconds = time.perf_counter() - start
+
+    return _result(recorder, len(files), sum(os.path.getsize(p) for p in files), seconds)
+
+def bench_compare_png(work_dir, config):
+    """
+    Time image loading and pixel statistics of compare_png on synthetic pairs
+    """
+    import compare_png
+
+    input_dir = os.path.join(work_dir, 'compare')
+    os.makedirs(input_dir, exist_ok=True)
+
+    pairs = []
+    for i in range(config['compare_pairs']):
+        seed = config['seed'] + 2 * i
+        pairs.append((make_synthetic_png(os.path.join(input_dir, f'a_{i:03d}.png'), config['compare_size'], seed),
+                      make_synthetic_png(os.path.join(input_dir, f'b_{i:03d}.png'), config['compare_size'], seed + 1)))
+
+    recorder = RunRecorder(verbosity='quiet')
+    start = time.perf_counter()
+    for path_a, path_b in pairs:
+        with recorder.stage('decode'):
+            img_a = compare_png.load_and_process_image(path_a, config['compare_size'])
+            img_b = compare_png.load_and_process_image(path_b, config['compare_size'])
+        with recorder.stage('compare'):
+            compare_png.calculate_pixel_statistics(img_a, img_b)
+    seconds = time.perf_counter() - start
+
+    input_bytes = sum(os.path.getsize(p) for pair in pairs for p in pair)
+    return _result(recorder, 2 * len(pairs), input_bytes, seconds)
+
+def bench_reorganize_radar_files(work_dir, config):
+    """
+    Time png_reorganizer on synthetic sweep frames (two sweeps per time point)
+    """
+    from png_reorganizer import reorganize_radar_files
+
+    source_dir = os.path.join(work_dir, 'frames')
+    target_dir = os.path.join(work_dir, 'cases')
+    os.makedirs(source_dir, exist_ok=True)
+
+    template = make_synthetic_png(os.path.join(work_dir, 'frame_template.png'), (256, 256), config['seed'])
+    files = []
+    for i in range(config['reorganize_frames']):
+        time_point = (datetime(2025, 1, 8, 0, 0) + timedelta(minutes=5 * i)).strftime('%Y%m%d%H%M')
+        for sweep_idx in range(2):
+            path = os.path.join(source_dir, f'RDR_SSP_FQC_{time_point}_sweep_{sweep_idx}.png')
+            shutil.copyfile(template, path)
+            files.append(path)
+
+    recorder = RunRecorder(verbosity='quiet')
+    start = time.perf_counter()
+    with recorder.stage('write'):
+        reorganize_radar_files(source_dir, target_dir, recorder=recorder)
+    seconds = time.perf_counter() - start
+
+    return _result(recorder, len(files), sum(os.path.getsize(p) for p in files), seconds)
+
+BENCHMARKS = {
+    'radar_to_cartesian': bench_radar_to_cartesian,
+    'grib2_to_png': bench_grib2_to_png,
+    'compare_png': bench_compare_png,
+    'reorganize_radar_files': bench_reorganize_radar_files,
+}
+
+def _run_one(name, config, work_dir):
+    case_dir = os.path.join(work_dir, name)
+    os.makedirs(case_dir, exist_ok=True)
+    return BENCHMARKS[name](case_dir, config)
+
+def run_benchmarks(names=None, config=None, label=None, results_dir='benchmark_results', work_dir=None):
+    """
+    Run the benchmark suite and store the results as JSON
+
+    Each benchmark runs in a fresh process so that peak RSS is measured
+    per pipeline.
+
+    Parameters:
+    names (list): Benchmarks to run (default: all of BENCHMARKS)
+    config (dict): Overrides for DEFAULT_CONFIG (e.g. {'engine': 'raster', 'precision': 'packed'}
+        to time the converters with another engine or precision)
+    label (str): Name of the result file (default: current timestamp)
+    results_dir (str): Directory to store result files
+    work_dir (str): Directory for fixtures and outputs (default: temporary)
+
+    Returns:
+    dict: Benchmark results
+    """
+    names = names or list(BENCHMARKS)
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    label = label or datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    results = {
+        'label': label,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'config': config,
+        'benchmarks': {},
+    }
+
+    temp_dir = None
+    if work_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='converter_bench_')
+        work_dir = temp_dir.name
+    try:
+        context = multiprocessing.get_context('spawn')
+        for name in names:
+            print(f"Running benchmark: {name}")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(_run_one, name, config, work_dir).result()
+            results['benchmarks'][name] = result
+            print(f"  {result['files']} files in {result['seconds']:.2f}s "
+                  f"({result['files_per_s']:.2f} files/s, {result['mb_per_s']:.2f} MB/s)")
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    os.makedirs(results_dir, exist_ok=True)
+    result_path = os.path.join(results_dir, f'{label}.json')
+    with open(result_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {result_path}")
+    return results
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(baseline, current, tolerance=0.10):
+    """
+    Compare two benchmark results and report regressions
+
+    Parameters:
+    baseline (dict or str): Baseline results or path to a result file
+    current (dict or str): Current results or path to a result file
+    tolerance (float): Allowed relative slowdown before reporting a regression
+
+    Returns:
+    list: (benchmark, metric, baseline value, current value) of each regression
+    """
+    if isinstance(baseline, str):
+        baseline = load_results(baseline)
+    if isinstance(current, str):
+        current = load_results(current)
+
+    print(f"Comparing {current['label']} against {baseline['label']}")
+    regressions = []
+    for name, cur in current['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            print(f"{name}: no baseline")
+            continue
+
+        print(f"\n{name}:")
+        checks = [('files_per_s', base['files_per_s'], cur['files_per_s'], True),
+                  ('peak_rss_mb', base['peak_rss_mb'], cur['peak_rss_mb'], False)]
+        for stage, stats in cur['stages'].items():
+            if stage in base['stages']:
+                checks.append((f'{stage}.mean_s', base['stages'][stage]['mean_s'], stats['mean_s'], False))
+
+        for metric, old, new, higher_is_better in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            flag = '  <-- regression' if regressed else ''
+            print(f"  {metric}: {old:.4f} -> {new:.4f} ({change:+.1%}){flag}")
+            if regressed:
+                regressions.append((name, metric, old, new))
+
+    return regressions
+
+def check_precision_equivalence(work_dir=None, engines=('raster', 'agg'), dpi=50, size=512, sweeps=3, seed=0):
+    """
+    Check that the float32 and packed paths render pixel-identical frames to float64
+
+    Renders a synthetic DBZH volume (int16, scale 0.01, covering the whole
+    -20 ~ 80 dBZ profile) with every precision and engine, and a synthetic
+    GRIB2 field with float32 and float64, as uint8 npy frames.
+
+    Returns:
+    dict: Number of differing pixels per (engine, precision); raises
+        AssertionError if any frame differs
+    """
+    import nc_to_png_all
+    import grib2_to_png
+
+    if work_dir is None:
+        with tempfile.TemporaryDirectory(prefix='precision_check_') as temp_dir:
+            return check_precision_equivalence(temp_dir, engines, dpi, size, sweeps, seed)
+    radar_path = make_synthetic_radar(os.path.join(work_dir, 'RDR_check.nc'), sweeps=sweeps, seed=seed)
+    grib2_path = make_synthetic_grib2(os.path.join(work_dir, 'check.grib2'), seed=seed)
+    recorder = RunRecorder(verbosity='warning')
+
+    def frames(output_dir):
+        return {name: np.load(os.path.join(output_dir, name)) for name in sorted(os.listdir(output_dir))}
+
+    differences = {}
+    for engine in engines:
+        reference = None
+        for precision in ('float64', 'float32', 'packed'):
+            output_dir = os.path.join(work_dir, f'radar_{engine}_{precision}')
+            os.makedirs(output_dir, exist_ok=True)
+            nc_to_png_all.radar_to_cartesian(radar_path, output_dir, recorder=recorder, engine=engine,
+                                             output_format='npy', dpi=dpi, size=size, precision=precision)
+            current = frames(output_dir)
+            if reference is None:
+                reference = current
+                continue
+            differences[('radar', engine, precision)] = sum(
+                int(np.count_nonzero(reference[name] != current.get(name, -1))) for name in reference)
+
+        reference = None
+        for precision in ('float64', 'float32'):
+            output_path = os.path.join(work_dir, f'grib2_{engine}_{precision}.npy')
+            grib2_to_png.grib2_to_png(grib2_path, output_path, recorder=recorder, engine=engine,
+                                      output_format='npy', dpi=dpi, size=size, precision=precision)
+            current = np.load(output_path)
+            if reference is None:
+                reference = current
+                continue
+            differences[('grib2', engine, precision)] = int(np.count_nonzero(reference != current))
+
+    for key, count in differences.items():
+        print(f"{' '.join(key):<24} {count} differing pixels")
+    failed = {key: count for key, count in differences.items() if count}
+    assert not failed, f"Output differs from the float64 path: {failed}"
+    return differences
+
+def compare_dataset_throughput(work_dir=None, volumes=58, frames_per_case=29, size=512, sweeps=2, threads=2,
+                               seed=0):
+    """
+    Compare sequence throughput of RadarSequenceDataset with the pre-rendered PNG path
+
+    The PNG path is process_radar_files (raster engine) + reorganize_radar_files
+    + PIL loading of every case; the dataset renders the same sequences
+    from the synthetic volumes in memory. The first sequence of both paths
+    must be identical.
+
+    Returns:
+    dict: Seconds and sequences per second of both paths
+    """
+    from PIL import Image
+    from nc_to_png_all import process_radar_files
+    from png_reorganizer import reorganize_radar_files
+    from radar_dataset import RadarSequenceDataset
+
+    if work_dir is None:
+        with tempfile.TemporaryDirectory(prefix='dataset_throughput_') as temp_dir:
+            return compare_dataset_throughput(temp_dir, volumes, frames_per_case, size, sweeps, threads, seed)
+    input_dir = os.path.join(work_dir, 'radar_nc')
+    os.makedirs(input_dir, exist_ok=True)
+    for i in range(volumes):
+        time_point = datetime(2024, 12, 22, 15, 0) + timedelta(minutes=5 * i)
+        make_synthetic_radar(os.path.join(input_dir, f"RDR_SSP_FQC_{time_point.strftime('%Y%m%d%H%M')}.nc"),
+                             sweeps, seed=seed + i, start_time=time_point)
+    recorder = RunRecorder(verbosity='warning')
+
+    start = time.perf_counter()
+    png_dir = os.path.join(work_dir, 'png')
+    case_dir = os.path.join(work_dir, 'cases')
+    process_radar_files(input_dir, png_dir, recorder=recorder, engine='raster', size=size)
+    reorganize_radar_files(png_dir, case_dir, frames_per_case, recorder=recorder)
+    rendered = time.perf_counter()
+    png_sequences = []
+    for case in sorted(os.listdir(case_dir)):
+        frames = sorted(os.listdir(os.path.join(case_dir, case)))
+        png_sequences.append(np.stack([np.asarray(Image.open(os.path.join(case_dir, case, name)))
+                                       for name in frames]))
+    png_seconds = time.perf_counter() - start
+    load_seconds = time.perf_counter() - rendered
+
+    start = time.perf_counter()
+    dataset = RadarSequenceDataset(input_dir, frames_per_case, engine='raster', size=size, threads=threads)
+    dataset_sequences = list(dataset)
+    dataset_seconds = time.perf_counter() - start
+
+    assert len(dataset_sequences) == len(png_sequences), "Number of sequences differs"
+    assert np.array_equal(dataset_sequences[0], png_sequences[0]), "Dataset frames differ from the PNG frames"
+    n = len(dataset_sequences)
+    results = {
+        'sequences': n,
+        'png_seconds': png_seconds, 'png_load_seconds': load_seconds, 'dataset_seconds': dataset_seconds,
+        'png_sequences_per_s': n / png_seconds, 'png_load_sequences_per_s': n / load_seconds,
+        'dataset_sequences_per_s': n / dataset_seconds,
+    }
+    print(f"{n} sequences of {frames_per_case} frames ({size} x {size})")
+    print(f"PNG path (convert + reorganize + load): {png_seconds:8.2f}s  {n / png_seconds:8.2f} seq/s")
+    print(f"PNG loading only:                       {load_seconds:8.2f}s  {n / load_seconds:8.2f} seq/s")
+    print(f"Dataset (in memory, {threads} threads):        {dataset_seconds:8.2f}s  {n / dataset_seconds:8.2f} seq/s")
+    return results
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['check-precision']:
+        check_precision_equivalence()
+        sys.exit()
+    if sys.argv[1:] == ['dataset-throughput']:
+        compare_dataset_throughput()
+        sys.exit()
+
+    # Usage example
+    results = run_benchmarks(label='current')
+
+    baseline_path = os.path.join('benchmark_results', 'baseline.json')
+    if os.path.exists(baseline_path):
+        compare_results(baseline_path, results)
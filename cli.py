@@ -0,0 +1,303 @@
+import os
+import sys
+import glob
+import argparse
+
+# Heavy libraries (xarray, pygrib, matplotlib, scipy) are imported inside the
+# subcommand handlers, so every subcommand only pays for what it uses.
+
+def _input_files(path, patterns):
+    """
+    A single file, or the files of a directory matching one of the patterns
+    """
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for pattern in patterns:
+        files.extend(glob.glob(os.path.join(path, pattern)))
+    return sorted(set(files))
+
+def _recorder(args):
+    from instrumentation import RunRecorder
+    return RunRecorder(log_path=args.log, verbosity=args.verbosity)
+
+def _mask_spec(args):
+    from masking import MaskSpec
+    return MaskSpec(fill_values=args.fill_value or (), valid_min=args.valid_min, valid_max=args.valid_max,
+                    threshold=args.threshold, min_range=getattr(args, 'min_range', None),
+                    max_range=getattr(args, 'max_range', None))
+
+def run_nc(args):
+    from nc_to_png_all import process_radar_files
+
+    with _recorder(args) as recorder:
+        process_radar_files(_input_files(args.input, ['*.nc']), args.output_dir, zip_path=args.zip,
+                            variable=args.variable[0] if len(args.variable) == 1 else args.variable,
+                            workers=args.workers, recorder=recorder, stack_channels=args.stack_channels,
+                            engine=args.engine, output_format=args.format, dpi=args.dpi, size=args.size,
+                            resume=args.resume, profile=args.profile, mask_spec=_mask_spec(args),
+                            mask_output=args.mask_output, precision=args.precision,
+                            shared_memory=args.shared_memory)
+
+def run_grib2(args):
+    from grib2_to_png import process_grib2_files
+
+    with _recorder(args) as recorder:
+        process_grib2_files(_input_files(args.input, ['*.grib2', '*.grb2']), args.output_dir,
+                            workers=args.workers, recorder=recorder, message=args.message,
+                            engine=args.engine, output_format=args.format, dpi=args.dpi,
+                            size=args.size, resume=args.resume, bbox=args.bbox, grid_shape=args.grid_shape,
+                            profile=args.profile, mask_spec=_mask_spec(args), mask_output=args.mask_output,
+                            precision=args.precision)
+
+def run_compare(args):
+    from compare_png import analyze_image_pair
+    from normalization import IMAGE_PROFILE
+
+    profile = IMAGE_PROFILE if args.profile == 'image' else args.profile
+    stats = analyze_image_pair(args.image_a, args.image_b, target_size=(args.size, args.size),
+                               output_dir=args.output_dir, show=args.show, profile=profile)
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+def run_reorganize(args):
+    from png_reorganizer import reorganize_radar_files
+
+    with _recorder(args) as recorder:
+        reorganize_radar_files(args.source_dir, args.target_dir, frames_per_case=args.frames, recorder=recorder,
+                               threads=args.threads, checksums=args.checksums)
+
+def run_stats(args):
+    if args.input.endswith('.nc'):
+        if args.metadata_only:
+            from metadata_catalog import inspect_netcdf
+            for key, value in inspect_netcdf(args.input)[0].items():
+                print(f"{key}: {value}")
+        else:
+            from ncviewer_stat import analyze_netcdf_radar
+            analyze_netcdf_radar(args.input)
+    elif args.histogram:
+        from grib2viewer_stat import analyze_grib2_values
+        analyze_grib2_values(args.input)
+    else:
+        from grib2viewer_sections import analyze_grib2
+        analyze_grib2(args.input, metadata_only=args.metadata_only)
+
+def run_climatology(args):
+    from grib2_climatology import aggregate_grib2
+
+    with _recorder(args) as recorder:
+        aggregate_grib2(_input_files(args.input, ['*.grib2', '*.grb2']), args.output, workers=args.workers,
+                        recorder=recorder, message=args.message, valid_range=tuple(args.valid_range),
+                        bbox=args.bbox, grid_shape=args.grid_shape, thresholds=tuple(args.thresholds),
+                        hist_range=tuple(args.hist_range), hist_bins=args.hist_bins)
+
+def run_profile(args):
+    from normalization import NormalizationProfile, profile_from_files
+
+    options = {'low': args.low, 'high': args.high, 'missing_level': args.missing_level}
+    if args.input.endswith('.npz'):
+        profile = NormalizationProfile.from_climatology(args.input, scale=args.scale, **options)
+    else:
+        files = _input_files(args.input, ['*.nc', '*.grib2', '*.grb2'])
+        profile = profile_from_files(files, variable=args.variable, scale=args.scale, message=args.message, **options)
+    profile.save(args.output)
+    print(f"{profile} saved to {args.output}")
+
+def run_catalog(args):
+    from metadata_catalog import build_catalog
+
+    build_catalog(args.input_dir, args.output, workers=args.workers)
+
+def run_download(args):
+    # raw_data is a plain directory, not a package
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'raw_data'))
+    from download_files import download_files
+
+    download_files(args.url, args.output_dir)
+
+def run_watch(args):
+    from watcher import watch_directory
+
+    with _recorder(args) as recorder:
+        watch_directory(args.input_dir, args.output_dir, workers=args.workers, recorder=recorder,
+                        poll_interval=args.poll_interval, settle=args.settle,
+                        process_existing=args.process_existing, recursive=args.recursive,
+                        variable=args.variable, message=args.message, engine=args.engine,
+                        output_format=args.format, dpi=args.dpi, size=args.size, resume=args.resume,
+                        profile=args.profile, mask_spec=_mask_spec(args), mask_output=args.mask_output,
+                        precision=args.precision)
+
+def _add_workers_option(parser):
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+
+def _add_log_options(parser):
+    parser.add_argument('--log', help='write a JSON-lines log of every stage to this file')
+    parser.add_argument('--verbosity', default='info', choices=['debug', 'info', 'warning', 'error', 'quiet'],
+                        help='console verbosity (default: info)')
+
+def _add_render_options(parser, default_size):
+    parser.add_argument('--engine', default='agg', choices=['agg', 'raster'],
+                        help='agg: matplotlib pcolormesh, raster: direct index-map rasterizer (default: agg)')
+    parser.add_argument('--format', default='png', choices=['png', 'npy'],
+                        help='png image or npy uint8 gray array (default: png)')
+    parser.add_argument('--dpi', type=int, default=300, help='resolution of the agg engine (default: 300)')
+    parser.add_argument('--size', type=int, default=default_size,
+                        help=f'image size in pixels of the raster engine '
+                             f'(default: {default_size or "1024 for NetCDF, 2400 for GRIB2"})')
+    parser.add_argument('--resume', action='store_true', help='skip outputs that already exist')
+    parser.add_argument('--precision', default='float32', choices=['float32', 'float64', 'packed'],
+                        help='numeric type of fields and geometry; packed maps the stored integers of NetCDF '
+                             'variables through a lookup table without unpacking (default: float32)')
+    parser.add_argument('--profile', help='JSON normalization profile (see the profile command) for a fixed '
+                                          'value to gray level mapping')
+
+def _add_mask_options(parser, gate_ranges=False):
+    parser.add_argument('--fill-value', type=float, action='append',
+                        help='additional value marking missing data (repeatable)')
+    parser.add_argument('--valid-min', type=float, help='values below are missing')
+    parser.add_argument('--valid-max', type=float, help='values above are missing')
+    parser.add_argument('--threshold', type=float, help='mask echoes below this value (noise/clutter)')
+    if gate_ranges:
+        parser.add_argument('--min-range', type=float, help='mask gates closer than this range in meters')
+        parser.add_argument('--max-range', type=float, help='mask gates farther than this range in meters')
+    parser.add_argument('--mask-output', action='store_true',
+                        help='also write a 1-bit <image>_mask.npz of the masked pixels (raster engine)')
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Convert GRIB2 and NetCDF climate data to PNG')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    nc = subparsers.add_parser('nc', help='convert CfRadial NetCDF radar volumes (one image per sweep)')
+    nc.add_argument('input', help='NetCDF file or directory of .nc files')
+    nc.add_argument('output_dir', help='directory for the generated images')
+    nc.add_argument('--variable', nargs='+', default=['DBZH'],
+                    help='variable(s) to convert in one pass, e.g. DBZH ZDR KDP RHOHV VELH; several variables '
+                         'are written to one subdirectory each (default: DBZH)')
+    nc.add_argument('--stack-channels', action='store_true',
+                    help='write the variables of a sweep as the channels of one image (png: up to 4)')
+    nc.add_argument('--zip', help='also compress the generated images to this ZIP file')
+    _add_render_options(nc, default_size=1024)
+    _add_mask_options(nc, gate_ranges=True)
+    _add_workers_option(nc)
+    nc.add_argument('--shared-memory', action='store_true',
+                    help='decode each volume once and hand its sweeps to the workers through shared memory')
+    _add_log_options(nc)
+    nc.set_defaults(func=run_nc)
+
+    grib2 = subparsers.add_parser('grib2', help='convert GRIB2 fields')
+    grib2.add_argument('input', help='GRIB2 file or directory of .grib2 files')
+    grib2.add_argument('output_dir', help='directory for the generated images')
+    grib2.add_argument('--message', type=int, default=1, help='message number (default: 1)')
+    grib2.add_argument('--bbox', type=float, nargs=4, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                       help='only convert this lat/lon window (longitudes in -180..180 or 0..360)')
+    grib2.add_argument('--grid-shape', type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'),
+                       help='resample the --bbox window to this grid (default: source resolution); '
+                            'the raster engine writes images of exactly this size')
+    _add_render_options(grib2, default_size=2400)
+    _add_mask_options(grib2)
+    _add_workers_option(grib2)
+    _add_log_options(grib2)
+    grib2.set_defaults(func=run_grib2)
+
+    compare = subparsers.add_parser('compare', help='compare two images pixel by pixel')
+    compare.add_argument('image_a')
+    compare.add_argument('image_b')
+    compare.add_argument('--size', type=int, default=512, help='images are resized to size x size (default: 512)')
+    compare.add_argument('--output-dir', default='comparison_results')
+    compare.add_argument('--show', action='store_true', help='show the comparison plot')
+    compare.add_argument('--profile', help="JSON normalization profile applied to the pixel values instead of "
+                                           "per-image min-max, or 'image' to keep the pixel values")
+    compare.set_defaults(func=run_compare)
+
+    reorganize = subparsers.add_parser('reorganize', help='group the lowest sweeps into cases of N frames')
+    reorganize.add_argument('source_dir')
+    reorganize.add_argument('target_dir')
+    reorganize.add_argument('--frames', type=int, default=29, help='frames per case (default: 29)')
+    reorganize.add_argument('--threads', type=int, default=8, help='cases copied concurrently (default: 8)')
+    reorganize.add_argument('--checksums', action='store_true', help='write a SHA-256 manifest per case')
+    _add_log_options(reorganize)
+    reorganize.set_defaults(func=run_reorganize)
+
+    stats = subparsers.add_parser('stats', help='print statistics of a NetCDF or GRIB2 file')
+    stats.add_argument('input')
+    stats.add_argument('--histogram', action='store_true', help='GRIB2: value histogram instead of the section dump')
+    stats.add_argument('--metadata-only', action='store_true',
+                       help='print the header metadata only, without decoding any data')
+    stats.set_defaults(func=run_stats)
+
+    climatology = subparsers.add_parser('climatology',
+                                        help='per-pixel mean/max/exceedance and value histogram of a GRIB2 archive')
+    climatology.add_argument('input', help='GRIB2 file or directory of .grib2 files')
+    climatology.add_argument('output', nargs='?', default='climatology.npz',
+                             help='.npz file to create (default: climatology.npz)')
+    climatology.add_argument('--message', type=int, default=1, help='message number (default: 1)')
+    climatology.add_argument('--valid-range', type=float, nargs=2, default=[0.0, 1000.0], metavar=('LOW', 'HIGH'),
+                             help='values outside are ignored, e.g. the MRMS no-coverage flags (default: 0 1000)')
+    climatology.add_argument('--thresholds', type=float, nargs='+', default=[0.1, 1.0, 10.0],
+                             help='per-pixel exceedance thresholds (default: 0.1 1 10)')
+    climatology.add_argument('--hist-range', type=float, nargs=2, default=[0.0, 200.0], metavar=('LOW', 'HIGH'),
+                             help='range of the fixed-bin histogram (default: 0 200)')
+    climatology.add_argument('--hist-bins', type=int, default=2000, help='number of histogram bins (default: 2000)')
+    climatology.add_argument('--bbox', type=float, nargs=4, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                             help='only aggregate this lat/lon window')
+    climatology.add_argument('--grid-shape', type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'),
+                             help='resample the --bbox window to this grid')
+    _add_workers_option(climatology)
+    _add_log_options(climatology)
+    climatology.set_defaults(func=run_climatology)
+
+    profile = subparsers.add_parser('profile', help='compute a normalization profile from data and save it as JSON')
+    profile.add_argument('input', help='climatology .npz, or NetCDF/GRIB2 file or directory')
+    profile.add_argument('output', help='JSON file to create')
+    profile.add_argument('--scale', default='linear', choices=['linear', 'log'], help='(default: linear)')
+    profile.add_argument('--low', type=float, default=0.001, help='quantile mapped to black (default: 0.001)')
+    profile.add_argument('--high', type=float, default=0.999, help='quantile mapped to white (default: 0.999)')
+    profile.add_argument('--missing-level', type=int, default=0, help='gray level of missing values (default: 0)')
+    profile.add_argument('--variable', default='DBZH', help='NetCDF variable (default: DBZH)')
+    profile.add_argument('--message', type=int, default=1, help='GRIB2 message number (default: 1)')
+    profile.set_defaults(func=run_profile)
+
+    watch = subparsers.add_parser('watch', help='convert NetCDF/GRIB2 files as they arrive in a directory')
+    watch.add_argument('input_dir', help='directory to watch')
+    watch.add_argument('output_dir', help='directory for the generated images')
+    watch.add_argument('--variable', default='DBZH', help='NetCDF variable to convert (default: DBZH)')
+    watch.add_argument('--message', type=int, default=1, help='GRIB2 message number (default: 1)')
+    watch.add_argument('--poll-interval', type=float, default=0.2,
+                       help='seconds between directory scans (default: 0.2)')
+    watch.add_argument('--settle', type=float, default=0.5,
+                       help='seconds a file must stay unchanged before it is converted (default: 0.5)')
+    watch.add_argument('--process-existing', action='store_true', help='also convert the files present at start')
+    watch.add_argument('--recursive', action='store_true', help='also watch subdirectories')
+    _add_render_options(watch, default_size=None)
+    _add_mask_options(watch, gate_ranges=True)
+    _add_workers_option(watch)
+    _add_log_options(watch)
+    watch.set_defaults(func=run_watch)
+
+    catalog = subparsers.add_parser('catalog', help='write a CSV catalog of the header metadata of a directory')
+    catalog.add_argument('input_dir', help='directory scanned recursively for .nc/.grib2 files')
+    catalog.add_argument('output', nargs='?', default='catalog.csv', help='CSV file to create (default: catalog.csv)')
+    catalog.add_argument('--workers', type=int, default=4, help='number of worker processes (default: 4)')
+    catalog.set_defaults(func=run_catalog)
+
+    download = subparsers.add_parser('download', help='download the .gz files linked from a page (MRMS)')
+    download.add_argument('url', nargs='?', default='https://mrms.ncep.noaa.gov/2D/PrecipRate/')
+    download.add_argument('--output-dir', default='downloads')
+    download.set_defaults(func=run_download)
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'mask_output', False) and args.engine != 'raster':
+        parser.error('--mask-output needs --engine raster')
+    if getattr(args, 'shared_memory', False) and len(args.variable) > 1:
+        parser.error('--shared-memory converts one variable')
+    if getattr(args, 'shared_memory', False) and args.stack_channels:
+        parser.error('--shared-memory does not support --stack-channels')
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,13 @@ import matplotlib.pyplot as plt
 from scipy import stats
 import os
 
-def load_and_process_image(image_path, target_size=(512, 512)):
+def load_and_process_image(image_path, target_size=(512, 512), profile=None, dtype=float):
     """
     Load and preprocess an image
     - Forcibly convert to RGB 3 channels
     - Resize to specified size
-    - Apply Min-Max normalization
+    - Apply Min-Max normalization, or the fixed mapping of a NormalizationProfile
+      (the same for every image, so that images stay comparable)
     """
     img = Image.open(image_path)
     
@@ -20,8 +21,15 @@ def load_and_process_image(image_path, target_size=(512, 512)):
     # Resize to target size
     img = img.resize(target_size, Image.Resampling.LANCZOS)
     
+    if profile is not None:
+        # Pixel values index the profile lookup table directly
+        normalized_array = profile.apply(np.array(img))
+        print(f"Loaded image shape from {image_path}: {normalized_array.shape}")
+        print(f"Value range: [{normalized_array.min():.1f}, {normalized_array.max():.1f}]")
+        return normalized_array
+    
     # Convert to numpy array
-    img_array = np.array(img).astype(float)
+    img_array = np.array(img).astype(dtype)
     
     # Normalize each channel
     normalized_array = np.zeros_like(img_array)
@@ -37,13 +45,14 @@ def load_and_process_image(image_path, target_size=(512, 512)):
     
     return normalized_array.astype(np.uint8)
 
-def calculate_pixel_statistics(img1_array, img2_array):
+def calculate_pixel_statistics(img1_array, img2_array, dtype=float):
     """
     Calculate pixel-by-pixel statistics between two images
+    (dtype=np.float32 halves the memory of the intermediate arrays)
     """
     # Normalize image values to 0-1 range
-    img1_norm = img1_array.astype(float) / 255.0
-    img2_norm = img2_array.astype(float) / 255.0
+    img1_norm = img1_array.astype(dtype) / dtype(255.0)
+    img2_norm = img2_array.astype(dtype) / dtype(255.0)
     
     # Basic statistics
     diff = img1_norm - img2_norm
@@ -88,7 +97,7 @@ def calculate_pixel_statistics(img1_array, img2_array):
         'Significant_Difference_Ratio': significant_diff_ratio
     }
 
-def plot_comparison(img1_array, img2_array, statistics, save_path=None):
+def plot_comparison(img1_array, img2_array, statistics, save_path=None, show=True):
     """
     Visualize the comparison of two images
     """
@@ -104,7 +113,7 @@ def plot_comparison(img1_array, img2_array, statistics, save_path=None):
     axes[0,1].axis('off')
     
     # Visualize difference (using normalized values)
-    diff_img = np.abs(img1_array.astype(float) - img2_array.astype(float)) / 255.0
+    diff_img = np.abs(img1_array.astype(np.float32) - img2_array.astype(np.float32)) / np.float32(255.0)
     diff_mean = np.mean(diff_img, axis=2)  # Average difference of RGB channels
     im = axes[0,2].imshow(diff_mean, cmap='hot')
     axes[0,2].set_title('Average Absolute Difference')
@@ -134,19 +143,27 @@ def plot_comparison(img1_array, img2_array, statistics, save_path=None):
     plt.tight_layout()
     if save_path:
         plt.savefig(save_path, bbox_inches='tight', dpi=300)
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
 
-def analyze_image_pair(nowcast_path='processed_data.png', usa_path='usa_data.png', target_size=(512, 512), output_dir='comparison_results'):
+def analyze_image_pair(nowcast_path='processed_data.png', usa_path='usa_data.png', target_size=(512, 512), output_dir='comparison_results', show=True, profile=None, dtype=float):
     """
     Compare two images and save the results
+
+    profile (NormalizationProfile or str) replaces the per-image min-max
+    normalization, e.g. normalization.IMAGE_PROFILE keeps the pixel values.
     """
+    from normalization import get_profile
+    profile = get_profile(profile)
     # Create result directory
     os.makedirs(output_dir, exist_ok=True)
     
     # Load and preprocess images
     print(f"Processing images to size {target_size}...")
-    nowcast_img = load_and_process_image(nowcast_path, target_size)
-    usa_img = load_and_process_image(usa_path, target_size)
+    nowcast_img = load_and_process_image(nowcast_path, target_size, profile, dtype)
+    usa_img = load_and_process_image(usa_path, target_size, profile, dtype)
     
     print(f"Processed image shapes:")
     print(f"NowcastNet image: {nowcast_img.shape}")
@@ -154,14 +171,15 @@ def analyze_image_pair(nowcast_path='processed_data.png', usa_path='usa_data.png
     
     # Calculate statistics
     print("Calculating statistics...")
-    stats = calculate_pixel_statistics(nowcast_img, usa_img)
+    stats = calculate_pixel_statistics(nowcast_img, usa_img, dtype)
     
     # Visualize and save results
     plot_comparison(
         nowcast_img, 
         usa_img, 
         stats,
-        save_path=os.path.join(output_dir, 'image_comparison.png')
+        save_path=os.path.join(output_dir, 'image_comparison.png'),
+        show=show
     )
     
     # Save statistics to text file
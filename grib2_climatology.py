@@ -0,0 +1,291 @@
+import os
+import glob
+import tempfile
+import contextlib
+
+import numpy as np
+
+from instrumentation import RunRecorder, map_files
+from grib2_to_png import read_grib2, read_grib2_subset
+from masking import MaskSpec
+from metadata_catalog import GRIB2_PATTERNS
+
+class ClimatologyAccumulator:
+    """
+    Streaming per-pixel and global statistics of a series of 2D fields
+
+    Keeps per-pixel sums, valid counts, maxima and threshold exceedance
+    counts, plus one global histogram with fixed uniform bins (and
+    underflow/overflow counters). Memory does not grow with the number of
+    fields, and two accumulators with the same configuration can be merged,
+    so a directory can be split across processes or runs.
+
+    Parameters:
+    thresholds (tuple): Values for the per-pixel exceedance counts (value >= threshold)
+    hist_range (tuple): (low, high) of the global histogram
+    hist_bins (int): Number of uniform histogram bins
+    """
+    # Source files kept for the record (fields counts all of them)
+    MAX_FILES = 1000
+
+    def __init__(self, thresholds=(0.1, 1.0, 10.0), hist_range=(0.0, 200.0), hist_bins=2000):
+        self.thresholds = np.asarray(thresholds, dtype=np.float32)
+        self.hist_range = (float(hist_range[0]), float(hist_range[1]))
+        self.hist_bins = int(hist_bins)
+        self.histogram = np.zeros(self.hist_bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.fields = 0
+        self.files = []
+        self.shape = None
+        self.sum = self.count = self.max = self.exceedance = None
+
+    def _allocate(self, shape):
+        self.shape = tuple(shape)
+        self.sum = np.zeros(shape, dtype=np.float64)
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.max = np.full(shape, np.nan, dtype=np.float32)
+        self.exceedance = np.zeros((len(self.thresholds),) + self.shape, dtype=np.int32)
+
+    def update(self, data, file=None):
+        """
+        Add one field; NaN values are ignored
+
+        Parameters:
+        data (numpy.ndarray): 2D float field (missing values as NaN)
+        file (str): Source file, kept for the record (the first MAX_FILES only)
+        """
+        data = np.asarray(data, dtype=np.float32)
+        if self.shape is None:
+            self._allocate(data.shape)
+        elif data.shape != self.shape:
+            raise ValueError(f"Field shape {data.shape} does not match the accumulated shape {self.shape}")
+
+        valid = np.isfinite(data)
+        np.add(self.sum, data, out=self.sum, where=valid)
+        self.count += valid
+        np.fmax(self.max, data, out=self.max)
+        for i, threshold in enumerate(self.thresholds):
+            # NaN compares as False
+            self.exceedance[i] += data >= threshold
+
+        values = data[valid]
+        low, high = self.hist_range
+        self.underflow += int(np.count_nonzero(values < low))
+        self.overflow += int(np.count_nonzero(values >= high))
+        values = values[(values >= low) & (values < high)]
+        index = ((values - low) * (self.hist_bins / (high - low))).astype(np.int64)
+        self.histogram += np.bincount(np.minimum(index, self.hist_bins - 1), minlength=self.hist_bins)
+
+        self.fields += 1
+        if file is not None and len(self.files) < self.MAX_FILES:
+            self.files.append(file)
+
+    def merge(self, other):
+        """
+        Add the statistics of another accumulator with the same configuration
+        """
+        if (not np.array_equal(other.thresholds, self.thresholds) or other.hist_range != self.hist_range
+                or other.hist_bins != self.hist_bins):
+            raise ValueError("Cannot merge accumulators with different thresholds or histogram bins")
+        if other.shape is None:
+            return self
+        if self.shape is None:
+            self._allocate(other.shape)
+        elif other.shape != self.shape:
+            raise ValueError(f"Cannot merge shape {other.shape} into {self.shape}")
+        self.sum += other.sum
+        self.count += other.count
+        np.fmax(self.max, other.max, out=self.max)
+        self.exceedance += other.exceedance
+        self.histogram += other.histogram
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.fields += other.fields
+        self.files.extend(other.files[:self.MAX_FILES - len(self.files)])
+        return self
+
+    @property
+    def bin_edges(self):
+        return np.linspace(self.hist_range[0], self.hist_range[1], self.hist_bins + 1)
+
+    def mean(self):
+        """
+        Per-pixel mean over the valid values (NaN where a pixel was never valid)
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.sum / self.count).astype(np.float32)
+
+    def exceedance_frequency(self):
+        """
+        Per-pixel fraction of valid values >= each threshold, shape (thresholds, height, width)
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.exceedance / self.count).astype(np.float32)
+
+    def quantile(self, q):
+        """
+        Approximate quantile(s) of all valid values from the histogram
+
+        Values below/above the histogram range are counted at its edges.
+
+        Parameters:
+        q (float or list): Quantile(s) in [0, 1]
+
+        Returns:
+        float or numpy.ndarray: Value(s), at histogram bin resolution
+        """
+        counts = np.concatenate([[self.underflow], self.histogram, [self.overflow]])
+        cumulative = np.cumsum(counts)
+        if cumulative[-1] == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        edges = self.bin_edges
+        # Upper edge of every counter; underflow maps to the low edge, overflow to the high edge
+        upper = np.concatenate([[edges[0]], edges[1:], [edges[-1]]])
+        position = np.searchsorted(cumulative, np.asarray(q) * cumulative[-1], side='left')
+        return upper[np.minimum(position, len(upper) - 1)]
+
+    def suggest_range(self, low=0.001, high=0.999):
+        """
+        Normalization range (vmin, vmax) covering the given quantiles of the data
+        """
+        vmin, vmax = self.quantile([low, high])
+        return float(vmin), float(vmax)
+
+    def save(self, output_path):
+        """
+        Save the accumulator (including the raw sums, so it can be merged later) as .npz
+        """
+        shape = self.shape or (0, 0)
+        arrays = {
+            'thresholds': self.thresholds, 'hist_range': np.asarray(self.hist_range),
+            'histogram': self.histogram, 'underflow': self.underflow, 'overflow': self.overflow,
+            'fields': self.fields, 'files': np.asarray(self.files, dtype=str), 'shape': np.asarray(shape),
+        }
+        if self.shape is not None:
+            arrays.update(sum=self.sum, count=self.count, max=self.max, exceedance=self.exceedance,
+                          mean=self.mean(), bin_edges=self.bin_edges)
+        np.savez(output_path, **arrays)
+        return output_path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            accumulator = cls(thresholds=f['thresholds'], hist_range=tuple(f['hist_range']),
+                              hist_bins=len(f['histogram']))
+            accumulator.histogram = f['histogram'].astype(np.int64)
+            accumulator.underflow = int(f['underflow'])
+            accumulator.overflow = int(f['overflow'])
+            accumulator.fields = int(f['fields'])
+            accumulator.files = [str(name) for name in f['files']]
+            if 'sum' in f.files:
+                accumulator.shape = tuple(int(n) for n in f['shape'])
+                accumulator.sum = f['sum']
+                accumulator.count = f['count']
+                accumulator.max = f['max']
+                accumulator.exceedance = f['exceedance']
+        return accumulator
+
+def read_field(file_path, message=1, valid_range=(None, None), bbox=None, grid_shape=None):
+    """
+    One GRIB2 field as float32 with missing and out-of-range values as NaN
+    """
+    mask_spec = MaskSpec(valid_min=valid_range[0], valid_max=valid_range[1])
+    if bbox is not None:
+        return read_grib2_subset(file_path, bbox, grid_shape, message, mask_spec)[0]
+    return read_grib2(file_path, message, latlons=False, mask_spec=mask_spec)[0]
+
+def _accumulate_chunk(chunk, recorder=None, partial_dir='.', message=1, valid_range=(None, None),
+                      bbox=None, grid_shape=None, **accumulator_options):
+    index, files = chunk
+    accumulator = ClimatologyAccumulator(**accumulator_options)
+    for file_path in files:
+        try:
+            with recorder.stage('decode', file_path):
+                data = read_field(file_path, message, valid_range, bbox, grid_shape)
+            with recorder.stage('accumulate', file_path):
+                accumulator.update(data, file_path)
+        except Exception as e:
+            recorder.exception('file_failed', e, message=f"Error processing {file_path}", file=file_path)
+        recorder.file_done(file_path)
+    return accumulator.save(os.path.join(partial_dir, f"climatology_part{index:03d}.npz"))
+
+def merge_partials(paths):
+    """
+    Merge saved accumulators (e.g. the partial results of several runs)
+    """
+    merged = None
+    for path in paths:
+        accumulator = ClimatologyAccumulator.load(path)
+        merged = accumulator if merged is None else merged.merge(accumulator)
+    return merged
+
+def aggregate_grib2(input_dir, output_path='climatology.npz', workers=1, recorder=None, message=1,
+                    valid_range=(None, None), bbox=None, grid_shape=None, keep_partials=False,
+                    **accumulator_options):
+    """
+    Per-pixel climatology and global histogram of every GRIB2 file of a directory
+
+    The files are split into one chunk per worker; every worker streams its
+    chunk through its own accumulator and saves it as a partial .npz in a
+    directory of this run, and the partials are merged into output_path.
+
+    Parameters:
+    input_dir (str or list): Directory with .grib2/.grb2 files, or list of GRIB2 files
+    output_path (str): Path of the .npz file to create
+    workers (int): Number of worker processes
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    message (int): Message number (1-based)
+    valid_range (tuple): (low, high) values outside are ignored (None: no limit)
+    bbox (tuple): Only aggregate this (lat_min, lat_max, lon_min, lon_max) window
+    grid_shape (tuple): (height, width) of the bbox target grid
+    keep_partials (bool): Keep the per-worker partial files (in '<output name>_parts_*' next to output_path)
+    **accumulator_options: ClimatologyAccumulator options (thresholds, hist_range, hist_bins)
+
+    Returns:
+    ClimatologyAccumulator: Merged statistics
+    """
+    recorder = recorder or RunRecorder()
+    workers = max(1, workers)
+    if isinstance(input_dir, (list, tuple)):
+        grib_files = list(input_dir)
+    else:
+        grib_files = sorted({path for pattern in GRIB2_PATTERNS for path in glob.glob(os.path.join(input_dir, pattern))})
+        # pygrib cannot read compressed files (MRMS products are downloaded as .grib2.gz)
+        compressed = glob.glob(os.path.join(input_dir, "*.gz"))
+        if compressed:
+            recorder.log('warning', 'skipped', message=f"Skipping {len(compressed)} compressed files in {input_dir} "
+                         f"(decompress .grib2.gz files first)", input_dir=input_dir, files=len(compressed))
+    recorder.log('info', 'start', message=f"Aggregating {len(grib_files)} GRIB2 files with {workers} workers",
+                 files=len(grib_files))
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    # A directory per run, so concurrent runs into the same directory keep their own partials
+    prefix = os.path.splitext(os.path.basename(output_path))[0] + '_parts_'
+    if keep_partials:
+        partial_context = contextlib.nullcontext(tempfile.mkdtemp(prefix=prefix, dir=output_dir))
+    else:
+        partial_context = tempfile.TemporaryDirectory(prefix=prefix, dir=output_dir)
+    chunks = [(i, grib_files[i::workers]) for i in range(workers) if grib_files[i::workers]]
+    with partial_context as partial_dir:
+        partials = map_files(_accumulate_chunk, chunks, workers, recorder, partial_dir=partial_dir,
+                             message=message, valid_range=valid_range, bbox=bbox, grid_shape=grid_shape,
+                             **accumulator_options)
+
+        with recorder.stage('merge'):
+            accumulator = merge_partials(partials) or ClimatologyAccumulator(**accumulator_options)
+            accumulator.save(output_path)
+
+    if accumulator.fields:
+        vmin, vmax = accumulator.suggest_range()
+        recorder.log('info', 'done', message=f"Climatology of {accumulator.fields} fields saved to {output_path}. "
+                     f"Maximum {np.nanmax(accumulator.max):.2f}, "
+                     f"suggested normalization range (0.1% ~ 99.9%): {vmin:.2f} ~ {vmax:.2f}",
+                     fields=accumulator.fields, output=output_path, suggested_range=[vmin, vmax])
+    recorder.print_summary()
+    return accumulator
+
+if __name__ == "__main__":
+    # Usage example
+    aggregate_grib2('downloads', 'climatology.npz', workers=4, valid_range=(0, None))
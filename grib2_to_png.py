@@ -1,39 +1,318 @@
+import os
+import glob
+from functools import lru_cache
+
 import pygrib
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import LogNorm
-
-# Open grib2 file
-grbs = pygrib.open('usa_data.grib2')
-grb = grbs[1]
-
-# Get data and lat/lon
-data, lats, lons = grb.data()
-
-# Figure settings - remove margins
-plt.figure(figsize=(8, 8))
-ax = plt.gca()
-ax.set_axis_off()
-
-# Remove margins
-plt.margins(0,0)
-plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
-
-# Visualize data - change to grayscale colormap
-plt.pcolormesh(lons, lats, data, 
-               cmap='Greys_r',     # Use Greys_r for inverted grayscale display
-               norm=LogNorm(vmin=0.1, vmax=data.max()),
-               )
-
-# Remove unnecessary margins
-plt.gca().xaxis.set_major_locator(plt.NullLocator())
-plt.gca().yaxis.set_major_locator(plt.NullLocator())
-
-# Save as PNG - set facecolor to black
-plt.savefig('usa_data.png', 
-            bbox_inches='tight', 
-            pad_inches=0, 
-            dpi=300,
-            facecolor='black',  # Set background color to black
-            edgecolor='none')
-plt.close()
\ No newline at end of file
+
+from instrumentation import RunRecorder, map_files
+from renderer import get_renderer, encode_frame, write_atomic
+from normalization import NormalizationProfile, get_profile
+from masking import MaskSpec, encode_bitmask
+
+# 8 x 8 inch figure with a black background, as produced by the original pyplot version
+GRIB2_RENDER_CONFIG = {'figsize': (8, 8), 'aspect': 'auto'}
+
+def read_grib2(file_path, message=1, latlons=True, mask_spec=None, dtype=np.float32):
+    """
+    Read one message of a GRIB2 file
+
+    Parameters:
+    file_path (str): Path to GRIB2 file
+    message (int): Message number (1-based)
+    latlons (bool): Also compute the 2D latitude/longitude arrays
+    mask_spec (MaskSpec): If given, the data is returned as dtype with the
+        message missingValue and the masked values set to NaN
+    dtype (numpy.dtype): Float type of the masked data (ecCodes always decodes to float64)
+
+    Returns:
+    tuple: (data, lats, lons) 2D arrays (lats and lons are None if latlons is False)
+    """
+    # Open grib2 file
+    grbs = pygrib.open(file_path)
+    try:
+        grb = grbs[message]
+
+        # Get data and lat/lon
+        if latlons:
+            data, lats, lons = grb.data()
+        else:
+            data, lats, lons = grb.values, None, None
+        if mask_spec is not None:
+            data = mask_spec.with_fill_values(grb['missingValue']).apply(data, dtype=dtype)[0]
+    finally:
+        grbs.close()
+    return data, lats, lons
+
+def grid_definition(grb):
+    """
+    Regular lat/lon grid of a message, read from the grid description keys
+
+    Returns:
+    tuple: (lat_first, lon_first, lat_step, lon_step, nj, ni); lat_step is
+        negative when the rows run from north to south
+    """
+    if grb['gridType'] != 'regular_ll':
+        raise ValueError(f"Subsetting needs a regular_ll grid, got {grb['gridType']}")
+    lat_step = grb['jDirectionIncrementInDegrees']
+    lon_step = grb['iDirectionIncrementInDegrees']
+    if not grb['jScansPositively']:
+        lat_step = -lat_step
+    if grb['iScansNegatively']:
+        lon_step = -lon_step
+    return (float(grb['latitudeOfFirstGridPointInDegrees']), float(grb['longitudeOfFirstGridPointInDegrees']),
+            float(lat_step), float(lon_step), int(grb['Nj']), int(grb['Ni']))
+
+def target_axes(grid, bbox, shape=None):
+    """
+    Pixel center latitudes (north first) and longitudes of the target grid
+
+    Parameters:
+    grid (tuple): Source grid, see grid_definition
+    bbox (tuple): (lat_min, lat_max, lon_min, lon_max) in degrees
+    shape (tuple): Target (height, width); default: the source resolution
+
+    Returns:
+    tuple: (lats, lons) 1D arrays
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    if shape is None:
+        shape = (max(1, int(round((lat_max - lat_min) / abs(grid[2])))),
+                 max(1, int(round((lon_max - lon_min) / abs(grid[3])))))
+    height, width = shape
+    lats = lat_max - (np.arange(height) + 0.5) * ((lat_max - lat_min) / height)
+    lons = lon_min + (np.arange(width) + 0.5) * ((lon_max - lon_min) / width)
+    return lats, lons
+
+@lru_cache(maxsize=32)
+def subset_index_map(grid, bbox, shape=None):
+    """
+    Nearest source row and column of every target pixel, -1 outside the source grid
+
+    Depends only on the grid definition, the bounding box and the target
+    shape, so it is computed once per configuration and process.
+
+    Returns:
+    tuple: (rows, cols) int64 arrays with the target height and width
+    """
+    lat_first, lon_first, lat_step, lon_step, nj, ni = grid
+    lats, lons = target_axes(grid, bbox, shape)
+    rows = np.rint((lats - lat_first) / lat_step).astype(np.int64)
+    # Longitudes are compared modulo 360, so -100 and 260 select the same column
+    cols = np.rint(((lons - lon_first) * np.sign(lon_step)) % 360 / abs(lon_step)).astype(np.int64)
+    rows[(rows < 0) | (rows >= nj)] = -1
+    cols[(cols < 0) | (cols >= ni)] = -1
+    return rows, cols
+
+def read_grib2_subset(file_path, bbox, shape=None, message=1, mask_spec=None, dtype=np.float32):
+    """
+    Read the part of a GRIB2 message inside a lat/lon bounding box, resampled to a fixed grid
+
+    The window is located from the grid definition (no 2D lat/lon arrays
+    are built) and the values are resampled with a cached nearest-neighbour
+    index map. Pixels outside the source grid, missing values and the values
+    masked by mask_spec are NaN.
+
+    Parameters:
+    file_path (str): Path to GRIB2 file
+    bbox (tuple): (lat_min, lat_max, lon_min, lon_max) in degrees
+    shape (tuple): Target (height, width); default: the source resolution
+    message (int): Message number (1-based)
+    mask_spec (MaskSpec): Additional masking rules (fill values, thresholds, value limits)
+    dtype (numpy.dtype): Float type of the returned window
+
+    Returns:
+    tuple: (data, lats, lons) float32 2D array (north first) and 1D pixel center axes
+    """
+    bbox = tuple(float(v) for v in bbox)
+    shape = tuple(shape) if shape is not None else None
+    grbs = pygrib.open(file_path)
+    try:
+        grb = grbs[message]
+        grid = grid_definition(grb)
+        mask_spec = (mask_spec or MaskSpec()).with_fill_values(grb['missingValue'])
+        rows, cols = subset_index_map(grid, bbox, shape)
+        valid_rows, valid_cols = rows[rows >= 0], cols[cols >= 0]
+        if valid_rows.size == 0 or valid_cols.size == 0:
+            data = np.full((len(rows), len(cols)), np.nan, dtype=dtype)
+        else:
+            # Packed data is decoded as a whole; only the window is kept and converted
+            values = grb.values
+            row0, row1 = valid_rows.min(), valid_rows.max() + 1
+            col0, col1 = valid_cols.min(), valid_cols.max() + 1
+            window = mask_spec.apply(values[row0:row1, col0:col1], dtype=dtype)[0]
+            del values
+            # Append a NaN row and column for the target pixels outside the grid (index -1)
+            window = np.pad(window, ((0, 1), (0, 1)), constant_values=np.nan)
+            data = window[np.where(rows >= 0, rows - row0, -1)[:, None], np.where(cols >= 0, cols - col0, -1)[None, :]]
+    finally:
+        grbs.close()
+    lats, lons = target_axes(grid, bbox, shape)
+    return data, lats, lons
+
+def field_profile(data, vmin=0.1):
+    """
+    Per-field log profile from vmin to the field maximum (the original scaling)
+
+    Frames scaled this way are not comparable between files; pass a fixed
+    profile to grib2_to_png for training data.
+    """
+    vmax = np.nanmax(data) if np.any(np.isfinite(data)) else vmin
+    # The profile needs vmax > vmin, also for crops without precipitation
+    return NormalizationProfile(vmin, float(vmax) if vmax > vmin else vmin * 10, scale='log')
+
+def render_grib2(data, lats, lons, dpi=300, profile=None):
+    """
+    Draw a GRIB2 field as a borderless grayscale image
+
+    The canvas of the calling thread is reused; fields on the same grid
+    as the previous one only update the mesh data. Missing values stay
+    masked and are not painted.
+
+    Returns:
+    AggRenderer: Renderer holding the rasterized field
+    """
+    profile = profile or field_profile(data)
+    renderer = get_renderer('agg', dpi=dpi, **GRIB2_RENDER_CONFIG)
+    # Use Greys_r for inverted grayscale display
+    renderer.draw(lons, lats, np.ma.masked_array(profile.apply(data), mask=profile.mask(data)), vmin=0, vmax=255)
+    return renderer
+
+def render_grib2_raster(data, size=2400, profile=None):
+    """
+    Rasterize a GRIB2 field on a regular lat/lon grid (north first) directly
+
+    Uses the same mapping as render_grib2 without building lat/lon arrays.
+    size may be a (width, height) tuple.
+
+    Returns:
+    RasterRenderer: Renderer holding the rasterized field
+    """
+    renderer = get_renderer('raster', size=size)
+    renderer.draw_grid(data, profile=profile or field_profile(data))
+    return renderer
+
+def draw_grib2(file_path, recorder, message=1, engine='agg', dpi=300, size=2400, bbox=None, grid_shape=None,
+               profile=None, mask_spec=None, dtype=np.float32):
+    """
+    Decode and render one GRIB2 message (see grib2_to_png for the parameters)
+
+    Returns:
+    tuple: (renderer, data) renderer holding the frame, and the decoded field
+    """
+    with recorder.stage('decode', file_path):
+        if bbox is not None:
+            data, lats, lons = read_grib2_subset(file_path, bbox, grid_shape, message, mask_spec, dtype)
+            if engine != 'raster':
+                lons, lats = np.meshgrid(lons, lats)
+        else:
+            data, lats, lons = read_grib2(file_path, message, latlons=(engine != 'raster'), mask_spec=mask_spec,
+                                          dtype=dtype)
+    with recorder.stage('render', file_path):
+        if engine == 'raster':
+            renderer = render_grib2_raster(data, size if bbox is None else data.shape[::-1], profile)
+        else:
+            renderer = render_grib2(data, lats, lons, dpi, profile)
+    return renderer, data
+
+def grib2_to_png(file_path, output_path, message=1, recorder=None, engine='agg', output_format='png',
+                 dpi=300, size=2400, resume=False, bbox=None, grid_shape=None, profile=None,
+                 mask_spec=None, mask_output=False, precision='float32'):
+    """
+    Convert one GRIB2 message to PNG
+
+    Parameters:
+    file_path (str): Path to GRIB2 file
+    output_path (str): Path of the PNG file to create
+    message (int): Message number (1-based)
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    engine (str): 'agg' (matplotlib pcolormesh) or 'raster' (direct grid rasterizer)
+    output_format (str): 'png' image or 'npy' uint8 gray array
+    dpi (int): Resolution of the 8 x 8 inch agg image
+    size (int): Image size in pixels of the raster engine
+    resume (bool): Skip the conversion if output_path already exists
+    bbox (tuple): Only convert (lat_min, lat_max, lon_min, lon_max), see read_grib2_subset
+    grid_shape (tuple): (height, width) of the bbox target grid; the raster
+        engine writes it at exactly this size (default: source resolution)
+    profile (NormalizationProfile or str): Value to gray level mapping, or the
+        path of a saved profile (default: log scale from 0.1 to the field maximum)
+    mask_spec (MaskSpec): Masking rules; the message missingValue is always masked
+    mask_output (bool): Also write the mask of the image as a 1-bit
+        '<output>_mask.npz' (see masking.load_bitmask); raster engine only
+    precision (str): 'float32' or 'float64' field after decoding ('packed' is
+        treated as float32: ecCodes decodes the packed values to float64 itself)
+
+    Returns:
+    str: Path to the generated PNG file
+    """
+    recorder = recorder or RunRecorder()
+    profile = get_profile(profile)
+    mask_spec = mask_spec or MaskSpec()
+    dtype = np.float64 if precision == 'float64' else np.float32
+    if mask_output and engine != 'raster':
+        raise ValueError("mask_output needs the raster engine (the mask is aligned with the image pixels)")
+    if resume and os.path.exists(output_path):
+        recorder.log('debug', 'skipped', message=f"Already converted: {output_path}", file=file_path, output=output_path)
+        return output_path
+
+    renderer, data = draw_grib2(file_path, recorder, message, engine, dpi, size, bbox, grid_shape, profile,
+                                mask_spec, dtype)
+    with recorder.stage('encode', file_path):
+        encoded = encode_frame(renderer, output_format)
+    with recorder.stage('write', file_path):
+        write_atomic(output_path, encoded)
+    if mask_output:
+        with recorder.stage('mask', file_path):
+            write_atomic(f"{os.path.splitext(output_path)[0]}_mask.npz",
+                         encode_bitmask(renderer.rasterize_mask(np.isnan(data))))
+    recorder.log('debug', 'generated', message=f"Generated: {output_path}",
+                 file=file_path, message_number=message, output=output_path, shape=data.shape)
+    recorder.file_done(file_path, outputs=1)
+    return output_path
+
+def _grib2_to_dir(file_path, output_dir, recorder=None, output_format='png', **options):
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    output_path = os.path.join(output_dir, f'{base_filename}.{output_format}')
+    try:
+        return grib2_to_png(file_path, output_path, recorder=recorder, output_format=output_format, **options)
+    except Exception as e:
+        recorder.exception('file_failed', e, message=f"Error processing {file_path}", file=file_path)
+        return None
+
+def process_grib2_files(input_dir, output_dir, workers=1, recorder=None, **options):
+    """
+    Convert every GRIB2 file of a directory
+
+    Parameters:
+    input_dir (str or list): Directory with .grib2 files, or list of GRIB2 files
+    output_dir (str): Directory for the generated images
+    workers (int): Number of worker processes
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    **options: Options of grib2_to_png (message, engine, output_format, dpi, size, resume, bbox, grid_shape, profile,
+        mask_spec, mask_output, precision)
+
+    Returns:
+    list: Paths to the generated files
+    """
+    recorder = recorder or RunRecorder()
+    os.makedirs(output_dir, exist_ok=True)
+    if options.get('profile') is not None:
+        options['profile'] = get_profile(options['profile'])
+
+    if isinstance(input_dir, (list, tuple)):
+        grib_files = list(input_dir)
+    else:
+        grib_files = sorted(glob.glob(os.path.join(input_dir, "*.grib2")))
+    recorder.log('info', 'start', message=f"Found {len(grib_files)} GRIB2 files", input_dir=str(input_dir), files=len(grib_files))
+
+    results = map_files(_grib2_to_dir, grib_files, workers, recorder, output_dir=output_dir, **options)
+    generated_files = [path for path in results if path is not None]
+
+    recorder.log('info', 'done',
+                 message=f"Processing complete. {len(grib_files)} files processed, {len(generated_files)} output files generated",
+                 files=len(grib_files), outputs=len(generated_files))
+    recorder.print_summary()
+    return generated_files
+
+if __name__ == "__main__":
+    grib2_to_png('usa_data.grib2', 'usa_data.png')
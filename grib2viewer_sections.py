@@ -9,7 +9,11 @@ def safe_get(grb, attr, default="Not available"):
     except:
         return default
 
-def analyze_grib2(file_path):
+def analyze_grib2(file_path, metadata_only=False):
+    """
+    Print the sections of every message; metadata_only=True skips the data
+    statistics (no values are decoded) and the dump of all keys
+    """
     try:
         # Open GRIB2 file
         grbs = pygrib.open(file_path)
@@ -70,6 +74,10 @@ def analyze_grib2(file_path):
             print(f"• Packing method: {safe_get(grb, 'packingType')}")
             print(f"• Missing value: {safe_get(grb, 'missingValue')}")
             
+            if metadata_only:
+                print("\n" + "="*50)
+                continue
+
             # 7 & 8. Bitmap & Data Section
             try:
                 data = grb.values
@@ -99,5 +107,6 @@ def analyze_grib2(file_path):
             grbs.close()
 
 # Usage example
-file_path = 'usa_data.grib2'  # Path to the GRIB2 file to analyze
-analyze_grib2(file_path)
\ No newline at end of file
+if __name__ == "__main__":
+    file_path = 'usa_data.grib2'  # Path to the GRIB2 file to analyze
+    analyze_grib2(file_path)
\ No newline at end of file
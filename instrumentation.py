@@ -0,0 +1,261 @@
+import sys
+import json
+import time
+import traceback
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'quiet': 100}
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process in MB (None if unsupported)
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KB on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class RunRecorder:
+    """
+    Record per-file, per-stage durations and memory of a conversion run
+
+    Events are written as JSON lines to log_path (buffered, one object per
+    line) and printed to the console only when their level reaches
+    verbosity. Per-sweep and per-file events are logged at 'debug', so the
+    default console verbosity ('info') keeps printing off the hot path.
+
+    Parameters:
+    log_path (str): Path of the JSON-lines log file (None: no file)
+    verbosity (str): Minimum level printed to the console
+    log_level (str): Minimum level written to the log file
+    track_allocations (bool): Record the peak Python allocation of every
+        stage with tracemalloc (slow, for debugging memory use)
+    collect_events (bool): Keep log events in memory instead of writing a
+        file (used by worker processes, see merge)
+    """
+    def __init__(self, log_path=None, verbosity='info', log_level='debug', track_allocations=False,
+                 collect_events=False):
+        self.config = {'verbosity': verbosity, 'log_level': log_level, 'track_allocations': track_allocations}
+        self.verbosity = LEVELS[verbosity]
+        self.log_level = LEVELS[log_level]
+        self.track_allocations = track_allocations
+        self._log_file = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.events = [] if collect_events else None
+        self.stage_durations = defaultdict(list)
+        self.file_stages = defaultdict(lambda: defaultdict(float))
+        self.failed_files = []
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def enabled(self, level):
+        """
+        Whether an event of this level would be written anywhere
+        """
+        level = LEVELS[level]
+        return level >= self.verbosity or (self.writes_events and level >= self.log_level)
+
+    @property
+    def writes_events(self):
+        return self._log_file is not None or self.events is not None
+
+    def log(self, level, event, **fields):
+        """
+        Emit one structured event
+
+        Parameters:
+        level (str): One of 'debug', 'info', 'warning', 'error'
+        event (str): Short event name
+        **fields: JSON-serializable event data, 'message' is used for console output
+        """
+        severity = LEVELS[level]
+        if severity >= self.log_level and self.writes_events:
+            record = {'ts': round(time.time(), 6), 'level': level, 'event': event}
+            record.update(fields)
+            line = json.dumps(record, default=str)
+            if self.events is not None:
+                self.events.append(line)
+            else:
+                self._log_file.write(line + '\n')
+        if severity >= self.verbosity:
+            message = fields.get('message')
+            if message is None:
+                message = ', '.join(f"{key}={value}" for key, value in fields.items())
+            prefix = '' if level == 'info' else f"{level.upper()}: "
+            print(f"{prefix}{message}")
+
+    def exception(self, event, error, **fields):
+        """
+        Log an error with its traceback (the traceback goes to the log file only)
+        """
+        self.log('error', event, message=f"{fields.pop('message', event)}: {error}",
+                 error=str(error), traceback=traceback.format_exc(), **fields)
+        if 'file' in fields:
+            self.failed_files.append(fields['file'])
+
+    @contextmanager
+    def stage(self, name, file=None):
+        """
+        Time a pipeline stage and record its duration and memory
+
+        Parameters:
+        name (str): Stage name (open, sweep, geometry, render, save, ...)
+        file (str): Input file the stage belongs to
+        """
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.stage_durations[name].append(duration)
+            if file is not None:
+                self.file_stages[file][name] += duration
+            if self.enabled('debug'):
+                fields = {'stage': name, 'file': file, 'duration_s': round(duration, 6), 'rss_peak_mb': peak_rss_mb()}
+                if self.track_allocations:
+                    fields['alloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                self.log('debug', 'stage', message=f"{name} ({file}): {duration:.3f}s", **fields)
+
+    def file_done(self, file, **fields):
+        """
+        Log the per-stage breakdown of a finished input file
+        """
+        stages = dict(self.file_stages.get(file, {}))
+        total = sum(stages.values())
+        self.log('debug', 'file', message=f"Finished {file} in {total:.3f}s", file=file,
+                 duration_s=round(total, 6), stages=stages, rss_peak_mb=peak_rss_mb(), **fields)
+
+    def state(self):
+        """
+        Picklable snapshot of the recorded data, to be merged by the parent process
+        """
+        return {
+            'stage_durations': dict(self.stage_durations),
+            'file_stages': {f: dict(s) for f, s in self.file_stages.items()},
+            'failed_files': list(self.failed_files),
+            'events': list(self.events or []),
+        }
+
+    def merge(self, state):
+        """
+        Add the data recorded by another recorder (e.g. in a worker process)
+        """
+        for name, values in state['stage_durations'].items():
+            self.stage_durations[name].extend(values)
+        for file, stages in state['file_stages'].items():
+            for name, duration in stages.items():
+                self.file_stages[file][name] += duration
+        self.failed_files.extend(state['failed_files'])
+        if self.events is not None:
+            self.events.extend(state['events'])
+        elif self._log_file is not None:
+            for line in state['events']:
+                self._log_file.write(line + '\n')
+
+    def summary(self, slowest=5):
+        """
+        Aggregate the recorded stages
+
+        Parameters:
+        slowest (int): Number of slowest files to report
+
+        Returns:
+        dict: Per-stage count/total/mean/p50/p95/max, slowest files, failures and peak RSS
+        """
+        stages = {}
+        for name, values in self.stage_durations.items():
+            values = np.asarray(values)
+            stages[name] = {
+                'count': int(values.size),
+                'total_s': float(values.sum()),
+                'mean_s': float(values.mean()),
+                'p50_s': float(np.percentile(values, 50)),
+                'p95_s': float(np.percentile(values, 95)),
+                'max_s': float(values.max()),
+            }
+        file_totals = sorted(((sum(s.values()), f) for f, s in self.file_stages.items()), reverse=True)
+        return {
+            'stages': stages,
+            'files': len(self.file_stages),
+            'slowest_files': [{'file': f, 'duration_s': d} for d, f in file_totals[:slowest]],
+            'failed_files': list(self.failed_files),
+            'rss_peak_mb': peak_rss_mb(),
+        }
+
+    def print_summary(self, slowest=5):
+        """
+        Log the end-of-run summary and print it as a table
+        """
+        summary = self.summary(slowest)
+        self.log('debug', 'summary', message='Run summary', **summary)
+        if self.verbosity > LEVELS['info']:
+            return summary
+
+        print(f"\n{'stage':<12}{'count':>8}{'total s':>10}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+        for name, s in summary['stages'].items():
+            print(f"{name:<12}{s['count']:>8}{s['total_s']:>10.3f}{s['p50_s']:>10.3f}{s['p95_s']:>10.3f}{s['max_s']:>10.3f}")
+        if summary['slowest_files']:
+            print("\nSlowest files:")
+            for entry in summary['slowest_files']:
+                print(f"  {entry['duration_s']:.3f}s  {entry['file']}")
+        if summary['failed_files']:
+            print(f"\nFailed files: {len(summary['failed_files'])}")
+        if summary['rss_peak_mb'] is not None:
+            print(f"Peak RSS: {summary['rss_peak_mb']:.1f} MB")
+        return summary
+
+    def close(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _run_recorded(func, item, recorder_config, collect_events, kwargs):
+    recorder = RunRecorder(collect_events=collect_events, **recorder_config)
+    result = func(item, recorder=recorder, **kwargs)
+    return result, recorder.state()
+
+def map_files(func, files, workers=1, recorder=None, **kwargs):
+    """
+    Call func(file, recorder=..., **kwargs) for every file, optionally in worker processes
+
+    With several workers every process records into its own recorder and
+    the timings and log events are merged into recorder as files finish.
+
+    Parameters:
+    func (callable): Module-level function converting one file
+    files (list): Input files
+    workers (int): Number of worker processes (1: run in this process)
+    recorder (RunRecorder): Recorder of the run
+    **kwargs: Extra arguments passed to func
+
+    Returns:
+    list: Results of func, in the order of files
+    """
+    recorder = recorder or RunRecorder()
+    if workers <= 1 or len(files) <= 1:
+        return [func(file, recorder=recorder, **kwargs) for file in files]
+
+    results = [None] * len(files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run_recorded, func, file, recorder.config, recorder.writes_events, kwargs): i
+                   for i, file in enumerate(files)}
+        for future in as_completed(futures):
+            result, state = future.result()
+            recorder.merge(state)
+            results[futures[future]] = result
+    return results
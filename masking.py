@@ -0,0 +1,134 @@
+import io
+
+import numpy as np
+
+def as_float32(data, dtype=np.float32):
+    """
+    Field as a float32 (or dtype) ndarray with missing values as NaN
+
+    Arrays of the requested type are returned as they are (so they can be
+    masked in place); masked arrays are filled with NaN and other types
+    converted with a single copy.
+    """
+    if np.ma.isMaskedArray(data):
+        return np.ma.filled(data.astype(dtype, copy=False), np.nan)
+    return np.asarray(data, dtype=dtype)
+
+class MaskSpec:
+    """
+    Missing-data and clutter masking rules shared by the NetCDF and GRIB2 paths
+
+    Masked values are set to NaN in place, so every later stage (profiles,
+    renderers, statistics) treats them as missing.
+
+    Parameters:
+    fill_values (tuple): Values marking missing data (e.g. a GRIB2 missingValue)
+    valid_min (float): Values below are invalid (e.g. the MRMS -3 no-coverage flag)
+    valid_max (float): Values above are invalid
+    threshold (float): Echoes below this value are masked (noise/clutter, e.g. 5 dBZ)
+    min_range (float): Radar gates closer than this range (m) are masked
+    max_range (float): Radar gates farther than this range (m) are masked
+    """
+    def __init__(self, fill_values=(), valid_min=None, valid_max=None, threshold=None, min_range=None, max_range=None):
+        self.fill_values = tuple(float(v) for v in np.atleast_1d(fill_values))
+        self.valid_min = valid_min
+        self.valid_max = valid_max
+        self.threshold = threshold
+        self.min_range = min_range
+        self.max_range = max_range
+
+    def with_fill_values(self, *fill_values):
+        """
+        Copy of the spec with additional fill values (e.g. read from a file)
+        """
+        values = [float(v) for v in fill_values if v is not None]
+        return MaskSpec(self.fill_values + tuple(values), self.valid_min, self.valid_max, self.threshold,
+                        self.min_range, self.max_range)
+
+    def gate_slices(self, ranges):
+        """
+        Slices of the last (gate) axis outside min_range/max_range
+
+        Ranges increase along the gates, so the limits are slices and no
+        per-gate comparison is needed.
+        """
+        slices = []
+        if ranges is not None and self.min_range is not None:
+            slices.append(slice(None, int(np.searchsorted(ranges, self.min_range, side='left'))))
+        if ranges is not None and self.max_range is not None:
+            slices.append(slice(int(np.searchsorted(ranges, self.max_range, side='right')), None))
+        return slices
+
+    def apply(self, data, ranges=None, mask=None, dtype=np.float32):
+        """
+        Mask a field in place
+
+        All comparisons write into one reused boolean buffer, and masked
+        values are set to NaN with copyto; no full-size temporary is created
+        per rule.
+
+        Parameters:
+        data (numpy.ndarray): Field; converted once to float32 if needed (see as_float32)
+        ranges (numpy.ndarray): Gate ranges in meters (increasing) of the last axis,
+            used by min_range/max_range
+        mask (numpy.ndarray): Optional boolean buffer with the shape of data
+        dtype (numpy.dtype): Float type of the returned field
+
+        Returns:
+        tuple: (data, mask) float32 field with NaN where masked, and the boolean mask
+        """
+        data = as_float32(data, dtype)
+        if mask is None:
+            mask = np.empty(data.shape, dtype=bool)
+        scratch = np.empty(data.shape, dtype=bool)
+
+        np.isnan(data, out=mask)
+        for fill_value in self.fill_values:
+            np.logical_or(mask, np.equal(data, fill_value, out=scratch), out=mask)
+        with np.errstate(invalid='ignore'):
+            lower = max((v for v in (self.valid_min, self.threshold) if v is not None), default=None)
+            if lower is not None:
+                np.logical_or(mask, np.less(data, lower, out=scratch), out=mask)
+            if self.valid_max is not None:
+                np.logical_or(mask, np.greater(data, self.valid_max, out=scratch), out=mask)
+        for gates in self.gate_slices(ranges):
+            mask[..., gates] = True
+
+        np.copyto(data, np.nan, where=mask)
+        return data, mask
+
+    def to_dict(self):
+        return {'fill_values': list(self.fill_values), 'valid_min': self.valid_min, 'valid_max': self.valid_max,
+                'threshold': self.threshold, 'min_range': self.min_range, 'max_range': self.max_range}
+
+    def __repr__(self):
+        rules = ', '.join(f"{key}={value!r}" for key, value in self.to_dict().items() if value not in (None, []))
+        return f"MaskSpec({rules})"
+
+def apply_mask(data, spec=None, ranges=None, mask=None):
+    """
+    Mask a field in place with a MaskSpec (default: only NaN is missing)
+
+    Returns:
+    tuple: (data, mask), see MaskSpec.apply
+    """
+    return (spec or MaskSpec()).apply(data, ranges, mask)
+
+def encode_bitmask(mask):
+    """
+    Encode a boolean mask with 1 bit per pixel (rows padded to whole bytes, deflated)
+
+    Returns:
+    bytes: .npz data with the packed bits ('bits') and the mask shape ('shape')
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, bits=np.packbits(mask, axis=-1), shape=np.asarray(mask.shape))
+    return buffer.getvalue()
+
+def load_bitmask(path):
+    """
+    Read a mask written by encode_bitmask as a boolean array
+    """
+    with np.load(path) as f:
+        shape = tuple(int(n) for n in f['shape'])
+        return np.unpackbits(f['bits'], axis=-1, count=shape[-1]).astype(bool).reshape(shape)
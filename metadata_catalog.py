@@ -0,0 +1,164 @@
+import os
+import csv
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+NETCDF_PATTERNS = ('*.nc',)
+GRIB2_PATTERNS = ('*.grib2', '*.grb2')
+
+def _join(values, fmt='{}'):
+    return ' '.join(fmt.format(v) for v in values)
+
+def inspect_netcdf(file_path):
+    """
+    Read the header of a CfRadial NetCDF file without decoding any moment data
+
+    Only global attributes, dimensions and the small per-sweep and range
+    coordinate variables are read.
+
+    Parameters:
+    file_path (str): Path to NC file
+
+    Returns:
+    list: One dict (catalog row) for the volume
+    """
+    import netCDF4 as nc
+
+    row = {'file': file_path, 'format': 'netcdf', 'size_mb': os.path.getsize(file_path) / (1024 * 1024)}
+    with nc.Dataset(file_path, 'r') as ds:
+        attrs = ds.ncattrs()
+        for attr in ('instrument_name', 'site_name', 'scan_name', 'time_coverage_start', 'time_coverage_end'):
+            row[attr] = ds.getncattr(attr) if attr in attrs else ''
+
+        variables = ds.variables
+        row['n_sweeps'] = len(ds.dimensions['sweep']) if 'sweep' in ds.dimensions else 0
+        row['n_rays'] = len(ds.dimensions['time']) if 'time' in ds.dimensions else 0
+        if 'fixed_angle' in variables:
+            row['elevations'] = _join(np.asarray(variables['fixed_angle'][:]), '{:.2f}')
+        if 'sweep_start_ray_index' in variables and 'sweep_end_ray_index' in variables:
+            starts = np.asarray(variables['sweep_start_ray_index'][:])
+            ends = np.asarray(variables['sweep_end_ray_index'][:])
+            row['rays_per_sweep'] = _join(ends - starts + 1)
+        if 'range' in variables:
+            ranges = np.asarray(variables['range'][:])
+            row['n_gates'] = ranges.size
+            if ranges.size:
+                row['range_first_m'] = float(ranges[0])
+                row['range_last_m'] = float(ranges[-1])
+        for name in ('latitude', 'longitude', 'altitude'):
+            if name in variables and variables[name].ndim == 0:
+                row[name] = float(variables[name][...])
+
+        point_dims = {'n_points'} if 'n_points' in ds.dimensions else {'time', 'range'}
+        fields = [name for name, var in variables.items()
+                  if var.ndim and set(var.dimensions) <= point_dims and var.dimensions != ('time',) and name != 'range']
+        row['fields'] = _join(fields)
+    return [row]
+
+def inspect_grib2(file_path):
+    """
+    Read the section keys of every GRIB2 message without decoding the data section
+
+    Parameters:
+    file_path (str): Path to GRIB2 file
+
+    Returns:
+    list: One dict (catalog row) per message
+    """
+    import pygrib
+
+    rows = []
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    grbs = pygrib.open(file_path)
+    try:
+        for grb in grbs:
+            keys = set(grb.keys())
+            row = {'file': file_path, 'format': 'grib2', 'size_mb': size_mb, 'message': grb.messagenumber}
+            for key in ('centre', 'name', 'shortName', 'units', 'typeOfLevel', 'level', 'gridType', 'Ni', 'Nj',
+                        'latitudeOfFirstGridPointInDegrees', 'longitudeOfFirstGridPointInDegrees',
+                        'latitudeOfLastGridPointInDegrees', 'longitudeOfLastGridPointInDegrees',
+                        'iDirectionIncrementInDegrees', 'jDirectionIncrementInDegrees',
+                        'jScansPositively', 'packingType', 'missingValue'):
+                row[key] = grb[key] if key in keys else ''
+            try:
+                row['validDate'] = grb.validDate.isoformat()
+                row['analDate'] = grb.analDate.isoformat()
+            except (AttributeError, RuntimeError):
+                row['validDate'] = row['analDate'] = ''
+            rows.append(row)
+    finally:
+        grbs.close()
+    return rows
+
+def inspect_file(file_path):
+    """
+    Metadata rows of a NetCDF or GRIB2 file; errors become a row with an 'error' column
+    """
+    try:
+        if file_path.endswith('.nc'):
+            return inspect_netcdf(file_path)
+        return inspect_grib2(file_path)
+    except Exception as e:
+        return [{'file': file_path, 'error': str(e)}]
+
+def find_data_files(input_dir, patterns=NETCDF_PATTERNS + GRIB2_PATTERNS, recursive=True):
+    files = []
+    for pattern in patterns:
+        if recursive:
+            files.extend(glob.glob(os.path.join(input_dir, '**', pattern), recursive=True))
+        else:
+            files.extend(glob.glob(os.path.join(input_dir, pattern)))
+    return sorted(set(files))
+
+def build_catalog(input_dir, output_path='catalog.csv', workers=4, patterns=NETCDF_PATTERNS + GRIB2_PATTERNS):
+    """
+    Inspect every NetCDF/GRIB2 file of a directory in parallel and write a CSV catalog
+
+    Parameters:
+    input_dir (str or list): Directory to scan recursively, or list of files
+    output_path (str): Path of the CSV file to create
+    workers (int): Number of worker processes
+    patterns (tuple): File name patterns to include
+
+    Returns:
+    list: Catalog rows
+    """
+    if isinstance(input_dir, (list, tuple)):
+        files = list(input_dir)
+    else:
+        files = find_data_files(input_dir, patterns)
+    print(f"Inspecting {len(files)} files with {workers} workers")
+
+    rows = []
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for file_rows in executor.map(inspect_file, files, chunksize=max(1, len(files) // (workers * 8))):
+                rows.extend(file_rows)
+    else:
+        for file_path in files:
+            rows.extend(inspect_file(file_path))
+
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    errors = sum(1 for row in rows if row.get('error'))
+    print(f"Catalog with {len(rows)} rows written to {output_path} ({errors} unreadable files)")
+    return rows
+
+def load_catalog(catalog_path):
+    """
+    Read a catalog CSV back as a list of dicts (all values are strings)
+    """
+    with open(catalog_path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+if __name__ == "__main__":
+    # Usage example
+    build_catalog('raw_data', 'catalog.csv')
@@ -1,156 +1,646 @@
 import xarray as xr
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import glob
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-import traceback
 
-def radar_to_cartesian(file_path, output_dir, variable='DBZH'):
+from instrumentation import RunRecorder, map_files, _run_recorded
+from renderer import get_renderer, encode_frame, encode_image, write_atomic
+from normalization import RADAR_DBZ_PROFILE, PackedProfile, get_profile, radar_profile
+from masking import MaskSpec, encode_bitmask
+from shared_buffers import SharedBufferPool, attach
+
+# 10 x 10 inch figure, as produced by the original pyplot version
+RADAR_RENDER_CONFIG = {'figsize': (10, 10), 'aspect': 'equal'}
+
+# float32: decoded fields and geometry stay float32, float64: promoted like the
+# original scripts, packed: raw integers mapped by a PackedProfile lookup table
+PRECISIONS = ('float32', 'float64', 'packed')
+
+def get_sweep_bounds(ds, sweep_idx):
+    """
+    Return the first and last ray index of a sweep
+    
+    Parameters:
+    ds (xarray.Dataset): Opened CfRadial dataset
+    sweep_idx (int): Sweep number
+    
+    Returns:
+    tuple: (start_idx, end_idx), both inclusive
+    """
+    start_idx = int(ds.sweep_start_ray_index[sweep_idx].values)
+    end_idx = int(ds.sweep_end_ray_index[sweep_idx].values)
+    return start_idx, end_idx
+
+def extract_sweep(ds, variable, start_idx, end_idx):
+    """
+    Extract one sweep of a variable as a (rays, gates) array
+    
+    Only the gates belonging to the sweep are decoded, instead of the
+    whole n_points variable.
+    
+    Parameters:
+    ds (xarray.Dataset): Opened CfRadial dataset
+    variable (str): Variable name to extract
+    start_idx (int): First ray index of the sweep
+    end_idx (int): Last ray index of the sweep (inclusive)
+    
+    Returns:
+    numpy.ndarray: Sweep data with shape (rays, gates)
+    """
+    n_gates = len(ds['range'])
+    start_gate_idx = start_idx * n_gates
+    end_gate_idx = (end_idx + 1) * n_gates
+    return ds[variable][start_gate_idx:end_gate_idx].values.reshape(-1, n_gates)
+
+def polar_to_cartesian(azimuths, ranges, dtype=np.float32):
+    """
+    Convert ray azimuths and gate ranges to cartesian coordinates
+    
+    Parameters:
+    azimuths (numpy.ndarray): Ray azimuths in degrees
+    ranges (numpy.ndarray): Gate ranges in meters
+    dtype (numpy.dtype): Float type of the computation and the result
+    
+    Returns:
+    tuple: (x, y) arrays in km with shape (rays, gates)
+    """
+    azimuths = np.radians(np.asarray(azimuths).astype(dtype, copy=False))
+    ranges = np.asarray(ranges).astype(dtype, copy=False)
+    
+    r, az = np.meshgrid(ranges, azimuths)
+    
+    x = r * np.sin(az)
+    y = r * np.cos(az)
+    return x/1000, y/1000
+
+def sweep_geometry(ds, start_idx, end_idx, n_rays, dtype=np.float32):
+    """
+    Convert the polar coordinates of a sweep to cartesian coordinates
+    
+    Parameters:
+    ds (xarray.Dataset): Opened CfRadial dataset
+    start_idx (int): First ray index of the sweep
+    end_idx (int): Last ray index of the sweep (inclusive)
+    n_rays (int): Number of rays in the extracted sweep data
+    dtype (numpy.dtype): Float type of the computation and the result
+    
+    Returns:
+    tuple: (x, y) arrays in km with shape (rays, gates)
+    """
+    return polar_to_cartesian(ds.azimuth[start_idx:end_idx+1].values[:n_rays], ds.range.values, dtype)
+
+def render_sweep(x, y, sweep_data, dpi=300, profile=RADAR_DBZ_PROFILE):
+    """
+    Draw a sweep as a borderless grayscale image
+    
+    The canvas of the calling thread is reused; sweeps with the same
+    geometry as the previous one only update the mesh data. Values are
+    mapped to gray levels with the profile before drawing; missing gates
+    stay masked, so they are not painted (as in the original pcolormesh of
+    the NaN field) instead of being drawn with the missing level.
+    
+    Returns:
+    AggRenderer: Renderer holding the rasterized sweep
+    """
+    renderer = get_renderer('agg', dpi=dpi, **RADAR_RENDER_CONFIG)
+    levels = np.ma.masked_array(profile.apply(sweep_data), mask=profile.mask(sweep_data))
+    renderer.draw(x, y, levels, vmin=0, vmax=255)
+    return renderer
+
+def render_sweep_raster(azimuths, ranges, sweep_data, size=1024, profile=RADAR_DBZ_PROFILE):
+    """
+    Rasterize a sweep directly onto a size x size grayscale image
+    
+    Parameters:
+    azimuths (numpy.ndarray): Ray azimuths in degrees
+    ranges (numpy.ndarray): Gate ranges in meters
+    sweep_data (numpy.ndarray): Sweep data with shape (rays, gates)
+    size (int): Output image size in pixels
+    profile (NormalizationProfile): Value to gray level mapping
+    
+    Returns:
+    RasterRenderer: Renderer holding the rasterized sweep
+    """
+    renderer = get_renderer('raster', size=size)
+    renderer.draw_polar(azimuths, ranges, sweep_data, profile=profile)
+    return renderer
+
+def open_volume(file_path, variable, recorder, precision='float32'):
+    """
+    Open a CfRadial file and check that it holds the variable(s) and the sweep indices
+    
+    Returns:
+    xarray.Dataset: Opened dataset, or None (warning logged) if the file cannot be converted
+    """
+    recorder.log('debug', 'open', message=f"Processing file: {file_path}", file=file_path)
+    with recorder.stage('open', file_path):
+        # Packed mode keeps the stored integers (no scaling, no fill value masking)
+        ds = xr.open_dataset(file_path, mask_and_scale=(precision != 'packed'))
+    
+    # Check dataset structure
+    if recorder.enabled('debug'):
+        recorder.log('debug', 'dataset', message=f"Dataset dimensions: {dict(ds.sizes)}",
+                     file=file_path, variables=list(ds.variables.keys()), dims=dict(ds.sizes))
+    
+    # Check if variable exists
+    for name in [variable] if isinstance(variable, str) else variable:
+        if name not in ds.variables:
+            recorder.log('warning', 'missing_variable',
+                         message=f"Variable '{name}' not found in {file_path}. Available variables: {list(ds.variables.keys())}",
+                         file=file_path, variable=name)
+            ds.close()
+            return None
+    
+    # Check if sweep_start_ray_index exists
+    if 'sweep_start_ray_index' not in ds.variables:
+        recorder.log('warning', 'missing_variable',
+                     message=f"'sweep_start_ray_index' not found in {file_path}",
+                     file=file_path, variable='sweep_start_ray_index')
+        ds.close()
+        return None
+    return ds
+
+def volume_packing(ds, variable):
+    """
+    Packing of a variable as (dtype, scale_factor, add_offset, fill_value), the PackedProfile arguments
+    """
+    attrs = ds[variable].attrs
+    fill_value = attrs.get('_FillValue')
+    return (ds[variable].dtype.str, float(attrs.get('scale_factor', 1.0)), float(attrs.get('add_offset', 0.0)),
+            None if fill_value is None else int(fill_value))
+
+def volume_profile(ds, variable, profile, mask_spec, precision):
+    """
+    Profile used for the sweeps of a volume
+    
+    In packed precision the profile is wrapped in a PackedProfile built from
+    the packing attributes of the variable; otherwise it is returned as is.
+    """
+    if precision != 'packed':
+        return profile
+    return PackedProfile(profile, *volume_packing(ds, variable), mask_spec)
+
+def draw_sweep(sweep_data, azimuths, ranges, profile, recorder, file_path, engine='agg', dpi=300, size=1024,
+               mask_spec=None, mask_output=False, precision='float32', xy=None):
+    """
+    Mask and render one extracted sweep
+    
+    Parameters:
+    sweep_data (numpy.ndarray): Sweep data with shape (rays, gates); masked in place
+    azimuths (numpy.ndarray): Ray azimuths in degrees, one per row of sweep_data
+    ranges (numpy.ndarray): Gate ranges in meters
+    profile (NormalizationProfile or PackedProfile): Value to gray level mapping (see volume_profile)
+    recorder (RunRecorder): Collects stage timings
+    file_path (str): Source file the stage timings are recorded for
+    xy (tuple): (x, y) of polar_to_cartesian, when already computed for another variable (agg engine)
+    Other parameters: see radar_to_cartesian
+    
+    Returns:
+    tuple: (renderer, mask) renderer holding the frame, and the boolean sweep
+        mask (None in packed precision unless mask_output is set)
+    """
+    mask_spec = mask_spec or MaskSpec()
+    float_type = np.float64 if precision == 'float64' else np.float32
+    with recorder.stage('mask', file_path):
+        if precision == 'packed':
+            sweep_data = profile.mask_gates(sweep_data, ranges)
+            sweep_mask = profile.mask(sweep_data) if mask_output else None
+        else:
+            sweep_data, sweep_mask = mask_spec.apply(sweep_data, ranges, dtype=float_type)
+    
+    if engine == 'raster':
+        with recorder.stage('render', file_path):
+            renderer = render_sweep_raster(azimuths, ranges, sweep_data, size, profile)
+    else:
+        if xy is None:
+            with recorder.stage('geometry', file_path):
+                xy = polar_to_cartesian(azimuths, ranges, float_type)
+        x, y = xy
+        
+        with recorder.stage('render', file_path):
+            renderer = render_sweep(x, y, sweep_data, dpi, profile)
+    return renderer, sweep_mask
+
+def write_sweep(sweep_data, azimuths, ranges, output_path, profile, recorder, file_path, engine='agg',
+                output_format='png', dpi=300, size=1024, mask_spec=None, mask_output=False, precision='float32',
+                xy=None):
+    """
+    Mask, render, encode and write one extracted sweep (see draw_sweep)
+    
+    Returns:
+    str: output_path
+    """
+    renderer, sweep_mask = draw_sweep(sweep_data, azimuths, ranges, profile, recorder, file_path, engine, dpi, size,
+                                      mask_spec, mask_output, precision, xy)
+    
+    with recorder.stage('encode', file_path):
+        encoded = encode_frame(renderer, output_format)
+    
+    with recorder.stage('write', file_path):
+        write_atomic(output_path, encoded)
+        if mask_output:
+            write_atomic(f"{os.path.splitext(output_path)[0]}_mask.npz",
+                         encode_bitmask(renderer.rasterize_mask(sweep_mask)))
+    return output_path
+
+def write_channels(sweeps, azimuths, ranges, output_path, profiles, recorder, file_path, engine='agg',
+                   output_format='png', dpi=300, size=1024, mask_spec=None, mask_output=False, precision='float32',
+                   xy=None):
+    """
+    Render the variables of a sweep and write them as the channels of one image
+    
+    Parameters:
+    sweeps (dict): Sweep data (rays, gates) by variable, in channel order; masked in place
+    profiles (dict): Profile by variable (see volume_profile)
+    Other parameters: see write_sweep
+    
+    Returns:
+    str: output_path
+    """
+    frames = []
+    masks = []
+    for name, sweep_data in sweeps.items():
+        renderer, sweep_mask = draw_sweep(sweep_data, azimuths, ranges, profiles[name], recorder, file_path, engine,
+                                          dpi, size, mask_spec, mask_output, precision, xy)
+        # The renderer reuses its image buffer for the next variable
+        frames.append(np.array(renderer.to_gray()))
+        if mask_output:
+            masks.append(renderer.rasterize_mask(sweep_mask))
+    
+    with recorder.stage('encode', file_path):
+        encoded = encode_image(np.stack(frames, axis=-1), output_format)
+    
+    with recorder.stage('write', file_path):
+        write_atomic(output_path, encoded)
+        if mask_output:
+            write_atomic(f"{os.path.splitext(output_path)[0]}_mask.npz", encode_bitmask(np.stack(masks, axis=-1)))
+    return output_path
+
+def sweep_outputs(output_dir, base_filename, sweep_idx, output_format, variables, stack_channels=False):
+    """
+    Output path(s) of a sweep, by variable
+    
+    One variable or stacked channels: '<output_dir>/<base>_sweep_<n>.<format>'
+    (key None when stacked); several variables: one subdirectory per variable.
+    """
+    output_filename = f'{base_filename}_sweep_{sweep_idx}.{output_format}'
+    if stack_channels:
+        return {None: os.path.join(output_dir, output_filename)}
+    if len(variables) == 1:
+        return {variables[0]: os.path.join(output_dir, output_filename)}
+    return {name: os.path.join(output_dir, name, output_filename) for name in variables}
+
+def radar_to_cartesian(file_path, output_dir, variable='DBZH', recorder=None, engine='agg',
+                       output_format='png', dpi=300, size=1024, resume=False, profile=None, mask_spec=None,
+                       mask_output=False, precision='float32', stack_channels=False):
     """
     Convert radar data to cartesian coordinates and save as PNG
     
+    Several variables are rendered in one pass over the volume: the dataset
+    is opened once, and the sweep indices, azimuths and geometry (cartesian
+    mesh or raster index map) are shared by the variables of a sweep.
+    
     Parameters:
     file_path (str): Path to NC file
     output_dir (str): Path to save PNG files
-    variable (str): Variable name to convert
+    variable (str or list): Variable name to convert, or several names (e.g.
+        ['DBZH', 'ZDR', 'KDP', 'RHOHV', 'VELH']); unless stacked, every
+        variable is written to its own subdirectory of output_dir
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    engine (str): 'agg' (matplotlib pcolormesh) or 'raster' (direct index-map rasterizer)
+    output_format (str): 'png' image or 'npy' uint8 gray array
+    dpi (int): Resolution of the 10 x 10 inch agg image
+    size (int): Image size in pixels of the raster engine
+    resume (bool): Skip sweeps whose output file already exists
+    profile (NormalizationProfile, str or dict): Value to gray level mapping, the
+        path of a saved profile, or a dict of them by variable (default:
+        normalization.RADAR_PROFILES, -20 ~ 80 dBZ linear for DBZH)
+    mask_spec (MaskSpec): Masking rules (fill values, echo threshold, gate
+        range limits); the variable _FillValue is always masked
+    mask_output (bool): Also write the mask of every image as a 1-bit
+        '<image>_mask.npz' (see masking.load_bitmask); raster engine only
+    precision (str): 'float32' (fields and geometry in float32), 'float64'
+        (promoted, as the original scripts) or 'packed' (the raw integers
+        are mapped through a PackedProfile without unpacking them)
+    stack_channels (bool): Write the variables of a sweep as the channels of one
+        (height, width, variables) image, in the order of variable (png: 1 to
+        4 channels, as L/LA/RGB/RGBA; npy: any number)
     
     Returns:
     list: List of paths to generated PNG files
     """
+    recorder = recorder or RunRecorder()
+    variables = [variable] if isinstance(variable, str) else list(variable)
+    mask_spec = mask_spec or MaskSpec()
+    if mask_output and engine != 'raster':
+        raise ValueError("mask_output needs the raster engine (the mask is aligned with the image pixels)")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (choose from {', '.join(PRECISIONS)})")
+    if stack_channels and output_format == 'png' and len(variables) > 4:
+        raise ValueError(f"A PNG holds at most 4 channels, got {len(variables)} variables (use the npy format)")
+    float_type = np.float64 if precision == 'float64' else np.float32
     generated_files = []
     try:
-        print(f"\nProcessing file: {file_path}")
-        ds = xr.open_dataset(file_path)
-        
-        # Check dataset structure
-        print(f"Dataset variables: {list(ds.variables.keys())}")
-        print(f"Dataset dimensions: {ds.dims}")
-        
-        # Check if variable exists
-        if variable not in ds.variables:
-            print(f"Warning: Variable '{variable}' not found in dataset. Available variables: {list(ds.variables.keys())}")
+        ds = open_volume(file_path, variables, recorder, precision)
+        if ds is None:
             return generated_files
         
-        # Check if sweep_start_ray_index exists
-        if 'sweep_start_ray_index' not in ds.variables:
-            print("Warning: 'sweep_start_ray_index' not found in dataset")
-            return generated_files
-            
         base_filename = os.path.splitext(os.path.basename(file_path))[0]
-        
-        print(f"Number of sweeps: {len(ds.sweep_start_ray_index)}")
+        ranges = ds.range.values
+        profiles = {name: volume_profile(ds, name, radar_profile(name, profile), mask_spec, precision)
+                    for name in variables}
+        if len(variables) > 1 and not stack_channels:
+            for name in variables:
+                os.makedirs(os.path.join(output_dir, name), exist_ok=True)
         
         for sweep_idx in range(len(ds.sweep_start_ray_index)):
+            output_paths = sweep_outputs(output_dir, base_filename, sweep_idx, output_format, variables,
+                                         stack_channels)
+            if resume and all(os.path.exists(path) for path in output_paths.values()):
+                generated_files.extend(output_paths.values())
+                recorder.log('debug', 'skipped', message=f"Already converted: sweep {sweep_idx} of {file_path}",
+                             file=file_path, sweep=sweep_idx, output=list(output_paths.values()))
+                continue
+            
             try:
-                start_idx = ds.sweep_start_ray_index[sweep_idx].values
-                end_idx = ds.sweep_end_ray_index[sweep_idx].values
-                
-                print(f"Processing sweep {sweep_idx}: start_idx={start_idx}, end_idx={end_idx}")
-                
-                start_gate_idx = start_idx * len(ds['range'])
-                end_gate_idx = (end_idx + 1) * len(ds['range'])
-                sweep_data = ds[variable].values[start_gate_idx:end_gate_idx].reshape(-1, len(ds['range']))
-                
-                print(f"Sweep data shape: {sweep_data.shape}")
+                with recorder.stage('sweep', file_path):
+                    start_idx, end_idx = get_sweep_bounds(ds, sweep_idx)
+                    sweeps = {name: extract_sweep(ds, name, start_idx, end_idx) for name in variables}
+                    azimuths = ds.azimuth[start_idx:end_idx+1].values
+                sweep_data = sweeps[variables[0]]
                 
                 if sweep_data.size > 0:
-                    azimuths = np.radians(ds.azimuth[start_idx:end_idx+1].values)
-                    ranges = ds.range.values
-                    
-                    r, az = np.meshgrid(ranges, azimuths[:sweep_data.shape[0]])
-                    
-                    x = r * np.sin(az)
-                    y = r * np.cos(az)
-                    
-                    fig = plt.figure(figsize=(10, 10), facecolor='black')
-                    ax = plt.axes(facecolor='black')
+                    azimuths = azimuths[:sweep_data.shape[0]]
+                    # The cartesian mesh is computed once for all variables of the sweep
+                    xy = None
+                    if engine != 'raster' and len(variables) > 1:
+                        with recorder.stage('geometry', file_path):
+                            xy = polar_to_cartesian(azimuths, ranges, float_type)
                     
-                    mesh = ax.pcolormesh(x/1000, y/1000, sweep_data,
-                                       cmap='Greys_r',
-                                       vmin=-20,
-                                       vmax=80)
-                    
-                    ax.set_aspect('equal')
-                    ax.set_xticks([])
-                    ax.set_yticks([])
-                    ax.set_xticklabels([])
-                    ax.set_yticklabels([])
-                    plt.axis('off')
-                    
-                    plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
-                    plt.margins(0,0)
-                    
-                    output_filename = f'{base_filename}_sweep_{sweep_idx}.png'
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    plt.savefig(output_path,
-                               bbox_inches='tight',
-                               pad_inches=0,
-                               dpi=300,
-                               facecolor='black',
-                               edgecolor='none')
-                    plt.close()
-                    
-                    generated_files.append(output_path)
-                    print(f"Generated: {output_path}")
+                    if stack_channels:
+                        write_channels(sweeps, azimuths, ranges, output_paths[None], profiles, recorder, file_path,
+                                       engine, output_format, dpi, size, mask_spec, mask_output, precision, xy)
+                    else:
+                        for name in variables:
+                            write_sweep(sweeps[name], azimuths, ranges, output_paths[name], profiles[name],
+                                        recorder, file_path, engine, output_format, dpi, size, mask_spec,
+                                        mask_output, precision, xy)
+                    generated_files.extend(output_paths.values())
+                    recorder.log('debug', 'generated', message=f"Generated: {', '.join(output_paths.values())}",
+                                 file=file_path, sweep=sweep_idx, output=list(output_paths.values()),
+                                 shape=sweep_data.shape)
                 else:
-                    print(f"Warning: Empty sweep data for sweep {sweep_idx}")
-                    
+                    recorder.log('warning', 'empty_sweep', message=f"Empty sweep data for sweep {sweep_idx} in {file_path}",
+                                 file=file_path, sweep=sweep_idx)
             except Exception as sweep_error:
-                print(f"Error processing sweep {sweep_idx}: {str(sweep_error)}")
-                print(traceback.format_exc())
+                recorder.exception('sweep_failed', sweep_error, message=f"Error processing sweep {sweep_idx} of {file_path}",
+                                   file=file_path, sweep=sweep_idx)
                 continue
                 
         ds.close()
         return generated_files
     
     except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
-        print(traceback.format_exc())
+        recorder.exception('file_failed', e, message=f"Error processing {file_path}", file=file_path)
         return generated_files
+    finally:
+        recorder.file_done(file_path, outputs=len(generated_files))
+
+# State of a convert_shared render worker, set once per process by _init_shared_worker
+_worker_state = {}
+
+def _init_shared_worker(profile, mask_spec):
+    # The profile is sent once per worker instead of with every task; packed
+    # profiles (and their lookup tables) are built here once per packing
+    _worker_state.clear()
+    _worker_state.update(profile=profile, mask_spec=mask_spec, packed={}, scratch={})
+
+def _worker_profile(packing):
+    if packing is None:
+        return _worker_state['profile']
+    packed = _worker_state['packed']
+    if packing not in packed:
+        packed[packing] = PackedProfile(_worker_state['profile'], *packing, _worker_state['mask_spec'])
+    return packed[packing]
 
-def process_radar_files(input_dir, output_dir, zip_path):
+def _worker_scratch(shape, dtype):
+    # Buffer of this worker reused for every sweep (grown when a sweep is larger)
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = _worker_state['scratch'].get(dtype)
+    if buffer is None or buffer.size < size:
+        buffer = _worker_state['scratch'][dtype] = np.empty(size, dtype=dtype)
+    return buffer[:size].reshape(shape)
+
+def _render_shared_sweep(task, recorder=None, **options):
+    """
+    Worker side of convert_shared: render one sweep of a volume held in shared memory
+    """
+    handle, start_gate, end_gate, n_gates, azimuths, ranges, output_path, file_path, sweep_idx, packing = task
+    try:
+        view = attach(handle)[start_gate:end_gate].reshape(-1, n_gates)
+        if view.size == 0:
+            recorder.log('warning', 'empty_sweep', message=f"Empty sweep data for sweep {sweep_idx} in {file_path}",
+                         file=file_path, sweep=sweep_idx)
+            return None
+        with recorder.stage('sweep', file_path):
+            # Masking works in place, so the read-only shared sweep is masked in the scratch buffer
+            sweep_data = _worker_scratch(view.shape, view.dtype)
+            np.copyto(sweep_data, view)
+            profile = _worker_profile(packing)
+        write_sweep(sweep_data, azimuths[:sweep_data.shape[0]], ranges, output_path, profile, recorder,
+                    file_path, **options)
+        recorder.log('debug', 'generated', message=f"Generated: {output_path}",
+                     file=file_path, sweep=sweep_idx, output=output_path, shape=sweep_data.shape)
+        return output_path
+    except Exception as sweep_error:
+        recorder.exception('sweep_failed', sweep_error, message=f"Error processing sweep {sweep_idx} of {file_path}",
+                           file=file_path, sweep=sweep_idx)
+        return None
+
+def convert_shared(nc_files, output_dir, variable='DBZH', workers=2, recorder=None, prefetch=2, engine='agg',
+                   output_format='png', dpi=300, size=1024, resume=False, profile=None, mask_spec=None,
+                   mask_output=False, precision='float32', stack_channels=False):
+    """
+    Convert NC files with one reader (this process) and per-sweep render workers
+    
+    Every volume is opened and decoded once here and copied into a block of
+    a SharedBufferPool; the render tasks only carry the block handle and the
+    gate slice of their sweep, so the decoded variable is never pickled.
+    The profile goes to every worker once, through the pool initializer, and
+    workers mask each sweep in a scratch buffer they reuse.
+    A block is returned to the pool when the last sweep of its volume is
+    done, and at most prefetch volumes are held at once.
+    
+    Parameters:
+    nc_files (list): NC files
+    output_dir (str): Path to save PNG files
+    variable (str): Variable name to convert
+    workers (int): Number of render processes
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    prefetch (int): Maximum number of decoded volumes in shared memory (at least 1)
+    stack_channels (bool): Not supported (one variable per image); must be False
+    Other parameters: see radar_to_cartesian
+    
+    Returns:
+    list: Generated files per input file, in the order of nc_files
+    """
+    recorder = recorder or RunRecorder()
+    if not isinstance(variable, str):
+        raise ValueError("The shared-memory path converts one variable (use radar_to_cartesian for several)")
+    if stack_channels:
+        raise ValueError("The shared-memory path does not stack channels (use radar_to_cartesian)")
+    profile = radar_profile(variable, profile)
+    mask_spec = mask_spec or MaskSpec()
+    if mask_output and engine != 'raster':
+        raise ValueError("mask_output needs the raster engine (the mask is aligned with the image pixels)")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (choose from {', '.join(PRECISIONS)})")
+    # At least one volume in flight (the reader waits while prefetch blocks are in use)
+    workers = max(1, workers)
+    prefetch = max(1, prefetch)
+    options = {'engine': engine, 'output_format': output_format, 'dpi': dpi, 'size': size,
+               'mask_spec': mask_spec, 'mask_output': mask_output, 'precision': precision}
+    results = [[] for _ in nc_files]
+    remaining = {}
+    pending = {}
+    
+    def collect(done):
+        for future in done:
+            handle, index = pending.pop(future)
+            try:
+                output_path, state = future.result()
+                recorder.merge(state)
+                if output_path is not None:
+                    results[index].append(output_path)
+            except Exception as e:
+                recorder.exception('sweep_failed', e, message=f"Render worker failed for {nc_files[index]}",
+                                   file=nc_files[index])
+            pool.release(handle)
+            remaining[index] -= 1
+            if remaining[index] == 0:
+                recorder.file_done(nc_files[index], outputs=len(results[index]))
+    
+    with SharedBufferPool(max_free_blocks=prefetch) as pool, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_shared_worker,
+                                initargs=(profile, mask_spec)) as executor:
+        for index, file_path in enumerate(nc_files):
+            while pool.in_use >= prefetch:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            try:
+                ds = open_volume(file_path, variable, recorder, precision)
+                if ds is None:
+                    recorder.file_done(file_path, outputs=0)
+                    continue
+                base_filename = os.path.splitext(os.path.basename(file_path))[0]
+                tasks = []
+                for sweep_idx in range(len(ds.sweep_start_ray_index)):
+                    output_path = os.path.join(output_dir, f'{base_filename}_sweep_{sweep_idx}.{output_format}')
+                    if resume and os.path.exists(output_path):
+                        results[index].append(output_path)
+                        continue
+                    tasks.append((sweep_idx, output_path) + get_sweep_bounds(ds, sweep_idx))
+                if not tasks:
+                    ds.close()
+                    recorder.file_done(file_path, outputs=len(results[index]))
+                    continue
+                
+                with recorder.stage('decode', file_path):
+                    data = ds[variable].values
+                    azimuths = ds.azimuth.values
+                    ranges = ds.range.values
+                    packing = volume_packing(ds, variable) if precision == 'packed' else None
+                ds.close()
+                with recorder.stage('share', file_path):
+                    handle = pool.put(data, refs=len(tasks))
+                del data
+            except Exception as e:
+                recorder.exception('file_failed', e, message=f"Error processing {file_path}", file=file_path)
+                recorder.file_done(file_path, outputs=len(results[index]))
+                continue
+            
+            n_gates = len(ranges)
+            remaining[index] = len(tasks)
+            for sweep_idx, output_path, start_idx, end_idx in tasks:
+                task = (handle, start_idx * n_gates, (end_idx + 1) * n_gates, n_gates,
+                        azimuths[start_idx:end_idx+1], ranges, output_path, file_path, sweep_idx, packing)
+                future = executor.submit(_run_recorded, _render_shared_sweep, task, recorder.config,
+                                         recorder.writes_events, options)
+                pending[future] = (handle, index)
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    return results
+
+def create_zip(files, output_dir, zip_path, recorder):
+    """
+    Compress generated files to ZIP, keeping their paths relative to output_dir
+    """
+    if not files:
+        recorder.log('warning', 'zip_skipped', message="No PNG files were generated, skipping ZIP creation")
+        return
+    recorder.log('info', 'zip', message=f"Creating ZIP file at {zip_path}...", zip_path=zip_path)
+    with recorder.stage('zip'):
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for file in files:
+                arcname = os.path.relpath(file, output_dir)
+                zipf.write(file, arcname)
+
+def process_radar_files(input_dir, output_dir, zip_path=None, variable='DBZH', workers=1, recorder=None,
+                        shared_memory=False, **options):
     """
     Process all NC files in the specified directory and compress results to ZIP
     
     Parameters:
-    input_dir (str): Path to directory with NC files
+    input_dir (str or list): Path to directory with NC files, or list of NC files
     output_dir (str): Path to directory for saving PNG files
-    zip_path (str): Path to final ZIP file
+    zip_path (str): Path to final ZIP file (None: no ZIP file)
+    variable (str or list): Variable name(s) to convert, see radar_to_cartesian
+    workers (int): Number of worker processes
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    shared_memory (bool): Decode every volume once in this process and render its
+        sweeps in the workers through shared memory (see convert_shared)
+    **options: Rendering options of radar_to_cartesian (engine, output_format, dpi, size, resume, profile,
+        mask_spec, mask_output, precision, stack_channels)
+    
+    Returns:
+    dict: End-of-run summary from RunRecorder.summary
     """
+    recorder = recorder or RunRecorder()
     os.makedirs(output_dir, exist_ok=True)
+    # Load a saved profile once instead of in every worker call
+    if isinstance(options.get('profile'), dict):
+        options['profile'] = {name: get_profile(profile) for name, profile in options['profile'].items()}
+    elif options.get('profile') is not None:
+        options['profile'] = get_profile(options['profile'])
     
-    nc_files = glob.glob(os.path.join(input_dir, "*.nc"))
-    print(f"Found {len(nc_files)} NC files")
+    if isinstance(input_dir, (list, tuple)):
+        nc_files = list(input_dir)
+    else:
+        nc_files = sorted(glob.glob(os.path.join(input_dir, "*.nc")))
+    recorder.log('info', 'start', message=f"Found {len(nc_files)} NC files", input_dir=str(input_dir), files=len(nc_files))
     
     all_generated_files = []
-    
-    for i, nc_file in enumerate(nc_files, 1):
-        print(f"\nProcessing file {i}/{len(nc_files)}: {nc_file}")
-        try:
-            generated_files = radar_to_cartesian(nc_file, output_dir)
-            all_generated_files.extend(generated_files)
-        except Exception as e:
-            print(f"Failed to process {nc_file}: {str(e)}")
-            print(traceback.format_exc())
-            continue
-    
-    if all_generated_files:
-        print(f"\nCreating ZIP file at {zip_path}...")
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file in all_generated_files:
-                arcname = os.path.relpath(file, output_dir)
-                zipf.write(file, arcname)
-        print("ZIP file created successfully")
+    if shared_memory and workers > 1:
+        results = convert_shared(nc_files, output_dir, variable, workers, recorder, **options)
     else:
-        print("\nNo PNG files were generated, skipping ZIP creation")
+        results = map_files(radar_to_cartesian, nc_files, workers, recorder,
+                            output_dir=output_dir, variable=variable, **options)
+    for generated_files in results:
+        all_generated_files.extend(generated_files)
     
-    print(f"\nProcessing complete.")
-    print(f"Total files processed: {len(nc_files)}")
-    print(f"Total PNG files generated: {len(all_generated_files)}")
-    print(f"ZIP file created at: {zip_path}")
+    if zip_path is not None:
+        create_zip(all_generated_files, output_dir, zip_path, recorder)
+    
+    recorder.log('info', 'done',
+                 message=f"Processing complete. {len(nc_files)} files processed, {len(all_generated_files)} output files generated",
+                 files=len(nc_files), outputs=len(all_generated_files), zip_path=zip_path)
+    return recorder.print_summary()
 
 # Usage example
 if __name__ == "__main__":
@@ -158,4 +648,7 @@ if __name__ == "__main__":
     output_directory = "D:\GLP\Korea_Climate_Data\KoreanPngDataset"  # Directory to save PNG files
     zip_file_path = "D:\GLP\Korea_Climate_Data/KoreaClimateDataset.zip"  # Path to final ZIP file
     
-    process_radar_files(input_directory, output_directory, zip_file_path)
\ No newline at end of file
+    log_file_path = "D:\GLP\Korea_Climate_Data/conversion_log.jsonl"  # Structured JSON-lines log
+    
+    with RunRecorder(log_path=log_file_path) as recorder:
+        process_radar_files(input_directory, output_directory, zip_file_path, recorder=recorder)
\ No newline at end of file
@@ -2,6 +2,8 @@ import xarray as xr
 import matplotlib.pyplot as plt
 import numpy as np
 
+from normalization import RADAR_DBZ_PROFILE
+
 def radar_to_cartesian(file_path, variable='DBZH'):
    ds = xr.open_dataset(file_path)
    
@@ -34,11 +36,11 @@ def radar_to_cartesian(file_path, variable='DBZH'):
            fig = plt.figure(figsize=(10, 10), facecolor='black')
            ax = plt.axes(facecolor='black')
            
-           # Plot data
-           mesh = ax.pcolormesh(x/1000, y/1000, sweep_data,
+           # Plot data (gray levels of the -20 ~ 80 dBZ profile)
+           mesh = ax.pcolormesh(x/1000, y/1000, RADAR_DBZ_PROFILE.apply(sweep_data),
                               cmap='Greys_r',
-                              vmin=-20,
-                              vmax=80)
+                              vmin=0,
+                              vmax=255)
            
            ax.set_aspect('equal')
            ax.set_xticks([])
@@ -61,4 +63,5 @@ def radar_to_cartesian(file_path, variable='DBZH'):
    ds.close()
 
 # Execute function
-radar_to_cartesian('korea_data.nc', 'DBZH')
\ No newline at end of file
+if __name__ == "__main__":
+   radar_to_cartesian('korea_data.nc', 'DBZH')
\ No newline at end of file
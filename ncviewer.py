@@ -1,7 +1,8 @@
 import netCDF4 as nc
-import numpy as np
 import matplotlib.pyplot as plt
 
+from masking import MaskSpec
+
 # Open NC file
 ds = nc.Dataset('korea_data.nc', 'r')
 
@@ -13,10 +14,9 @@ print("DBZH variable attributes:", dbzh_var.ncattrs())
 # Read data
 dbzh = dbzh_var[:]
 
-# Handle missing values
-if hasattr(dbzh_var, '_FillValue'):
-    fill_value = dbzh_var._FillValue
-    dbzh = np.ma.masked_equal(dbzh, fill_value)
+# Handle missing values (set to NaN in place on a float32 buffer)
+fill_value = dbzh_var._FillValue if hasattr(dbzh_var, '_FillValue') else None
+dbzh, _ = MaskSpec().with_fill_values(fill_value).apply(dbzh)
 
 # Attempt to reshape data
 # Reshape according to actual data structure
@@ -1,6 +1,44 @@
 import xarray as xr
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+class SweepAnalysisPlot:
+   """
+   Histogram and 2D view of a sweep drawn on one reused Agg figure
+
+   The figure, axes, image and colorbar are created once; every call only
+   replaces the histogram and the image data before saving.
+   """
+   def __init__(self):
+       self.figure = Figure(figsize=(12, 5))
+       self.canvas = FigureCanvasAgg(self.figure)
+       self.ax_hist, self.ax_data = self.figure.subplots(1, 2)
+       self.image = None
+       self.colorbar = None
+
+   def save(self, sweep_data, valid_data, var_name, units, sweep_idx, output_path):
+       # subplot 1: histogram
+       self.ax_hist.cla()
+       self.ax_hist.hist(valid_data, bins=50, density=True)
+       self.ax_hist.set_title(f'{var_name} Distribution - Sweep {sweep_idx}')
+       self.ax_hist.set_xlabel('Value')
+       self.ax_hist.set_ylabel('Density')
+
+       # subplot 2: 2D plot
+       height, width = sweep_data.shape
+       if self.image is None:
+           self.image = self.ax_data.imshow(sweep_data, cmap='rainbow', origin='lower')
+           self.colorbar = self.figure.colorbar(self.image, ax=self.ax_data)
+       else:
+           self.image.set_data(sweep_data)
+           self.image.set_extent((-0.5, width - 0.5, -0.5, height - 0.5))
+       self.image.set_clim(valid_data.min(), valid_data.max())
+       self.colorbar.set_label(f'{var_name} [{units}]')
+       self.ax_data.set_title(f'{var_name} Data - Sweep {sweep_idx}')
+
+       self.figure.tight_layout()
+       self.figure.savefig(output_path)
 
 def analyze_netcdf_radar(file_path):
    # Read NetCDF file
@@ -39,6 +77,7 @@ def analyze_netcdf_radar(file_path):
    print(f"Elevation angles: {ds.fixed_angle.values}")
    print(f"Sweep mode: {ds.sweep_mode.values}")
    
+   plot = SweepAnalysisPlot()
    for sweep_idx in range(len(ds.sweep_start_ray_index)):
        print(f"\nSweep {sweep_idx} Analysis:")
        print(f"Elevation angle: {ds.fixed_angle.values[sweep_idx]} degrees")
@@ -60,26 +99,11 @@ def analyze_netcdf_radar(file_path):
                    print(f"Data range: {np.min(valid_data):.2f} ~ {np.max(valid_data):.2f}")
                    
                    # Data distribution visualization
-                   plt.figure(figsize=(12, 5))
-                   
-                   # subplot 1: histogram
-                   plt.subplot(121)
-                   plt.hist(valid_data, bins=50, density=True)
-                   plt.title(f'{var_name} Distribution - Sweep {sweep_idx}')
-                   plt.xlabel('Value')
-                   plt.ylabel('Density')
-                   
-                   # subplot 2: 2D plot
-                   plt.subplot(122)
-                   plt.imshow(sweep_data, cmap='rainbow', origin='lower')
-                   plt.colorbar(label=f'{var_name} [{ds[var_name].units}]')
-                   plt.title(f'{var_name} Data - Sweep {sweep_idx}')
-                   
-                   plt.tight_layout()
-                   plt.savefig(f'{var_name}_sweep_{sweep_idx}_analysis.png')
-                   plt.close()
+                   plot.save(sweep_data, valid_data, var_name, ds[var_name].units, sweep_idx,
+                             f'{var_name}_sweep_{sweep_idx}_analysis.png')
 
    ds.close()
 
 # Execute function
-analyze_netcdf_radar('korea_data.nc')
\ No newline at end of file
+if __name__ == "__main__":
+   analyze_netcdf_radar('korea_data.nc')
\ No newline at end of file
@@ -0,0 +1,353 @@
+import json
+
+import numpy as np
+
+SCALES = ('linear', 'log')
+
+class NormalizationProfile:
+    """
+    Fixed mapping of data values to 0..255 gray levels, shared by all converters
+
+    Values are mapped linearly (or by their logarithm) from [vmin, vmax]
+    to 0..255; values below vmin get below_level, values above vmax 255 and
+    NaN (missing) values missing_level. The mapping is precomputed as a
+    lookup table, so converting a frame is one vectorized indexing pass:
+    float data is quantized to lut_size steps between vmin and vmax (or
+    their logarithms), and
+    integer data (e.g. 8-bit images, raw 16-bit radar counts) indexes an
+    exact table over the whole integer range.
+
+    Parameters:
+    vmin (float): Value mapped to level 0
+    vmax (float): Value mapped to level 255
+    scale (str): 'linear' or 'log' (vmin must then be > 0)
+    missing_level (int): Level of NaN values (raster engine and apply(); the agg engine leaves them unpainted)
+    below_level (int): Level of values below vmin
+    lut_size (int): Number of quantization steps of the float lookup table
+    name (str): Optional description (e.g. variable and source)
+    """
+    def __init__(self, vmin, vmax, scale='linear', missing_level=0, below_level=0, lut_size=65536, name=None):
+        if scale not in SCALES:
+            raise ValueError(f"Unknown scale: {scale} (choose from {', '.join(SCALES)})")
+        if not vmax > vmin:
+            raise ValueError(f"vmax ({vmax}) must be greater than vmin ({vmin})")
+        if scale == 'log' and vmin <= 0:
+            raise ValueError(f"A log profile needs vmin > 0, got {vmin}")
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        self.scale = scale
+        self.missing_level = int(missing_level)
+        self.below_level = int(below_level)
+        self.lut_size = int(lut_size)
+        self.name = name
+        self._lut = None
+        self._integer_luts = {}
+
+    def levels(self, values):
+        """
+        Exact gray levels of the given values (slow path, used to build the tables)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.scale == 'log':
+                position = (np.log(values) - np.log(self.vmin)) / (np.log(self.vmax) - np.log(self.vmin))
+            else:
+                position = (values - self.vmin) / (self.vmax - self.vmin)
+        levels = np.clip(np.floor(position * 256), 0, 255)
+        levels = np.where(values < self.vmin, self.below_level, levels)
+        levels = np.where(np.isnan(values), self.missing_level, levels)
+        return levels.astype(np.uint8)
+
+    def _domain(self):
+        # Quantization axis of the float table: the values, or their logarithm
+        if self.scale == 'log':
+            return np.log(self.vmin), np.log(self.vmax)
+        return self.vmin, self.vmax
+
+    @property
+    def lut(self):
+        """
+        Float lookup table: [below vmin, lut_size steps from vmin to vmax, above vmax, missing]
+        """
+        if self._lut is None:
+            low, high = self._domain()
+            centers = low + (np.arange(self.lut_size) + 0.5) * ((high - low) / self.lut_size)
+            if self.scale == 'log':
+                centers = np.exp(centers)
+            self._lut = np.concatenate([[self.below_level], self.levels(centers),
+                                        [255, self.missing_level]]).astype(np.uint8)
+        return self._lut
+
+    def integer_lut(self, dtype, scale_factor=1.0, add_offset=0.0, fill_value=None):
+        """
+        Exact lookup table over all values of an integer type of up to 16 bits
+
+        The table is indexed by the raw values shifted by the type minimum,
+        so packed data (value = raw * scale_factor + add_offset) is mapped
+        without unpacking it to floats first.
+        """
+        dtype = np.dtype(dtype)
+        key = (dtype.str, scale_factor, add_offset, fill_value)
+        lut = self._integer_luts.get(key)
+        if lut is None:
+            info = np.iinfo(dtype)
+            raw = np.arange(info.min, info.max + 1, dtype=np.int64)
+            values = raw * float(scale_factor) + float(add_offset)
+            if fill_value is not None:
+                values[raw == fill_value] = np.nan
+            lut = self._integer_luts[key] = self.levels(values)
+        return lut
+
+    def apply(self, data, out=None):
+        """
+        Map data to uint8 gray levels with the lookup table
+
+        Parameters:
+        data (numpy.ndarray): Values (float with NaN as missing, or integer of up to 16 bits)
+        out (numpy.ndarray): Optional uint8 array for the result
+
+        Returns:
+        numpy.ndarray: uint8 array with the shape of data
+        """
+        data = np.asarray(data)
+        if data.dtype.kind in 'iu' and data.dtype.itemsize <= 2:
+            info = np.iinfo(data.dtype)
+            index = data if info.min == 0 else data.astype(np.int32) - info.min
+            return np.take(self.integer_lut(data.dtype), index, out=out)
+
+        if np.ma.isMaskedArray(data):
+            data = np.ma.filled(data.astype(np.float32), np.nan)
+        low, high = self._domain()
+        if self.scale == 'log':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                index = np.log(data, dtype=np.float32)
+            # log of values <= 0 is -inf or NaN; they are below vmin, not missing
+            index[np.asarray(data <= 0)] = -np.inf
+            index -= np.float32(low)
+        else:
+            index = np.subtract(data, low, dtype=np.float32)
+        index *= np.float32(self.lut_size / (high - low))
+        # [below, 0 .. lut_size - 1, above]; NaN goes to the last (missing) entry
+        np.floor(index, out=index)
+        np.clip(index, -1, self.lut_size, out=index)
+        index += 1
+        np.nan_to_num(index, copy=False, nan=self.lut_size + 2)
+        return np.take(self.lut, index.astype(np.intp), out=out)
+
+    def mask(self, data):
+        """
+        Boolean mask of the missing values (NaN or masked; integer data has none)
+        """
+        if np.ma.isMaskedArray(data):
+            return np.ma.getmaskarray(data) | np.isnan(np.ma.getdata(data))
+        data = np.asarray(data)
+        if data.dtype.kind not in 'fc':
+            return np.zeros(data.shape, dtype=bool)
+        return np.isnan(data)
+
+    def to_dict(self):
+        return {'vmin': self.vmin, 'vmax': self.vmax, 'scale': self.scale, 'missing_level': self.missing_level,
+                'below_level': self.below_level, 'lut_size': self.lut_size, 'name': self.name}
+
+    def save(self, path):
+        """
+        Save the profile as JSON
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def from_data(cls, arrays, scale='linear', low=0.001, high=0.999, sample_size=1000000, seed=0, **options):
+        """
+        Profile whose bounds are quantiles of the valid values of some arrays
+
+        Parameters:
+        arrays (iterable): Arrays of values (NaN and masked values are ignored)
+        scale (str): 'linear' or 'log' (log ignores values <= 0)
+        low (float): Quantile mapped to vmin
+        high (float): Quantile mapped to vmax
+        sample_size (int): Maximum number of values sampled from every array
+        seed (int): Seed of the sampling
+
+        Returns:
+        NormalizationProfile: New profile
+        """
+        rng = np.random.default_rng(seed)
+        samples = []
+        for data in arrays:
+            values = np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan).ravel()
+            values = values[np.isfinite(values)]
+            if scale == 'log':
+                values = values[values > 0]
+            if values.size > sample_size:
+                values = rng.choice(values, sample_size, replace=False)
+            samples.append(values)
+        values = np.concatenate(samples) if samples else np.empty(0)
+        if values.size == 0:
+            raise ValueError("No valid values to compute a normalization profile from")
+        vmin, vmax = np.quantile(values, [low, high])
+        if vmax <= vmin:
+            vmax = vmin + 1.0
+        return cls(vmin, vmax, scale=scale, **options)
+
+    @classmethod
+    def from_climatology(cls, climatology, scale='log', low=0.001, high=0.999, **options):
+        """
+        Profile from the histogram of a GRIB2 climatology (grib2_climatology)
+
+        Parameters:
+        climatology (ClimatologyAccumulator or str): Accumulator or path of its .npz file
+        scale (str): 'linear' or 'log'
+        low (float): Quantile mapped to vmin
+        high (float): Quantile mapped to vmax
+        """
+        if isinstance(climatology, str):
+            from grib2_climatology import ClimatologyAccumulator
+            climatology = ClimatologyAccumulator.load(climatology)
+        vmin, vmax = climatology.suggest_range(low, high)
+        if scale == 'log':
+            # The lowest histogram edge is usually 0, use the first bin above it
+            vmin = max(vmin, float(climatology.bin_edges[1]))
+        if vmax <= vmin:
+            vmax = vmin * 10 if scale == 'log' else vmin + 1.0
+        return cls(vmin, vmax, scale=scale, **options)
+
+    def __repr__(self):
+        return (f"NormalizationProfile(vmin={self.vmin!r}, vmax={self.vmax!r}, scale={self.scale!r}, "
+                f"missing_level={self.missing_level}, name={self.name!r})")
+
+class PackedProfile:
+    """
+    A NormalizationProfile applied directly to packed integer data
+
+    Fields stored as scaled integers (value = raw * scale_factor +
+    add_offset, e.g. CfRadial int16 moments) are mapped without unpacking
+    them to floats: scaling, fill value and the masking rules of a MaskSpec
+    are folded into one exact table over the integer range, evaluated once.
+    apply() and mask() are then a single indexing pass over the raw values.
+
+    Parameters:
+    profile (NormalizationProfile): Value to gray level mapping
+    dtype (numpy.dtype): Integer type of the raw data (up to 16 bits)
+    scale_factor (float): Packing scale
+    add_offset (float): Packing offset
+    fill_value (int): Raw value marking missing data (default: the type minimum,
+        which is also used to mark gates masked by range limits)
+    mask_spec (MaskSpec): Masking rules in physical units
+    """
+    def __init__(self, profile, dtype=np.int16, scale_factor=1.0, add_offset=0.0, fill_value=None, mask_spec=None):
+        from masking import MaskSpec
+
+        self.profile = profile
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind not in 'iu' or self.dtype.itemsize > 2:
+            raise ValueError(f"Packed data must be an integer type of up to 16 bits, got {self.dtype}")
+        self.mask_spec = mask_spec or MaskSpec()
+        info = np.iinfo(self.dtype)
+        self.offset = -info.min
+        self.fill_value = int(info.min if fill_value is None else fill_value)
+
+        raw = np.arange(info.min, info.max + 1, dtype=np.int64)
+        # Unpacked in float32, exactly like the decoded (mask_and_scale) float path
+        values = (raw.astype(np.float32) * np.float32(scale_factor) + np.float32(add_offset)).astype(np.float32)
+        values[raw == self.fill_value] = np.nan
+        values, self.mask_lut = self.mask_spec.apply(values)
+        self.lut = profile.levels(values)
+
+    def _index(self, raw):
+        raw = np.asarray(raw)
+        return raw if self.offset == 0 else raw.astype(np.int32) + self.offset
+
+    def apply(self, raw, out=None):
+        """
+        Gray levels of raw packed values
+        """
+        return np.take(self.lut, self._index(raw), out=out)
+
+    def mask(self, raw):
+        """
+        Boolean mask (missing or masked by the spec) of raw packed values
+        """
+        return np.take(self.mask_lut, self._index(raw))
+
+    def mask_gates(self, raw, ranges):
+        """
+        Set the gates outside the range limits of the spec to the fill value, in place
+        """
+        for gates in self.mask_spec.gate_slices(ranges):
+            raw[..., gates] = self.fill_value
+        return raw
+
+def _file_values(files, variable='DBZH', message=1):
+    import netCDF4 as nc
+    from grib2_climatology import read_field
+
+    for file_path in files:
+        if file_path.endswith('.nc'):
+            with nc.Dataset(file_path, 'r') as ds:
+                # Scaled to physical units, fill values masked
+                yield ds.variables[variable][:]
+        else:
+            yield read_field(file_path, message)
+
+def profile_from_files(files, variable='DBZH', scale='linear', low=0.001, high=0.999, message=1, **options):
+    """
+    Profile from the values of NetCDF (variable) and/or GRIB2 (message) files
+
+    Returns:
+    NormalizationProfile: New profile named after the variable
+    """
+    options.setdefault('name', variable if any(f.endswith('.nc') for f in files) else f"GRIB2 message {message}")
+    return NormalizationProfile.from_data(_file_values(files, variable, message), scale=scale, low=low, high=high,
+                                          **options)
+
+def get_profile(profile, default=None):
+    """
+    Profile object from a profile, a JSON path or None (default)
+    """
+    if profile is None:
+        return default
+    if isinstance(profile, NormalizationProfile):
+        return profile
+    return NormalizationProfile.load(profile)
+
+# Reflectivity range of the original NetCDF converters
+RADAR_DBZ_PROFILE = NormalizationProfile(-20, 80, scale='linear', name='DBZH dBZ')
+
+# Default ranges of common polarimetric moments, for rendering several variables of a volume
+RADAR_PROFILES = {
+    'DBZH': RADAR_DBZ_PROFILE,
+    'DBZV': NormalizationProfile(-20, 80, scale='linear', name='DBZV dBZ'),
+    'ZDR': NormalizationProfile(-4, 8, scale='linear', name='ZDR dB'),
+    'KDP': NormalizationProfile(-2, 10, scale='linear', name='KDP deg/km'),
+    'PHIDP': NormalizationProfile(0, 360, scale='linear', name='PHIDP deg'),
+    'RHOHV': NormalizationProfile(0.2, 1.05, scale='linear', name='RHOHV'),
+    'VELH': NormalizationProfile(-32, 32, scale='linear', name='VELH m/s'),
+    'WIDTHH': NormalizationProfile(0, 16, scale='linear', name='WIDTHH m/s'),
+}
+
+def radar_profile(variable, profile=None):
+    """
+    Profile of a radar variable
+
+    Parameters:
+    variable (str): Variable name
+    profile (NormalizationProfile, str or dict): Profile (or JSON path) used for
+        every variable, or a dict of them by variable name (None: defaults)
+
+    Returns:
+    NormalizationProfile: The given profile, else the RADAR_PROFILES entry,
+        else the -20 ~ 80 dBZ profile
+    """
+    if isinstance(profile, dict):
+        profile = profile.get(variable)
+    return get_profile(profile, RADAR_PROFILES.get(variable, RADAR_DBZ_PROFILE))
+
+# 8-bit images: identity mapping, used instead of per-image min-max scaling
+IMAGE_PROFILE = NormalizationProfile(0, 256, scale='linear', name='8-bit image')
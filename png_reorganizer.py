@@ -1,102 +1,266 @@
 import os
+import re
+import glob
 import shutil
+import hashlib
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def reorganize_radar_files(source_dir, target_dir, frames_per_case=29):
+from instrumentation import RunRecorder
+
+MANIFEST_NAME = 'manifest.sha256'
+# '.<case>.tmp<pid>' (frames being copied) and '.<case>.old<pid>' (case being replaced)
+WORK_DIR_PATTERN = re.compile(r'\.(tmp|old)(\d+)$')
+
+def frame_name(case_id, frame_idx):
+    return f"{case_id}-{str(frame_idx).zfill(2)}.png"
+
+def copy_with_checksum(source_file, target_file, chunk_size=1024 * 1024):
+    """
+    Copy a file (with its metadata, as shutil.copy2) and return its SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(source_file, 'rb') as src, open(target_file, 'wb') as dst:
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            digest.update(chunk)
+            dst.write(chunk)
+    shutil.copystat(source_file, target_file)
+    return digest.hexdigest()
+
+def case_complete(case_dir, case_id, sources, checksums=False):
+    """
+    Whether a case directory already holds every frame (same size as its source)
+
+    With checksums, the case must also have a manifest listing every frame,
+    and the frames must match their checksums (see verify_case).
+    """
+    if not os.path.isdir(case_dir):
+        return False
+    manifest_path = os.path.join(case_dir, MANIFEST_NAME)
+    if checksums and not os.path.exists(manifest_path):
+        return False
+    for frame_idx, source_file in enumerate(sources):
+        target_file = os.path.join(case_dir, frame_name(case_id, frame_idx))
+        if not os.path.exists(target_file) or os.path.getsize(target_file) != os.path.getsize(source_file):
+            return False
+    if checksums:
+        with open(manifest_path) as f:
+            listed = {line.rstrip('\n').split('  ', 1)[-1] for line in f if line.strip()}
+        if listed != {frame_name(case_id, frame_idx) for frame_idx in range(len(sources))}:
+            return False
+        return not verify_case(case_dir)
+    return True
+
+def verify_case(case_dir):
+    """
+    Check the frames of a case directory against its checksum manifest
+
+    Returns:
+    list: Names of missing or corrupted frames (empty if the case is intact)
+    """
+    bad = []
+    with open(os.path.join(case_dir, MANIFEST_NAME)) as f:
+        for line in f:
+            expected, name = line.rstrip('\n').split('  ', 1)
+            path = os.path.join(case_dir, name)
+            if not os.path.exists(path):
+                bad.append(name)
+                continue
+            digest = hashlib.sha256()
+            with open(path, 'rb') as frame:
+                for chunk in iter(lambda: frame.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != expected:
+                bad.append(name)
+    return bad
+
+def _pid_alive(pid):
+    """
+    Whether a process with this pid is running (on this machine)
+    """
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: running, owned by another user
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def remove_stale_dirs(target_dir, case_id):
+    """
+    Remove the work directories of a case left behind by interrupted runs
+
+    Only directories of this process and of processes that are no longer
+    running are removed; those of runs still in progress are kept.
+    """
+    for work_dir in glob.glob(os.path.join(target_dir, f".{case_id}.*")):
+        match = WORK_DIR_PATTERN.search(work_dir)
+        if match is None:
+            continue
+        pid = int(match.group(2))
+        if pid == os.getpid() or not _pid_alive(pid):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def materialize_case(case_id, sources, target_dir, checksums=False, recorder=None):
+    """
+    Create one case directory from a complete copy
+
+    The frames are copied to a temporary directory next to the case, which
+    is renamed to the case directory once complete, so an interrupted run
+    never leaves a half-written case behind. Complete cases are skipped.
+    An incomplete case of an earlier run is first renamed aside and deleted
+    after the new case is in place; the replacement is two renames, not one
+    atomic step, so a crash in between leaves no case directory (the old
+    one is kept as '.<case>.old<pid>') and the next run creates it again.
+
+    Parameters:
+    case_id (str): Case name (e.g. '00012')
+    sources (list): Source frames in order
+    target_dir (str): Directory of the cases
+    checksums (bool): Also write a SHA-256 manifest ('manifest.sha256',
+        sha256sum format) of the frames
+    recorder (RunRecorder): Collects stage timings
+
+    Returns:
+    str: The case directory, or None if it was already complete
+    """
+    recorder = recorder or RunRecorder()
+    case_dir = os.path.join(target_dir, case_id)
+    remove_stale_dirs(target_dir, case_id)
+    if case_complete(case_dir, case_id, sources, checksums):
+        return None
+
+    temp_dir = os.path.join(target_dir, f".{case_id}.tmp{os.getpid()}")
+    os.makedirs(temp_dir)
+    with recorder.stage('copy', case_id):
+        lines = []
+        for frame_idx, source_file in enumerate(sources):
+            name = frame_name(case_id, frame_idx)
+            target_file = os.path.join(temp_dir, name)
+            if checksums:
+                lines.append(f"{copy_with_checksum(source_file, target_file)}  {name}\n")
+            else:
+                shutil.copy2(source_file, target_file)
+        if checksums:
+            with open(os.path.join(temp_dir, MANIFEST_NAME), 'w') as f:
+                f.writelines(lines)
+    with recorder.stage('commit', case_id):
+        # An incomplete case of an earlier run is replaced
+        old_dir = None
+        if os.path.exists(case_dir):
+            old_dir = os.path.join(target_dir, f".{case_id}.old{os.getpid()}")
+            os.rename(case_dir, old_dir)
+        os.rename(temp_dir, case_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir)
+    recorder.file_done(case_id, frames=len(sources))
+    return case_dir
+
+def reorganize_radar_files(source_dir, target_dir, frames_per_case=29, recorder=None, threads=8,
+                           checksums=False):
     """
     Function to reorganize radar PNG files - select only the lowest sweep for each time point
-    
+
     Parameters:
     source_dir (str): Directory containing original PNG files
     target_dir (str): Directory to save reorganized files
     frames_per_case (int): Number of frames needed per case (folder)
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    threads (int): Number of cases copied concurrently
+    checksums (bool): Write a SHA-256 manifest per case (see verify_case)
     """
-    print(f"Starting file reorganization...")
-    print(f"Source directory: {source_dir}")
-    print(f"Target directory: {target_dir}")
-    
+    recorder = recorder or RunRecorder()
+    recorder.log('info', 'start', message=f"Starting file reorganization: {source_dir} -> {target_dir}",
+                 source_dir=source_dir, target_dir=target_dir)
+
     os.makedirs(target_dir, exist_ok=True)
-    
+
     # Group files by time point
     time_groups = defaultdict(list)
-    
+
     # Collect and group all PNG files
     total_files_found = 0
-    print("\nScanning for PNG files...")
-    
-    for root, _, files in os.walk(source_dir):
-        png_files = [f for f in files if f.endswith('.png')]
-        print(f"Found {len(png_files)} PNG files in this directory")
-        
-        for file in png_files:
-            total_files_found += 1
-            # Parse filename (e.g.: RDR_SSP_FQC_202501081335_sweep_1.png)
-            parts = file.split('_')
-            if len(parts) >= 6:
-                try:
-                    time_point = parts[3]  # Time information (e.g., 202501081335)
-                    sweep_num = int(parts[5].split('.')[0])  # Sweep number
-                    full_path = os.path.join(root, file)
-                    time_groups[time_point].append((sweep_num, full_path))
-                    print(f"Processed: {file} (time_point: {time_point}, sweep: {sweep_num})")
-                except (ValueError, IndexError) as e:
-                    print(f"Error processing file {file}: {str(e)}")
-            else:
-                print(f"Skipping file with unexpected format: {file}")
-    
-    print(f"\nTotal PNG files found: {total_files_found}")
-    print(f"Unique time points found: {len(time_groups)}")
-    
+
+    with recorder.stage('scan'):
+        for root, _, files in os.walk(source_dir):
+            png_files = [f for f in files if f.endswith('.png')]
+            recorder.log('debug', 'scan', message=f"Found {len(png_files)} PNG files in {root}",
+                         directory=root, files=len(png_files))
+
+            for file in png_files:
+                total_files_found += 1
+                # Parse filename (e.g.: RDR_SSP_FQC_202501081335_sweep_1.png)
+                parts = file.split('_')
+                if len(parts) >= 6:
+                    try:
+                        time_point = parts[3]  # Time information (e.g., 202501081335)
+                        sweep_num = int(parts[5].split('.')[0])  # Sweep number
+                        full_path = os.path.join(root, file)
+                        time_groups[time_point].append((sweep_num, full_path))
+                    except (ValueError, IndexError) as e:
+                        recorder.log('warning', 'bad_filename', message=f"Error processing file {file}: {str(e)}", file=file)
+                else:
+                    recorder.log('warning', 'bad_filename', message=f"Skipping file with unexpected format: {file}", file=file)
+
+    recorder.log('info', 'scanned', message=f"Total PNG files found: {total_files_found}, unique time points: {len(time_groups)}",
+                 files=total_files_found, time_points=len(time_groups))
+
     # Select only the lowest sweep for each time point
     lowest_sweep_files = []
-    print("\nSelecting lowest sweeps for each time point...")
-    
+
     for time_point in sorted(time_groups.keys()):
         files = time_groups[time_point]
         if files:
             # Sort by sweep number and select the lowest
             files.sort(key=lambda x: x[0])
             lowest_sweep_files.append((time_point, files[0][1]))
-            print(f"Time point {time_point}: Selected sweep {files[0][0]}")
-    
-    print(f"\nTotal lowest sweep files selected: {len(lowest_sweep_files)}")
-    
+
     # Group selected files into cases with 29 frames each
     total_cases = len(lowest_sweep_files) // frames_per_case
-    print(f"\nTotal number of complete cases that can be created: {total_cases}")
-    
+    recorder.log('info', 'selected',
+                 message=f"Selected {len(lowest_sweep_files)} lowest sweep files, {total_cases} complete cases can be created",
+                 frames=len(lowest_sweep_files), cases=total_cases)
+
     if total_cases == 0:
-        print("\nNot enough files to create complete cases!")
-        print(f"Need {frames_per_case} files per case, but only found {len(lowest_sweep_files)} files")
+        recorder.log('warning', 'not_enough_files',
+                     message=f"Not enough files to create complete cases! Need {frames_per_case} files per case, but only found {len(lowest_sweep_files)} files",
+                     frames=len(lowest_sweep_files), frames_per_case=frames_per_case)
         return
-    
-    # Process each case
-    for case_idx in range(total_cases):
-        case_id = str(case_idx).zfill(5)
-        case_dir = os.path.join(target_dir, case_id)
-        os.makedirs(case_dir, exist_ok=True)
-        
-        print(f"\nProcessing case {case_id}...")
-        
-        # Copy the 29 files for this case
-        for frame_idx in range(frames_per_case):
-            file_idx = case_idx * frames_per_case + frame_idx
-            if file_idx < len(lowest_sweep_files):
-                _, source_file = lowest_sweep_files[file_idx]
-                new_filename = f"{case_id}-{str(frame_idx).zfill(2)}.png"
-                target_file = os.path.join(case_dir, new_filename)
-                
-                # Copy file
-                shutil.copy2(source_file, target_file)
-                print(f"Copied: {new_filename}")
-            else:
-                print(f"Warning: Not enough source files for case {case_id}, frame {frame_idx}")
-                break
+
+    # Materialize the cases concurrently (copies are I/O bound)
+    cases = [(str(case_idx).zfill(5), [source_file for _, source_file in
+                                      lowest_sweep_files[case_idx * frames_per_case:(case_idx + 1) * frames_per_case]])
+             for case_idx in range(total_cases)]
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        futures = {executor.submit(materialize_case, case_id, sources, target_dir, checksums, recorder): case_id
+                   for case_id, sources in cases}
+        for future in as_completed(futures):
+            case_id = futures[future]
+            try:
+                if future.result() is None:
+                    skipped += 1
+            except Exception as e:
+                recorder.exception('case_failed', e, message=f"Error creating case {case_id}", file=case_id)
+    if skipped:
+        recorder.log('info', 'skipped', message=f"{skipped} complete cases skipped", cases=skipped)
+
+    recorder.print_summary()
 
 if __name__ == "__main__":
     # Usage example
     source_directory = "D:/GLP/Korea_Climate_Data/KoreanPngDataset"  # Directory containing original PNG files
     target_directory = "D:/GLP/Korea_Climate_Data/ReorganizedDataset"  # Directory to save reorganized files
-    
+
     reorganize_radar_files(source_directory, target_directory)
-    print("\nFile reorganization complete!")
\ No newline at end of file
+    print("\nFile reorganization complete!")
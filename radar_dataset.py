@@ -0,0 +1,237 @@
+import os
+import re
+import glob
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from instrumentation import RunRecorder
+from normalization import get_profile, radar_profile
+from masking import MaskSpec
+from nc_to_png_all import PRECISIONS, open_volume, get_sweep_bounds, extract_sweep, volume_profile, draw_sweep
+from grib2_to_png import draw_grib2
+
+# 20241223-000000 (MRMS) or 202412230000 (KMA radar) in a file name
+TIME_PATTERN = re.compile(r'(\d{8})-?(\d{4}(?:\d{2})?)')
+
+def frame_time(file_path):
+    """
+    Time stamp of a volume from its file name, as a sortable string
+
+    Returns:
+    str: 'YYYYMMDDHHMM[SS]', or the file name if it holds no time stamp
+    """
+    name = os.path.basename(file_path)
+    match = TIME_PATTERN.search(name)
+    return match.group(1) + match.group(2) if match else name
+
+def find_volumes(input_dir, patterns=('*.nc', '*.grib2', '*.grb2')):
+    """
+    NC/GRIB2 files of a directory in time order
+    """
+    files = set()
+    for pattern in patterns:
+        files.update(glob.glob(os.path.join(input_dir, pattern)))
+    return sorted(files, key=lambda path: (frame_time(path), os.path.basename(path)))
+
+class RadarSequenceDataset:
+    """
+    Frame sequences rendered on demand from raw NetCDF/GRIB2 volumes
+
+    Yields the same uint8 frames as process_radar_files / grib2_to_png
+    followed by reorganize_radar_files, without writing PNG files: sequence
+    i is the frames of files [i * stride, i * stride + frames_per_case)
+    in time order, as an array of shape (frames, height, width). Rendered
+    frames are kept in a bounded LRU cache, so overlapping sequences decode
+    every volume once, and iteration renders the next sequences in
+    background threads.
+
+    The class has __len__ and __getitem__, so it can be passed to a
+    torch.utils.data.DataLoader (e.g. with transform=torch.from_numpy);
+    torch is not required. With num_workers > 0 the dataset is pickled to
+    the workers (spawned on Windows and macOS) without its lock, frame
+    cache and recorder; every worker starts with an empty cache and a
+    recorder of the same configuration, and transform must be picklable.
+
+    Parameters:
+    files (str or list): Directory with .nc/.grib2 files, or list of files (sorted by frame_time)
+    frames_per_case (int): Number of frames per sequence
+    stride (int): Files between the starts of two sequences (default: frames_per_case,
+        consecutive cases as reorganize_radar_files)
+    sweep (int): Sweep of the NetCDF volumes (default: 0, the lowest sweep)
+    variable (str): NetCDF variable to render
+    message (int): GRIB2 message number (1-based)
+    engine (str): 'raster' or 'agg'
+    dpi (int): Resolution of the agg engine
+    size (int): Image size in pixels of the raster engine
+    bbox (tuple): GRIB2 lat/lon window, see read_grib2_subset
+    grid_shape (tuple): (height, width) of the GRIB2 bbox grid
+    profile (NormalizationProfile or str): Value to gray level mapping (default:
+        the converter defaults, RADAR_PROFILES for NetCDF, per-field log for GRIB2)
+    mask_spec (MaskSpec): Masking rules
+    precision (str): 'float32', 'float64' or 'packed' (NetCDF only)
+    cache_size (int): Number of rendered frames kept in memory
+    prefetch (int): Number of sequences rendered ahead while iterating
+    threads (int): Number of background rendering threads
+    transform (callable): Applied to every sequence array before it is returned
+    recorder (RunRecorder): Collects stage timings (default: new quiet recorder)
+    """
+    def __init__(self, files, frames_per_case=29, stride=None, sweep=0, variable='DBZH', message=1,
+                 engine='raster', dpi=300, size=1024, bbox=None, grid_shape=None, profile=None, mask_spec=None,
+                 precision='float32', cache_size=64, prefetch=2, threads=2, transform=None, recorder=None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision} (choose from {', '.join(PRECISIONS)})")
+        if isinstance(files, (list, tuple)):
+            self.files = sorted(files, key=lambda path: (frame_time(path), os.path.basename(path)))
+        else:
+            self.files = find_volumes(files)
+        self.frames_per_case = frames_per_case
+        self.stride = stride or frames_per_case
+        self.sweep = sweep
+        self.variable = variable
+        self.message = message
+        self.engine = engine
+        self.dpi = dpi
+        self.size = size
+        self.bbox = bbox
+        self.grid_shape = grid_shape
+        self.profile = get_profile(profile)
+        self.mask_spec = mask_spec or MaskSpec()
+        self.precision = precision
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.threads = threads
+        self.transform = transform
+        self.recorder = recorder or RunRecorder(verbosity='warning')
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock, the cached frames and the recorder (log file, stage
+        # timings) stay in this process
+        state = self.__dict__.copy()
+        del state['_lock'], state['_cache']
+        state['recorder'] = self.recorder.config
+        return state
+
+    def __setstate__(self, state):
+        state['recorder'] = RunRecorder(**state['recorder'])
+        self.__dict__.update(state)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        if len(self.files) < self.frames_per_case:
+            return 0
+        return (len(self.files) - self.frames_per_case) // self.stride + 1
+
+    def frame_indices(self, index):
+        """
+        Indices into files of the frames of sequence index
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Sequence {index} out of range ({len(self)} sequences)")
+        start = index * self.stride
+        return range(start, start + self.frames_per_case)
+
+    def sequence_files(self, index):
+        return [self.files[i] for i in self.frame_indices(index)]
+
+    def _render_radar(self, file_path):
+        recorder = self.recorder
+        ds = open_volume(file_path, self.variable, recorder, self.precision)
+        if ds is None:
+            raise ValueError(f"Cannot read '{self.variable}' sweeps from {file_path}")
+        try:
+            with recorder.stage('sweep', file_path):
+                start_idx, end_idx = get_sweep_bounds(ds, self.sweep)
+                sweep_data = extract_sweep(ds, self.variable, start_idx, end_idx)
+                azimuths = ds.azimuth[start_idx:end_idx+1].values[:sweep_data.shape[0]]
+                ranges = ds.range.values
+            profile = volume_profile(ds, self.variable, radar_profile(self.variable, self.profile), self.mask_spec,
+                                     self.precision)
+        finally:
+            ds.close()
+        renderer, _ = draw_sweep(sweep_data, azimuths, ranges, profile, recorder, file_path, self.engine, self.dpi,
+                                 self.size, self.mask_spec, precision=self.precision)
+        return renderer
+
+    def _render_grib2(self, file_path):
+        dtype = np.float64 if self.precision == 'float64' else np.float32
+        return draw_grib2(file_path, self.recorder, self.message, self.engine, self.dpi, self.size, self.bbox,
+                          self.grid_shape, self.profile, self.mask_spec, dtype)[0]
+
+    def load_frame(self, file_index):
+        """
+        Rendered uint8 frame of files[file_index], from the cache if possible
+        """
+        with self._lock:
+            frame = self._cache.get(file_index)
+            if frame is not None:
+                self._cache.move_to_end(file_index)
+                return frame
+        file_path = self.files[file_index]
+        if file_path.endswith('.nc'):
+            renderer = self._render_radar(file_path)
+        else:
+            renderer = self._render_grib2(file_path)
+        # The raster renderer reuses its image buffer for the next frame of this thread
+        frame = np.array(renderer.to_gray())
+        with self._lock:
+            self._cache[file_index] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def _stack(self, frames):
+        sequence = np.stack(frames)
+        return self.transform(sequence) if self.transform is not None else sequence
+
+    def __getitem__(self, index):
+        return self._stack([self.load_frame(i) for i in self.frame_indices(index)])
+
+    def __iter__(self):
+        """
+        Sequences in order; the frames of the next prefetch sequences are
+        rendered by the background threads meanwhile
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = {}
+            ahead = deque()
+
+            def submit(index):
+                indices = self.frame_indices(index)
+                for i in indices:
+                    if i not in futures:
+                        futures[i] = executor.submit(self.load_frame, i)
+                ahead.append(indices)
+
+            for index in range(min(self.prefetch + 1, len(self))):
+                submit(index)
+            next_index = len(ahead)
+            while ahead:
+                indices = ahead.popleft()
+                frames = [futures[i].result() for i in indices]
+                # Frames before the next sequence are not needed any more
+                for i in list(futures):
+                    if i < indices.start + self.stride:
+                        del futures[i]
+                if next_index < len(self):
+                    submit(next_index)
+                    next_index += 1
+                yield self._stack(frames)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+if __name__ == "__main__":
+    # Usage example
+    dataset = RadarSequenceDataset('raw_data', frames_per_case=29, engine='raster', size=1024)
+    print(f"{len(dataset.files)} volumes, {len(dataset)} sequences")
+    for sequence in dataset:
+        print(sequence.shape, sequence.dtype)
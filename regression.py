@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+from instrumentation import RunRecorder
+from compare_png import calculate_pixel_statistics
+from benchmark import SAMPLE_GRIB2, make_synthetic_radar, make_synthetic_grib2
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_RADAR = os.path.join(PACKAGE_DIR, 'raw_data', 'RDR_SSP_FQC_202412230000.nc')
+GOLDEN_DIR = os.path.join(PACKAGE_DIR, 'golden')
+
+# Every engine, on the bundled samples and on synthetic fixtures (kept small:
+# 512 px raster frames, 30 ~ 50 dpi agg frames)
+CASES = {
+    'grib2_sample_raster': {'input': 'grib2_sample', 'engine': 'raster', 'size': 512},
+    'grib2_sample_agg': {'input': 'grib2_sample', 'engine': 'agg', 'dpi': 50},
+    'grib2_sample_bbox_raster': {'input': 'grib2_sample', 'engine': 'raster', 'bbox': (30, 40, -100, -90),
+                                 'grid_shape': (256, 256)},
+    'grib2_synthetic_raster': {'input': 'grib2_synthetic', 'engine': 'raster', 'size': 512},
+    'grib2_synthetic_agg': {'input': 'grib2_synthetic', 'engine': 'agg', 'dpi': 50},
+    'radar_sample_raster': {'input': 'radar_sample', 'engine': 'raster', 'size': 512},
+    'radar_sample_packed_raster': {'input': 'radar_sample', 'engine': 'raster', 'size': 512, 'precision': 'packed'},
+    'radar_sample_agg': {'input': 'radar_sample', 'engine': 'agg', 'dpi': 30},
+    'radar_synthetic_raster': {'input': 'radar_synthetic', 'engine': 'raster', 'size': 512},
+    'radar_synthetic_agg': {'input': 'radar_synthetic', 'engine': 'agg', 'dpi': 30},
+}
+
+# Maximum MAE / RMSE / ratio of pixels off by more than 10% and minimum
+# correlation (on the 0-1 scale of compare_png) per engine; the raster
+# engine is deterministic, agg output may move with the matplotlib version
+TOLERANCES = {
+    'raster': {'MAE': 0.0, 'RMSE': 0.0, 'Significant_Difference_Ratio': 0.0, 'Correlation': 1.0},
+    'agg': {'MAE': 0.002, 'RMSE': 0.02, 'Significant_Difference_Ratio': 0.002, 'Correlation': 0.999},
+}
+
+# Agg frames compared with the original pyplot/savefig scripts; the synthetic
+# volume has about 10% missing (NaN) gates, which must stay unpainted
+BASELINE_CASES = {
+    'radar_synthetic_baseline': {'input': 'radar_synthetic', 'dpi': 50},
+    'radar_sample_baseline': {'input': 'radar_sample', 'dpi': 30},
+    'grib2_synthetic_baseline': {'input': 'grib2_synthetic', 'dpi': 50},
+}
+
+def make_inputs(work_dir, seed=0):
+    """
+    Input files of the cases: the bundled samples and synthetic fixtures written to work_dir
+    """
+    return {
+        'grib2_sample': SAMPLE_GRIB2,
+        'radar_sample': SAMPLE_RADAR,
+        'grib2_synthetic': make_synthetic_grib2(os.path.join(work_dir, 'synthetic.grib2'), seed=seed),
+        'radar_synthetic': make_synthetic_radar(os.path.join(work_dir, 'RDR_SSP_FQC_202412221500.nc'), sweeps=3,
+                                                seed=seed),
+    }
+
+def render_case(case, input_path, work_dir, recorder=None):
+    """
+    Convert the input of a case with the public converters as uint8 npy frames
+
+    Returns:
+    tuple: (frames, seconds) frames by output name, and the conversion time
+    """
+    import nc_to_png_all
+    import grib2_to_png
+
+    recorder = recorder or RunRecorder(verbosity='warning')
+    options = {key: value for key, value in case.items() if key != 'input'}
+    output_dir = tempfile.mkdtemp(prefix='frames_', dir=work_dir)
+    start = time.perf_counter()
+    if input_path.endswith('.nc'):
+        nc_to_png_all.radar_to_cartesian(input_path, output_dir, recorder=recorder, output_format='npy', **options)
+    else:
+        output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(input_path))[0] + '.npy')
+        grib2_to_png.grib2_to_png(input_path, output_path, recorder=recorder, output_format='npy', **options)
+    seconds = time.perf_counter() - start
+    frames = {os.path.splitext(name)[0]: np.load(os.path.join(output_dir, name))
+              for name in sorted(os.listdir(output_dir)) if name.endswith('.npy')}
+    return frames, seconds
+
+def _savefig_gray(fig, dpi):
+    import io
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight', pad_inches=0, dpi=dpi, facecolor='black',
+                edgecolor='none')
+    plt.close(fig)
+    return np.asarray(Image.open(buffer).convert('RGBA'))[:, :, 0].copy()
+
+def baseline_radar_frames(file_path, dpi=300, variable='DBZH'):
+    """
+    Sweeps rendered like the original nc_to_png_all script (pyplot
+    pcolormesh of the NaN-masked field, -20 ~ 80 dBZ, tight savefig)
+
+    Returns:
+    dict: Gray frames by output name
+    """
+    import xarray as xr
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    frames = {}
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    with xr.open_dataset(file_path) as ds:
+        n_gates = len(ds['range'])
+        values = ds[variable].values
+        for sweep_idx in range(len(ds.sweep_start_ray_index)):
+            start_idx = int(ds.sweep_start_ray_index[sweep_idx].values)
+            end_idx = int(ds.sweep_end_ray_index[sweep_idx].values)
+            sweep_data = values[start_idx * n_gates:(end_idx + 1) * n_gates].reshape(-1, n_gates)
+            if sweep_data.size == 0:
+                continue
+            azimuths = np.radians(ds.azimuth[start_idx:end_idx+1].values)
+            r, az = np.meshgrid(ds.range.values, azimuths[:sweep_data.shape[0]])
+            x = r * np.sin(az)
+            y = r * np.cos(az)
+
+            fig = plt.figure(figsize=(10, 10), facecolor='black')
+            ax = plt.axes(facecolor='black')
+            ax.pcolormesh(x / 1000, y / 1000, sweep_data, cmap='Greys_r', vmin=-20, vmax=80)
+            ax.set_aspect('equal')
+            ax.set_xticks([])
+            ax.set_yticks([])
+            plt.axis('off')
+            plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
+            plt.margins(0, 0)
+            frames[f'{base_filename}_sweep_{sweep_idx}'] = _savefig_gray(fig, dpi)
+    return frames
+
+def baseline_grib2_frames(file_path, dpi=300):
+    """
+    First message rendered like the original grib2_to_png script (pyplot
+    pcolormesh with LogNorm(0.1, max), tight savefig)
+
+    Returns:
+    dict: Gray frame by output name
+    """
+    import pygrib
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    grbs = pygrib.open(file_path)
+    try:
+        data, lats, lons = grbs[1].data()
+    finally:
+        grbs.close()
+    fig = plt.figure(figsize=(8, 8))
+    ax = plt.gca()
+    ax.set_axis_off()
+    plt.margins(0, 0)
+    plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
+    plt.pcolormesh(lons, lats, data, cmap='Greys_r', norm=LogNorm(vmin=0.1, vmax=data.max()))
+    ax.xaxis.set_major_locator(plt.NullLocator())
+    ax.yaxis.set_major_locator(plt.NullLocator())
+    return {os.path.splitext(os.path.basename(file_path))[0]: _savefig_gray(fig, dpi)}
+
+def check_baseline(names=None, tolerance=None, work_dir=None, seed=0):
+    """
+    Compare the agg engine with the original pyplot/savefig scripts
+
+    The golden frames are produced by the current code, so they cannot
+    show a change of the agg output itself; these cases render the same
+    inputs through the original scripts and compare them frame by frame
+    with the agg tolerances.
+
+    Returns:
+    dict: Per case: passed, the differing frames and the worst frame metrics
+    """
+    names = names or list(BASELINE_CASES)
+    tolerance = {**TOLERANCES['agg'], **(tolerance or {})}
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='baseline_', dir=work_dir) as temp_dir:
+        inputs = make_inputs(temp_dir, seed)
+        for name in names:
+            case = BASELINE_CASES[name]
+            input_path = inputs[case['input']]
+            if input_path.endswith('.nc'):
+                expected = baseline_radar_frames(input_path, case['dpi'])
+            else:
+                expected = baseline_grib2_frames(input_path, case['dpi'])
+            frames, _ = render_case({'engine': 'agg', 'dpi': case['dpi']}, input_path, temp_dir)
+            failures = sorted(set(expected) ^ set(frames))
+            worst = None
+            for key in sorted(set(expected) & set(frames)):
+                metrics = frame_metrics(expected[key], frames[key])
+                if not within_tolerance(metrics, tolerance):
+                    failures.append(key)
+                if metrics is not None and (worst is None or metrics['MAE'] > worst['MAE']):
+                    worst = metrics
+            report[name] = {'passed': not failures, 'failed_frames': failures, 'worst': worst}
+            mae = f"{worst['MAE']:.5f}" if worst else '-'
+            ratio = f"{worst['Significant_Difference_Ratio']:.5f}" if worst else '-'
+            print(f"{name:<28} {'ok' if not failures else 'FAILED':<6} {len(frames):>2} frames  "
+                  f"max MAE {mae}  significant {ratio}")
+            if failures:
+                print(f"  differing or missing frames: {', '.join(failures)}")
+    failed = [name for name, result in report.items() if not result['passed']]
+    print(f"{len(report) - len(failed)}/{len(report)} baseline cases passed")
+    return report
+
+def frame_metrics(golden, current):
+    """
+    compare_png statistics of two gray frames (the mean correlation over the
+    RGB channels; identical frames are not compared pixel by pixel)
+    """
+    if golden.shape != current.shape:
+        return None
+    if np.array_equal(golden, current):
+        return {'MAE': 0.0, 'RMSE': 0.0, 'Significant_Difference_Ratio': 0.0, 'Correlation': 1.0}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        statistics = calculate_pixel_statistics(np.repeat(golden[..., None], 3, axis=-1),
+                                                np.repeat(current[..., None], 3, axis=-1))
+    # NaN when one of the frames is constant
+    correlation = float(np.nan_to_num(np.mean(statistics['Correlations_RGB'])))
+    return {'MAE': float(statistics['MAE']), 'RMSE': float(statistics['RMSE']),
+            'Significant_Difference_Ratio': float(statistics['Significant_Difference_Ratio']),
+            'Correlation': correlation}
+
+def within_tolerance(metrics, tolerance):
+    if metrics is None:
+        return False
+    return (metrics['MAE'] <= tolerance['MAE'] and metrics['RMSE'] <= tolerance['RMSE']
+            and metrics['Significant_Difference_Ratio'] <= tolerance['Significant_Difference_Ratio']
+            and metrics['Correlation'] >= tolerance['Correlation'])
+
+def _run_cases(names, work_dir, seed):
+    inputs = make_inputs(work_dir, seed)
+    for name in names:
+        case = CASES[name]
+        frames, seconds = render_case(case, inputs[case['input']], work_dir)
+        yield name, case, frames, seconds
+
+def update_golden(names=None, golden_dir=GOLDEN_DIR, seed=0, work_dir=None):
+    """
+    Render the cases and store their frames as the golden outputs
+
+    Every case is saved as '<case>.npz' (compressed, one array per frame)
+    and its conversion time is stored in manifest.json as the timing baseline.
+
+    Returns:
+    dict: The manifest
+    """
+    names = names or list(CASES)
+    os.makedirs(golden_dir, exist_ok=True)
+    manifest_path = os.path.join(golden_dir, 'manifest.json')
+    manifest = {'cases': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    manifest.update(created=datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                    numpy=np.__version__, seed=seed)
+
+    with tempfile.TemporaryDirectory(prefix='golden_', dir=work_dir) as temp_dir:
+        for name, case, frames, seconds in _run_cases(names, temp_dir, seed):
+            np.savez_compressed(os.path.join(golden_dir, f'{name}.npz'), **frames)
+            manifest['cases'][name] = {'case': case, 'frames': sorted(frames), 'seconds': seconds}
+            print(f"{name:<28} {len(frames)} frames  {seconds:7.3f}s")
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Golden outputs saved to {golden_dir}")
+    return manifest
+
+def check_golden(names=None, golden_dir=GOLDEN_DIR, tolerances=None, max_slowdown=None, results_path=None,
+                 work_dir=None):
+    """
+    Render the cases and compare them with the golden outputs
+
+    Every frame is compared with compare_png's MAE, RMSE, correlation and
+    ratio of significantly different pixels against the tolerances of its
+    engine; the conversion time is reported against the golden timing.
+
+    Parameters:
+    names (list): Cases to check (default: all cases with golden outputs)
+    golden_dir (str): Directory of the golden outputs (see update_golden)
+    tolerances (dict): Overrides for TOLERANCES, per engine
+    max_slowdown (float): Also fail a case slower than this factor of its golden
+        timing (None: timing is only reported)
+    results_path (str): Also write the report as JSON to this path
+
+    Returns:
+    dict: Per case: passed, seconds, speedup and the worst frame metrics
+    """
+    with open(os.path.join(golden_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    names = names or [name for name in CASES if name in manifest['cases']]
+    tolerances = {engine: {**TOLERANCES[engine], **(tolerances or {}).get(engine, {})} for engine in TOLERANCES}
+
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='regression_', dir=work_dir) as temp_dir:
+        for name, case, frames, seconds in _run_cases(names, temp_dir, manifest.get('seed', 0)):
+            tolerance = tolerances[case['engine']]
+            with np.load(os.path.join(golden_dir, f'{name}.npz')) as golden:
+                expected = {key: golden[key] for key in golden.files}
+            failures = sorted(set(expected) ^ set(frames))
+            worst = None
+            for key in sorted(set(expected) & set(frames)):
+                metrics = frame_metrics(expected[key], frames[key])
+                if not within_tolerance(metrics, tolerance):
+                    failures.append(key)
+                if metrics is not None and (worst is None or metrics['MAE'] > worst['MAE']):
+                    worst = metrics
+            golden_seconds = manifest['cases'][name].get('seconds')
+            speedup = golden_seconds / seconds if golden_seconds and seconds > 0 else None
+            slow = max_slowdown is not None and speedup is not None and speedup < 1 / max_slowdown
+            report[name] = {'passed': not failures and not slow, 'failed_frames': failures, 'frames': len(frames),
+                            'seconds': seconds, 'golden_seconds': golden_seconds, 'speedup': speedup,
+                            'worst': worst}
+            status = 'ok' if report[name]['passed'] else 'FAILED'
+            mae = f"{worst['MAE']:.5f}" if worst else '-'
+            speed = f"{speedup:5.2f}x" if speedup else '-'
+            print(f"{name:<28} {status:<6} {len(frames):>2} frames  max MAE {mae}  "
+                  f"{seconds:7.3f}s ({speed} vs golden)")
+            if failures:
+                print(f"  differing or missing frames: {', '.join(failures)}")
+
+    if results_path is not None:
+        with open(results_path, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'cases': report}, f, indent=2)
+    failed = [name for name, result in report.items() if not result['passed']]
+    print(f"{len(report) - len(failed)}/{len(report)} cases passed")
+    return report
+
+# Command lines of cli.py run on the radar sample, and the equivalent run
+# they must reproduce frame for frame
+CLI_CASES = {
+    'nc_shared_memory': (['nc', '{input}', '{output}', '--engine', 'raster', '--size', '256', '--format', 'npy',
+                          '--workers', '2', '--shared-memory'],
+                         ['nc', '{input}', '{output}', '--engine', 'raster', '--size', '256', '--format', 'npy']),
+    'nc_shared_memory_mask': (['nc', '{input}', '{output}', '--engine', 'raster', '--size', '256', '--format',
+                               'npy', '--workers', '2', '--shared-memory', '--threshold', '5', '--mask-output'],
+                              ['nc', '{input}', '{output}', '--engine', 'raster', '--size', '256', '--format',
+                               'npy', '--threshold', '5', '--mask-output']),
+}
+
+def check_cli(names=None, work_dir=None):
+    """
+    Run the CLI_CASES command lines through cli.main and compare their
+    outputs with the reference command line of each case
+
+    Returns:
+    dict: Per case: passed and the differing or missing output files
+    """
+    import cli
+
+    names = names or list(CLI_CASES)
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='cli_', dir=work_dir) as temp_dir:
+        for name in names:
+            outputs = []
+            for run, argv in enumerate(CLI_CASES[name]):
+                output_dir = os.path.join(temp_dir, f'{name}_{run}')
+                try:
+                    cli.main([arg.format(input=SAMPLE_RADAR, output=output_dir) for arg in argv]
+                             + ['--verbosity', 'warning'])
+                except (Exception, SystemExit) as e:
+                    print(f"  {' '.join(argv)}: {type(e).__name__}: {e}")
+                    outputs.append(None)
+                    continue
+                outputs.append({file_name: np.load(os.path.join(output_dir, file_name))
+                                for file_name in sorted(os.listdir(output_dir)) if file_name.endswith('.npy')})
+            current, expected = outputs
+            if current is None or expected is None:
+                failures = ['<command failed>']
+            else:
+                failures = sorted(set(current) ^ set(expected))
+                failures += [key for key in sorted(set(current) & set(expected))
+                             if not np.array_equal(current[key], expected[key])]
+            passed = not failures and bool(current)
+            report[name] = {'passed': passed, 'failed_outputs': failures}
+            print(f"{name:<28} {'ok' if passed else 'FAILED':<6} {len(current or {})} outputs")
+            if failures:
+                print(f"  differing or missing outputs: {', '.join(failures)}")
+    failed = [name for name, result in report.items() if not result['passed']]
+    print(f"{len(report) - len(failed)}/{len(report)} CLI cases passed")
+    return report
+
+if __name__ == "__main__":
+    # Usage: python regression.py check | update | cli | baseline [case ...]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    cases = sys.argv[2:] or None
+    if command == 'update':
+        update_golden(cases)
+    elif command == 'baseline':
+        results = check_baseline(cases)
+        sys.exit(0 if all(result['passed'] for result in results.values()) else 1)
+    elif command == 'cli':
+        results = check_cli(cases)
+        sys.exit(0 if all(result['passed'] for result in results.values()) else 1)
+    else:
+        results = check_golden(cases)
+        if cases is None:
+            results.update(check_baseline())
+        sys.exit(0 if all(result['passed'] for result in results.values()) else 1)
@@ -0,0 +1,382 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+class AggRenderer:
+    """
+    Borderless pcolormesh renderer that reuses one Agg canvas for every frame
+
+    The figure is created once without pyplot. Frames that share the
+    geometry of the previous frame only replace the QuadMesh array data
+    (and the color limits), so the mesh is not rebuilt. Images are rendered
+    to memory and encoded as PNG with PIL, without a second draw.
+
+    Like savefig(bbox_inches='tight', pad_inches=0), the image is cropped
+    to the data: when the aspect shrinks the axes (e.g. a sector sweep
+    with aspect 'equal'), the figure is resized to the axes box once per
+    geometry, so it keeps the width and height of the data extent.
+
+    Parameters:
+    figsize (tuple): Figure size in inches
+    dpi (int): Resolution in dots per inch
+    cmap (str): Colormap name
+    facecolor (str): Background color where data is missing
+    aspect (str): Axes aspect ('equal' for radar sweeps, 'auto' for lat/lon grids)
+    """
+    def __init__(self, figsize=(10, 10), dpi=300, cmap='Greys_r', facecolor='black', aspect='equal'):
+        self.cmap = cmap
+        self.facecolor = facecolor
+        self.aspect = aspect
+        self.figsize = figsize
+        self.figure = Figure(figsize=figsize, dpi=dpi, facecolor=facecolor)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_axes([0, 0, 1, 1])
+        self._reset_axes()
+
+    def _reset_axes(self):
+        if tuple(self.figure.get_size_inches()) != tuple(self.figsize):
+            self.figure.set_size_inches(self.figsize)
+            self.ax.set_position([0, 0, 1, 1])
+        self.ax.cla()
+        self.ax.set_axis_off()
+        self.ax.set_facecolor(self.facecolor)
+        self.ax.set_aspect(self.aspect)
+        self.ax.margins(0, 0)
+        self._mesh = None
+        self._x = None
+        self._y = None
+        self._geometry_key = None
+
+    def _same_geometry(self, x, y, geometry_key):
+        if self._mesh is None:
+            return False
+        if geometry_key is not None:
+            return geometry_key == self._geometry_key
+        if x is self._x and y is self._y:
+            return True
+        return (x.shape == self._x.shape and y.shape == self._y.shape
+                and np.array_equal(x, self._x) and np.array_equal(y, self._y))
+
+    def draw(self, x, y, data, norm=None, vmin=None, vmax=None, geometry_key=None):
+        """
+        Rasterize one frame on the canvas
+
+        Parameters:
+        x (numpy.ndarray): Cell center x coordinates, same shape as data
+        y (numpy.ndarray): Cell center y coordinates, same shape as data
+        data (numpy.ndarray): Values to draw
+        norm (matplotlib.colors.Normalize): Normalization (overrides vmin/vmax)
+        vmin (float): Lower color limit
+        vmax (float): Upper color limit
+        geometry_key (hashable): Identifies the geometry (e.g. sweep shape and
+            azimuths); if omitted, x and y are compared with the previous frame
+        """
+        if self._same_geometry(x, y, geometry_key):
+            self._mesh.set_array(data)
+            if norm is not None:
+                self._mesh.set_norm(norm)
+            else:
+                self._mesh.set_clim(vmin, vmax)
+        else:
+            self._reset_axes()
+            self._mesh = self.ax.pcolormesh(x, y, data, cmap=self.cmap, norm=norm,
+                                            vmin=None if norm is not None else vmin,
+                                            vmax=None if norm is not None else vmax,
+                                            shading='auto')
+            self._x, self._y, self._geometry_key = x, y, geometry_key
+            self._fit_figure()
+        self.canvas.draw()
+
+    def _fit_figure(self):
+        # Shrink the figure to the axes box left by the aspect, as the tight
+        # bbox of savefig does (the canvas truncates to whole pixels)
+        self.ax.apply_aspect()
+        width, height = self.ax.get_position().size
+        if width < 1 or height < 1:
+            fig_width, fig_height = self.figsize
+            self.figure.set_size_inches(fig_width * width, fig_height * height)
+            self.ax.set_position([0, 0, 1, 1])
+
+    def to_array(self):
+        """
+        Copy of the rendered RGBA pixels, shape (height, width, 4)
+        """
+        return np.array(self.canvas.buffer_rgba())
+
+    def to_gray(self):
+        """
+        Rendered frame as a 2D uint8 array (the colormap is grayscale)
+        """
+        return np.array(np.asarray(self.canvas.buffer_rgba())[:, :, 0])
+
+    def to_png(self, compress_level=6):
+        """
+        Encode the rendered frame as PNG bytes
+        """
+        width, height = self.canvas.get_width_height()
+        image = Image.frombuffer('RGBA', (width, height), self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=compress_level)
+        return buffer.getvalue()
+
+# Azimuth resolution of the polar index maps (0.01 degree)
+AZIMUTH_BINS = 36000
+
+class RasterRenderer:
+    """
+    Direct grayscale rasterizer, the fast alternative to AggRenderer
+
+    Values are mapped linearly from [vmin, vmax] to 0..255 (missing values
+    are 0, i.e. black like the matplotlib background) and placed on the
+    output image with a nearest-neighbour index map. Index maps depend only
+    on the geometry and are cached, so a frame costs one lookup pass.
+
+    Parameters:
+    size (int or tuple): Output image size in pixels (width, height)
+    cache_size (int): Number of index maps kept
+    """
+    def __init__(self, size=1024, cache_size=16):
+        self.size = (size, size) if np.isscalar(size) else tuple(size)
+        self.cache_size = cache_size
+        self._index_maps = OrderedDict()
+        self._last_map = None
+        self.image = None
+
+    def _cached(self, key, build):
+        index_map = self._index_maps.get(key)
+        if index_map is None:
+            index_map = build()
+            self._index_maps[key] = index_map
+            if len(self._index_maps) > self.cache_size:
+                self._index_maps.popitem(last=False)
+        else:
+            self._index_maps.move_to_end(key)
+        return index_map
+
+    def polar_index_map(self, azimuths, ranges):
+        """
+        Flat (ray, gate) index of every output pixel of a sweep, -1 outside the sweep
+
+        The image covers [-R, R] km in both directions (north up), where R is
+        the outer edge of the last gate. The per-pixel gate and azimuth bin
+        (0.01 degree) only depend on the ranges and are cached; the nearest
+        ray of every azimuth bin is looked up per sweep, because ray
+        azimuths vary slightly from sweep to sweep.
+
+        Parameters:
+        azimuths (numpy.ndarray): Ray azimuths in degrees
+        ranges (numpy.ndarray): Gate center ranges in meters (increasing)
+
+        Returns:
+        numpy.ndarray: int64 array with shape (height, width)
+        """
+        key = ('polar', self.size, azimuths.tobytes(), ranges.tobytes())
+        return self._cached(key, lambda: self._build_polar_index_map(azimuths, ranges))
+
+    def _polar_pixels(self, ranges):
+        width, height = self.size
+        ranges = np.asarray(ranges, dtype=np.float64)
+        half_gate = (ranges[1] - ranges[0]) / 2 if len(ranges) > 1 else ranges[0]
+        edges = np.concatenate([[ranges[0] - half_gate], (ranges[:-1] + ranges[1:]) / 2, [ranges[-1] + half_gate]])
+        max_range = edges[-1]
+
+        x = (np.arange(width) + 0.5) * (2 * max_range / width) - max_range
+        y = max_range - (np.arange(height) + 0.5) * (2 * max_range / height)
+        xx, yy = np.meshgrid(x, y)
+        r = np.hypot(xx, yy)
+        az = np.degrees(np.arctan2(xx, yy)) % 360
+
+        gate = np.searchsorted(edges, r, side='right') - 1
+        gate[gate >= len(ranges)] = -1
+        az_bin = (az * (AZIMUTH_BINS / 360)).astype(np.int32) % AZIMUTH_BINS
+        return gate, az_bin
+
+    def _build_polar_index_map(self, azimuths, ranges):
+        gate, az_bin = self._cached(('polar_pixels', self.size, ranges.tobytes()), lambda: self._polar_pixels(ranges))
+
+        # Nearest ray of every azimuth bin center, taking the 0/360 wrap into account
+        bin_az = (np.arange(AZIMUTH_BINS) + 0.5) * (360 / AZIMUTH_BINS)
+        order = np.argsort(azimuths)
+        sorted_az = np.asarray(azimuths, dtype=np.float64)[order]
+        padded = np.concatenate([[sorted_az[-1] - 360], sorted_az, [sorted_az[0] + 360]])
+        pos = np.clip(np.searchsorted(padded, bin_az), 1, len(padded) - 1)
+        nearest = np.where(bin_az - padded[pos - 1] <= padded[pos] - bin_az, pos - 1, pos)
+        ray_of_bin = order[(nearest - 1) % len(sorted_az)]
+
+        return np.where(gate >= 0, ray_of_bin[az_bin] * len(ranges) + gate, -1)
+
+    def to_levels(self, data, vmin, vmax):
+        """
+        Map values to 0..255 gray levels, NaN to 0
+        """
+        if vmax <= vmin:
+            return np.zeros(np.shape(data), dtype=np.uint8)
+        scaled = (np.asarray(data, dtype=np.float64) - vmin) * (255.0 / (vmax - vmin))
+        levels = np.clip(np.nan_to_num(scaled, nan=0.0), 0, 255).astype(np.uint8)
+        return levels
+
+    def draw_polar(self, azimuths, ranges, data, vmin=-20, vmax=80, profile=None):
+        """
+        Rasterize a sweep with shape (rays, gates)
+
+        With a NormalizationProfile the gray levels come from its lookup
+        table instead of vmin/vmax.
+        """
+        index_map = self.polar_index_map(azimuths, ranges)
+        levels = profile.apply(data) if profile is not None else self.to_levels(data, vmin, vmax)
+        # Append a black level for pixels outside the sweep (index -1)
+        levels = np.append(levels.ravel(), np.uint8(0))
+        self.image = levels[index_map]
+        self._last_map = ('polar', index_map)
+
+    def draw_grid(self, data, vmin=None, vmax=None, log=False, profile=None):
+        """
+        Rasterize a regular grid whose first row is the northern edge
+
+        The grid is resampled to the output size with a nearest-neighbour
+        index map; log=True maps log(value) instead (values <= vmin are 0).
+        A NormalizationProfile replaces vmin, vmax and log.
+        """
+        data = np.asarray(data)
+        if profile is not None:
+            levels = profile.apply(data)
+        elif log:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                levels = self.to_levels(np.where(data > vmin, np.log(data), np.nan), np.log(vmin), np.log(vmax))
+        else:
+            levels = self.to_levels(data, vmin, vmax)
+
+        ny, nx = data.shape
+        width, height = self.size
+        if (nx, ny) == (width, height):
+            self.image = levels
+            self._last_map = ('identity',)
+            return
+        rows, cols = self._cached(('grid', self.size, data.shape), lambda: (
+            ((np.arange(height) + 0.5) * ny / height).astype(np.int64)[:, None],
+            ((np.arange(width) + 0.5) * nx / width).astype(np.int64)[None, :],
+        ))
+        self.image = levels[rows, cols]
+        self._last_map = ('grid', rows, cols)
+
+    def rasterize_mask(self, mask):
+        """
+        Map a boolean mask of the last drawn data onto the output image
+
+        Uses the index map of the last draw, so the mask is pixel-aligned
+        with the image; pixels outside the data (beyond the last gate) are
+        masked.
+        """
+        if self._last_map is None:
+            raise RuntimeError("rasterize_mask needs a previous draw")
+        kind = self._last_map[0]
+        if kind == 'polar':
+            return np.append(np.asarray(mask, dtype=bool).ravel(), True)[self._last_map[1]]
+        if kind == 'grid':
+            return np.asarray(mask, dtype=bool)[self._last_map[1], self._last_map[2]]
+        return np.asarray(mask, dtype=bool)
+
+    def to_gray(self):
+        return self.image
+
+    def to_png(self, compress_level=6):
+        """
+        Encode the rendered frame as a grayscale PNG
+        """
+        buffer = io.BytesIO()
+        Image.fromarray(self.image).save(buffer, format='PNG', compress_level=compress_level)
+        return buffer.getvalue()
+
+ENGINES = ('agg', 'raster')
+OUTPUT_FORMATS = ('png', 'npy')
+
+def encode_frame(renderer, output_format='png'):
+    """
+    Encode the frame held by a renderer
+
+    Parameters:
+    renderer (AggRenderer or RasterRenderer): Renderer after draw
+    output_format (str): 'png' image or 'npy' 2D uint8 gray array
+
+    Returns:
+    bytes: Encoded frame
+    """
+    if output_format == 'png':
+        return renderer.to_png()
+    if output_format == 'npy':
+        buffer = io.BytesIO()
+        np.save(buffer, renderer.to_gray())
+        return buffer.getvalue()
+    raise ValueError(f"Unknown output format: {output_format}")
+
+# PIL modes of 1 to 4 channel uint8 images
+IMAGE_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
+
+def encode_image(image, output_format='png', compress_level=6):
+    """
+    Encode a uint8 (height, width) or (height, width, channels) array
+
+    Parameters:
+    image (numpy.ndarray): Gray image or stacked channels
+    output_format (str): 'png' (1 to 4 channels, as L/LA/RGB/RGBA) or 'npy'
+
+    Returns:
+    bytes: Encoded image
+    """
+    buffer = io.BytesIO()
+    if output_format == 'png':
+        channels = 1 if image.ndim == 2 else image.shape[-1]
+        if channels not in IMAGE_MODES:
+            raise ValueError(f"A PNG holds 1 to 4 channels, got {channels}")
+        Image.fromarray(image.reshape(image.shape[:2]) if channels == 1 else image,
+                        mode=IMAGE_MODES[channels]).save(buffer, format='PNG', compress_level=compress_level)
+    elif output_format == 'npy':
+        np.save(buffer, image)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return buffer.getvalue()
+
+def write_atomic(output_path, data):
+    """
+    Write bytes to a temporary file and rename it, so that an interrupted
+    run never leaves a partially written output behind
+    """
+    temp_path = f"{output_path}.tmp{os.getpid()}"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+
+_local = threading.local()
+
+def get_renderer(engine='agg', **config):
+    """
+    Return the renderer of the calling thread for this configuration
+
+    Matplotlib is not thread-safe, so every thread (and every worker
+    process) keeps its own canvas (and index map cache) per configuration.
+
+    Parameters:
+    engine (str): 'agg' or 'raster'
+    **config: AggRenderer or RasterRenderer arguments
+
+    Returns:
+    AggRenderer or RasterRenderer: Cached renderer
+    """
+    renderers = getattr(_local, 'renderers', None)
+    if renderers is None:
+        renderers = _local.renderers = {}
+    key = (engine,) + tuple(sorted(config.items()))
+    if key not in renderers:
+        if engine == 'agg':
+            renderers[key] = AggRenderer(**config)
+        elif engine == 'raster':
+            renderers[key] = RasterRenderer(**config)
+        else:
+            raise ValueError(f"Unknown rendering engine: {engine} (choose from {', '.join(ENGINES)})")
+    return renderers[key]
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+class SharedArray:
+    """
+    Picklable handle of an array in a shared memory block
+
+    Only the block name, shape and dtype are sent to a worker; the worker
+    maps the block with attach() instead of receiving the data.
+    """
+    __slots__ = ('name', 'shape', 'dtype')
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype.str
+
+    def __setstate__(self, state):
+        self.name, self.shape, dtype = state
+        self.dtype = np.dtype(dtype)
+
+    def __repr__(self):
+        return f"SharedArray({self.name!r}, shape={self.shape}, dtype={self.dtype})"
+
+# Whether this process started its own resource tracker (spawned workers)
+# rather than sharing the tracker of the pool owner (forked workers)
+_own_tracker = None
+
+def _untrack(shm):
+    # Before Python 3.13, attaching registers the block with the resource
+    # tracker, and a tracker of its own would unlink the block when the
+    # worker exits; a shared tracker must keep the registration of the owner
+    if _own_tracker:
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+# Blocks mapped by this process (worker side), most recently used last
+_attached = OrderedDict()
+MAX_ATTACHED = 8
+
+def attach(handle):
+    """
+    Zero-copy read-only view of a shared array, in any process
+
+    The mapping of a block is kept open and reused, so the pool recycling
+    a block for the next volume costs no new mapping.
+
+    Parameters:
+    handle (SharedArray): Handle received from the pool owner
+
+    Returns:
+    numpy.ndarray: Read-only array backed by the shared block
+    """
+    global _own_tracker
+    shm = _attached.get(handle.name)
+    if shm is None:
+        if _own_tracker is None:
+            _own_tracker = getattr(resource_tracker._resource_tracker, '_fd', None) is None
+        shm = shared_memory.SharedMemory(name=handle.name)
+        _untrack(shm)
+        _attached[handle.name] = shm
+        while len(_attached) > MAX_ATTACHED:
+            _, old = _attached.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:  # a view is still alive, the mapping goes with it
+                pass
+    else:
+        _attached.move_to_end(handle.name)
+    array = np.ndarray(handle.shape, dtype=handle.dtype, buffer=shm.buf)
+    array.flags.writeable = False
+    return array
+
+class SharedBufferPool:
+    """
+    Pool of shared memory blocks for handing decoded arrays to worker processes
+
+    The owner (reader) process copies a decoded array into a block once
+    with put(); workers receive the small SharedArray handle and map the
+    block with attach(). Every handle carries a reference count (e.g. one
+    per render task); when release() brings it to zero the block goes
+    back to the pool and is reused for the next array that fits, so
+    blocks are not created and unlinked for every volume.
+
+    Parameters:
+    max_free_blocks (int): Number of released blocks kept for reuse; further
+        released blocks are unlinked
+    """
+    def __init__(self, max_free_blocks=4):
+        self.max_free_blocks = max_free_blocks
+        self._free = []
+        self._used = {}
+
+    def put(self, array, refs=1):
+        """
+        Copy an array into a shared block
+
+        Parameters:
+        array (numpy.ndarray): Array to share
+        refs (int): Initial reference count (number of release() calls
+            before the block is recycled)
+
+        Returns:
+        SharedArray: Handle to send to workers
+        """
+        array = np.ascontiguousarray(array)
+        shm = self._allocate(array.nbytes)
+        handle = SharedArray(shm.name, array.shape, array.dtype)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self._used[shm.name] = [shm, refs]
+        return handle
+
+    def _allocate(self, nbytes):
+        fitting = [shm for shm in self._free if shm.size >= nbytes]
+        if fitting:
+            shm = min(fitting, key=lambda block: block.size)
+            self._free.remove(shm)
+            return shm
+        return shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+
+    def view(self, handle):
+        """
+        Writable view of a block in the owner process
+        """
+        shm = self._used[handle.name][0]
+        return np.ndarray(handle.shape, dtype=handle.dtype, buffer=shm.buf)
+
+    def acquire(self, handle, count=1):
+        """
+        Add references to a block
+        """
+        self._used[handle.name][1] += count
+
+    def release(self, handle, count=1):
+        """
+        Drop references to a block; at zero it is recycled (or unlinked)
+
+        Returns:
+        int: Remaining references
+        """
+        entry = self._used[handle.name]
+        entry[1] -= count
+        if entry[1] > 0:
+            return entry[1]
+        shm = self._used.pop(handle.name)[0]
+        if len(self._free) < self.max_free_blocks:
+            self._free.append(shm)
+        else:
+            self._unlink(shm)
+        return 0
+
+    @property
+    def in_use(self):
+        """
+        Number of blocks with live references
+        """
+        return len(self._used)
+
+    @property
+    def nbytes(self):
+        """
+        Total size of the blocks owned by the pool (used and free)
+        """
+        return sum(shm.size for shm, _ in self._used.values()) + sum(shm.size for shm in self._free)
+
+    @staticmethod
+    def _unlink(shm):
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """
+        Unlink every block, including blocks still referenced
+        """
+        for shm, _ in self._used.values():
+            self._unlink(shm)
+        for shm in self._free:
+            self._unlink(shm)
+        self._used.clear()
+        self._free.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
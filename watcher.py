@@ -0,0 +1,252 @@
+import os
+import time
+import asyncio
+import fnmatch
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from instrumentation import RunRecorder, _run_recorded
+from normalization import get_profile
+
+WATCH_PATTERNS = ('*.nc', '*.grib2', '*.grb2')
+# Names of files still being written by downloaders and write_atomic
+PARTIAL_PATTERNS = ('.*', '*.tmp', '*.tmp[0-9]*', '*.part', '*.crdownload')
+
+def _warm_worker():
+    # Import the converters (xarray, pygrib, matplotlib) before the first file arrives
+    import nc_to_png_all
+    import grib2_to_png
+
+def convert_arrival(file_path, recorder=None, output_dir='.', variable='DBZH', message=1, bbox=None,
+                    grid_shape=None, size=None, **options):
+    """
+    Convert one newly arrived NC or GRIB2 file with the batch converters
+
+    Parameters:
+    file_path (str): NC or GRIB2 file
+    recorder (RunRecorder): Collects stage timings and log events
+    output_dir (str): Directory for the generated images
+    variable (str): NetCDF variable to convert
+    message (int): GRIB2 message number
+    bbox (tuple): GRIB2 lat/lon window
+    grid_shape (tuple): GRIB2 bbox grid shape
+    size (int): Raster image size (None: converter default, 1024 for NetCDF, 2400 for GRIB2)
+    **options: Rendering options shared by radar_to_cartesian and grib2_to_png
+
+    Returns:
+    list: Generated files
+    """
+    if size is not None:
+        options['size'] = size
+    if file_path.endswith('.nc'):
+        from nc_to_png_all import radar_to_cartesian
+        return radar_to_cartesian(file_path, output_dir, variable, recorder=recorder, **options)
+    from grib2_to_png import _grib2_to_dir
+    output_path = _grib2_to_dir(file_path, output_dir, recorder=recorder, message=message, bbox=bbox,
+                                grid_shape=grid_shape, **options)
+    # None when the conversion failed (already logged)
+    return [output_path] if output_path is not None else []
+
+class DirectoryWatcher:
+    """
+    Poll a directory for new NC/GRIB2 files and report them once they are complete
+
+    Every poll is one os.scandir pass; the (size, mtime) of the entries
+    are kept in a stat cache, and a file is reported when its size and
+    mtime have not changed for settle seconds (so files still being copied
+    or downloaded are not converted half-written). Temporary names
+    (PARTIAL_PATTERNS) are ignored.
+
+    Parameters:
+    input_dir (str): Directory to watch
+    patterns (tuple): File name patterns to convert
+    recursive (bool): Also watch subdirectories
+    settle (float): Seconds a file must stay unchanged before it is reported
+    process_existing (bool): Report the files already present at start
+    """
+    def __init__(self, input_dir, patterns=WATCH_PATTERNS, recursive=False, settle=0.5, process_existing=False):
+        self.input_dir = input_dir
+        self.patterns = patterns
+        self.recursive = recursive
+        self.settle = settle
+        self._stats = {}
+        self._done = set()
+        if not process_existing:
+            self._done.update(self.scan())
+
+    def _wanted(self, name):
+        if any(fnmatch.fnmatch(name, pattern) for pattern in PARTIAL_PATTERNS):
+            return False
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    def scan(self):
+        """
+        Current (size, mtime_ns) of the watched files
+        """
+        stats = {}
+        directories = [self.input_dir]
+        while directories:
+            try:
+                entries = list(os.scandir(directories.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if self.recursive:
+                            directories.append(entry.path)
+                    elif self._wanted(entry.name):
+                        stat = entry.stat()
+                        stats[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                except FileNotFoundError:  # removed between scandir and stat
+                    continue
+        return stats
+
+    def poll(self, now=None):
+        """
+        Files that became complete since the last poll
+
+        Returns:
+        list: (path, first_seen) of the settled files, oldest first
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        current = self.scan()
+        for path, stat in current.items():
+            if path in self._done:
+                continue
+            cached = self._stats.get(path)
+            if cached is None or cached[0] != stat:
+                # New or still growing; first_seen is kept to measure the latency
+                first_seen = cached[2] if cached is not None else now
+                self._stats[path] = (stat, now, first_seen)
+            elif now - cached[1] >= self.settle and stat[0] > 0:
+                ready.append((path, cached[2]))
+        for path, _ in ready:
+            self._done.add(path)
+            del self._stats[path]
+        # Forget files that were removed
+        for path in set(self._stats) - set(current):
+            del self._stats[path]
+        self._done &= set(current)
+        return sorted(ready, key=lambda item: item[1])
+
+async def watch(input_dir, output_dir, workers=1, recorder=None, poll_interval=0.2, settle=0.5,
+                process_existing=False, recursive=False, stop=None, max_files=None, **options):
+    """
+    Convert files as they arrive in a directory, until stopped
+
+    Completed files are submitted to an executor created once for the
+    whole watch: a single thread for workers=1, otherwise a process pool
+    whose workers import the converters at start. The executor (and the
+    per-thread renderers with their geometry and index map caches) stays
+    warm between arrivals, so a new volume only pays for its own decoding
+    and rendering. Polling continues while files are being converted.
+
+    Parameters:
+    input_dir (str): Directory to watch
+    output_dir (str): Directory for the generated images
+    workers (int): Number of worker processes (1: one conversion thread)
+    recorder (RunRecorder): Collects stage timings and log events (default: new recorder)
+    poll_interval (float): Seconds between two directory scans
+    settle (float): Seconds a file must stay unchanged before it is converted
+    process_existing (bool): Also convert the files present at start
+    recursive (bool): Also watch subdirectories
+    stop (asyncio.Event): Stop watching when set (pending conversions are finished)
+    max_files (int): Stop after converting this many files
+    **options: Options of convert_arrival (variable, message, bbox, engine, size, profile, ...)
+
+    Returns:
+    list: Generated files
+    """
+    recorder = recorder or RunRecorder()
+    os.makedirs(output_dir, exist_ok=True)
+    # Load a saved profile once instead of for every file
+    if options.get('profile') is not None:
+        options['profile'] = get_profile(options['profile'])
+    options['output_dir'] = output_dir
+    watcher = DirectoryWatcher(input_dir, recursive=recursive, settle=settle, process_existing=process_existing)
+    recorder.log('info', 'watch', message=f"Watching {input_dir} (every {poll_interval}s, settle {settle}s)",
+                 input_dir=input_dir, output_dir=output_dir, workers=workers)
+
+    loop = asyncio.get_running_loop()
+    if workers <= 1:
+        executor = ThreadPoolExecutor(max_workers=1, initializer=_warm_worker)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker)
+    # Executors start their threads/processes on the first submit, so warm them up now
+    for _ in range(max(1, workers)):
+        executor.submit(int)
+    generated_files = []
+    converted = 0
+    failed = 0
+    pending = set()
+
+    async def convert(path, first_seen):
+        nonlocal converted, failed
+        start = time.monotonic()
+        try:
+            if workers <= 1:
+                outputs = await loop.run_in_executor(executor, lambda: convert_arrival(path, recorder, **options))
+            else:
+                outputs, state = await loop.run_in_executor(executor, _run_recorded, convert_arrival, path,
+                                                            recorder.config, recorder.writes_events, options)
+                recorder.merge(state)
+        except Exception as e:
+            recorder.exception('file_failed', e, message=f"Error processing {path}", file=path)
+            failed += 1
+            return
+        if not outputs:
+            # The converters log their errors and return no outputs
+            recorder.log('warning', 'file_failed', message=f"No outputs generated for {path}", file=path)
+            failed += 1
+            return
+        generated_files.extend(outputs)
+        converted += 1
+        end = time.monotonic()
+        recorder.log('info', 'converted',
+                     message=f"Converted {path} in {end - start:.2f}s ({len(outputs)} outputs, "
+                             f"{end - first_seen:.2f}s after it was first seen)",
+                     file=path, outputs=len(outputs), convert_s=round(end - start, 6),
+                     latency_s=round(end - first_seen, 6))
+
+    try:
+        submitted = 0
+        while not (stop is not None and stop.is_set()):
+            if max_files is not None and submitted >= max_files:
+                break
+            for path, first_seen in watcher.poll():
+                if max_files is not None and submitted >= max_files:
+                    break
+                task = asyncio.create_task(convert(path, first_seen))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                submitted += 1
+            await asyncio.sleep(poll_interval)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        executor.shutdown(wait=True)
+    recorder.log('info', 'done', message=f"Stopped watching. {converted} files converted, {failed} failed, "
+                 f"{len(generated_files)} output files generated", files=converted, failed=failed,
+                 outputs=len(generated_files))
+    return generated_files
+
+def watch_directory(input_dir, output_dir, **options):
+    """
+    Blocking watch (see watch) that stops on Ctrl+C
+
+    Returns:
+    list: Generated files
+    """
+    recorder = options.setdefault('recorder', RunRecorder())
+    try:
+        generated_files = asyncio.run(watch(input_dir, output_dir, **options))
+    except KeyboardInterrupt:
+        recorder.log('info', 'done', message="Watch interrupted")
+        generated_files = []
+    recorder.print_summary()
+    return generated_files
+
+if __name__ == "__main__":
+    # Usage example
+    watch_directory('incoming', 'output', engine='raster', workers=2)